@@ -15,5 +15,12 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import sys
+
+if '--trace-startup' in sys.argv:
+    # Installed before the agent and its dependencies are imported, so their import times are recorded
+    from c8ydm.framework import startup
+    startup.install_import_timer()
+
 from c8ydm.main import start
 from c8ydm.main import stop
\ No newline at end of file
@@ -17,12 +17,16 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import io
+import json
 import logging
 import re
 import sys
+import time
 from typing import List, Optional
 from c8ydm.framework.smartrest import SmartRESTMessage
 from c8ydm.framework.modulebase import Listener
+from c8ydm.core import profiler
 from c8ydm.core.shell import CommandAlias, CommandAliasWithArgs, InvalidCommandError, CommandFailedError, CommandTimeoutError, TimeoutExpired
 class CommandHandler(Listener):
 
@@ -31,6 +35,7 @@ class CommandHandler(Listener):
     command_message_id = '511'
     _supported_commands = None
     timeout = 60
+    profile_usage = 'profile cpu|memory <seconds>'
 
     def _set_executing(self):
         executing = SmartRESTMessage('s/us', '501', [self.fragment])
@@ -107,6 +112,11 @@ class CommandHandler(Listener):
                     self._set_success_with_result('\n'.join(self._show_help()))
                     return
 
+                profile = re.match(r'^profile (cpu|memory) (\d+)$', raw_cmd)
+                if profile:
+                    self._profile(profile.group(1), int(profile.group(2)))
+                    return
+
                 resolved_cmd = self._resolve_command(raw_cmd)
 
                 if resolved_cmd:
@@ -156,7 +166,39 @@ class CommandHandler(Listener):
             List[str]: List of command usages
         """
         return [cmd.show_usage()
-                for cmd in self._supported_commands]
+                for cmd in self._supported_commands] + [self.profile_usage]
+
+    def _profile(self, kind: str, duration: int):
+        """Capture a CPU or memory profile of the running agent and upload it as
+        binary of a c8y_LogfileRequest event. The URL of the binary is the result of the
+        operation.
+
+        Args:
+            kind (str): cpu or memory
+            duration (int): Capture window in seconds
+        """
+        max_duration = self.agent.configuration.getIntValue('agent', 'profile.max.seconds', 110)
+        if duration <= 0 or duration > max_duration:
+            self._set_failed(f'Profile duration must be between 1 and {max_duration} seconds')
+            return
+        self.logger.info(f'Capturing {kind} profile for {duration} seconds')
+        try:
+            report = profiler.capture(kind, duration)
+        except RuntimeError as ex:
+            self._set_failed(f'{ex}')
+            return
+        name = f'{kind}-profile_{self.agent.serial}_{time.strftime("%Y%m%d-%H%M%S")}.txt'
+        files = {
+            'object': (None, json.dumps({'name': name, 'type': 'text/plain'})),
+            'file': (name, io.BytesIO(report.encode('utf8')), 'text/plain'),
+        }
+        mo_id = self.agent.rest_client.get_internal_id(self.agent.serial)
+        binaryurl = self.agent.rest_client.upload_event_logfile(mo_id, files)
+        if binaryurl:
+            self.logger.info(f'Uploaded {kind} profile to {binaryurl}')
+            self._set_success_with_result(binaryurl)
+        else:
+            self._set_failed(f'Could not upload {kind} profile')
 
     def _resolve_command(self, user_input: str) -> Optional[CommandAlias]:
         """Convert a command alias to its command equalivalent. If not match is found
@@ -219,4 +261,7 @@ class CommandHandler(Listener):
         return [self.fragment]
 
     def getSupportedTemplates(self):
-        return []
\ No newline at end of file
+        return []
+
+    def getHandledMessages(self):
+        return [('s/ds', self.command_message_id)]
\ No newline at end of file
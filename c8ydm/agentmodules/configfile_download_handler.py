@@ -40,6 +40,9 @@ class DownloadConfigfileInitializer(Initializer, Listener):
     def getSupportedTemplates(self):
         return []
 
+    def getHandledMessages(self):
+        return [('s/ds', '524')]
+
     def _set_executing(self):
         executing = SmartRESTMessage('s/us', '501', [self.fragment])
         #print("Executing MSG send")
@@ -39,6 +39,9 @@ class UploadConfigfileInitializer(Initializer, Listener):
     def getSupportedTemplates(self):
         return []
 
+    def getHandledMessages(self):
+        return [('s/ds', '526'), ('s/ds', '520')]
+
     def _set_executing(self):
         executing = SmartRESTMessage('s/us', '501', [self.fragment])
         self.agent.publishMessage(executing)
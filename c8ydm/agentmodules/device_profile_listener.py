@@ -110,4 +110,7 @@ class DeviceProfileListener(Listener):
     def getSupportedTemplates(self):
         return []
 
+    def getHandledMessages(self):
+        return [('s/ds', self.device_profiles_message_id)]
+
 
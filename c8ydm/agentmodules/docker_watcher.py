@@ -29,6 +29,22 @@ class DockerSensor(Sensor, Initializer, Listener):
     docker_watcher = DockerWatcher()
     fragment = 'c8y_Docker'
 
+    def _status(self, container_status):
+        if 'Up' in container_status:
+            return 'up'
+        elif 'Exited' in container_status:
+            return 'down'
+        return container_status
+
+    def _register(self, container):
+        # Known containers are neither registered again nor is an unchanged status sent
+        container_id = f'{self.serial}_{container["containerID"]}'
+        container_status = container['status']
+        if container_status:
+            self.agent.children.register_service(container_id, 'docker', container['name'],
+                                                 self._status(container_status))
+        return container_id
+
     def getSensorMessages(self):
         #self.logger.info(f'Docker Update Loop called...')
         payload = self.docker_watcher.get_stats()
@@ -42,21 +58,11 @@ class DockerSensor(Sensor, Initializer, Listener):
             for container in payload['c8y_Docker']:
                 try:
                     service_measurements = ['ResourceUsage','']
-                    container_id = f'{self.serial}_{container["containerID"]}'
-                    container_name = container['name']
-                    container_status = container['status']
+                    container_id = self._register(container)
                     container_cpu = float(container['cpu'])
                     container_memory = float(container['memory_perc'])
-                    #self.logger.info(f'Container found with name {container_name} id {container_id} status {container_status} cpu {container_cpu} memory {container_memory}')
-                    if container_status:
-                        if 'Up' in container_status:
-                            status = 'up'
-                        elif 'Exited' in container_status:
-                            status = 'down'
-                        else:
-                            status = container_status
-                        update_msg = SmartRESTMessage(f's/us/{container_id}', '104', [status])
-                        service_msgs.append(update_msg)
+                    if not self.agent.children.is_registered(container_id):
+                        continue
                     if container_cpu:
                         service_measurements.extend(['ResourceUsage', 'cpu', container_cpu, '%'])
                     if container_memory:
@@ -78,22 +84,9 @@ class DockerSensor(Sensor, Initializer, Listener):
             if self.agent.token_received.wait(timeout=self.agent.refresh_token_interval):
                 internal_id = self.agent.rest_client.get_internal_id(self.agent.serial)
                 self.agent.rest_client.update_managed_object(internal_id, json.dumps(payload))
-            service_msgs = []
             for container in payload['c8y_Docker']:
-                container_id = f'{self.serial}_{container["containerID"]}'
-                container_name = container['name']
-                container_status = container['status']
-                #self.logger.info(f'Container found with name {container_name} id {container_id} status {container_status}')
-                if container_status:
-                    if 'Up' in container_status:
-                        status = 'up'
-                    elif 'Exited' in container_status:
-                        status = 'down'
-                    else:
-                        status = container_status
-                    msg = SmartRESTMessage('s/us', '102', [container_id, 'docker', container_name, status])
-                    service_msgs.append(msg)
-        return service_msgs
+                self._register(container)
+        return []
     
     def _set_executing(self):
         executing = SmartRESTMessage('s/us', '501', [self.fragment])
@@ -146,4 +139,7 @@ class DockerSensor(Sensor, Initializer, Listener):
         return [self.fragment]
 
     def getSupportedTemplates(self):
-        return [self.xid]
\ No newline at end of file
+        return [self.xid]
+
+    def getHandledMessages(self):
+        return [('s/dc/' + self.xid, 'dm501')]
\ No newline at end of file
@@ -31,18 +31,6 @@ class FirmwareManagement(Listener, Initializer):
     fragment = 'c8y_Firmware'
     firmware_manager = FirmwareManager()
 
-    def group(self, seq, sep):
-        result = [[]]
-        for e in seq:
-            if sep not in str(e):
-                result[-1].append(e)
-            else:
-                result[-1].append(e[:e.find(sep)])
-                result.append([])
-        if result[-1] == []:
-            result.pop()
-        return result
-    
     def _set_executing(self):
         executing = SmartRESTMessage('s/us', '501', [self.fragment])
         self.agent.publishMessage(executing)
@@ -59,7 +47,7 @@ class FirmwareManagement(Listener, Initializer):
         try:
             is_simulated = self.agent.simulated
             if 's/ds' in message.topic and message.messageId == '515':
-                messages = self.group(message.values, '\n')[0]
+                messages = list(message.values)
                 deviceId = messages.pop(0)
                 self.logger.info('Firmware Update for device ' +
                                  deviceId + ' with message ' + str(messages))
@@ -91,7 +79,7 @@ class FirmwareManagement(Listener, Initializer):
                 """
             # Patch handling
             if 's/ds' in message.topic and message.messageId == '525':
-                messages = self.group(message.values, '\n')[0]
+                messages = list(message.values)
                 deviceId = messages.pop(0)
                 self.logger.info('Firmware Patch for device ' +
                                  deviceId + ' with message ' + str(messages))
@@ -117,6 +105,9 @@ class FirmwareManagement(Listener, Initializer):
     def getSupportedTemplates(self):
         return []
 
+    def getHandledMessages(self):
+        return [('s/ds', '515'), ('s/ds', '525')]
+
     def getMessages(self):
         #TODO Check current Firmware version, Update Operation, Update Fragment
         return self.get_firmware_msg()
@@ -37,6 +37,9 @@ class LogfileInitializer(Initializer, Listener):
     def getSupportedTemplates(self):
         return []
 
+    def getHandledMessages(self):
+        return [('s/ds', '522')]
+
     def _set_executing(self):
         executing = SmartRESTMessage('s/us', '501', [self.fragment])
         #print("Executing MSG send")
@@ -32,6 +32,10 @@ class Network(Initializer):
     xid = 'c8y-dm-agent-v1.0'
     def_adapter = None
 
+    def getDependencies(self):
+        # dm100 is defined by the SmartREST template uploaded by SmartRestInitializer
+        return ['SmartRestInitializer']
+
     def getMessages(self):
         net_msg = None
         pos_msg = None
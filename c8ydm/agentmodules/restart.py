@@ -17,6 +17,7 @@ limitations under the License.
 """
 import logging, time, json, time
 import subprocess
+from c8ydm.framework.journal import DONE
 from c8ydm.framework.modulebase import Listener, Initializer
 from c8ydm.framework.smartrest import SmartRESTMessage
 import os
@@ -30,11 +31,15 @@ class Restart(Listener, Initializer):
             executing = SmartRESTMessage('s/us', '501', ['c8y_Restart'])
             self.agent.publishMessage(executing)
             try:
+                # The restart is reported as successful when the agent comes back
+                self.checkpoint(DONE)
                 if self.agent.simulated:
                     process = subprocess.Popen(["docker","restart",self.serial],stdout=subprocess.PIPE, stderr=subprocess.PIPE)
                     process.wait()
                 else:
-                    os.system('shutdown -r 1')
+                    result = os.system('shutdown -r 1')
+                    if result != 0:
+                        raise Exception(f'shutdown exited with {result}')
 
             except Exception as e:
                 failed = SmartRESTMessage('s/us', '502', ['c8y_Restart', 'Error during Restart:' + str(e)])
@@ -46,6 +51,12 @@ class Restart(Listener, Initializer):
     def getSupportedTemplates(self):
         return []
 
+    def getHandledMessages(self):
+        return [('s/ds', '510')]
+
     def getMessages(self):
+        # With a journal the restart is closed by the reconciliation, which also sees a failed reboot
+        if self.agent.journal is not None:
+            return []
         response = SmartRESTMessage('s/us', '503', ['c8y_Restart', 'Restart Successful'])
         return [response]
\ No newline at end of file
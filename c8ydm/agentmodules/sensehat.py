@@ -142,4 +142,7 @@ class DeviceSensor(Sensor, Initializer, Listener):
         return [self.fragment]
     
     def getSupportedTemplates(self):
-        return [self.xid]
\ No newline at end of file
+        return [self.xid]
+
+    def getHandledMessages(self):
+        return [('s/dc/' + self.xid, self.message_id)]
\ No newline at end of file
@@ -26,6 +26,10 @@ import pathlib
 class SmartRestInitializer(Initializer):
     logger = logging.getLogger(__name__)
 
+    def getPriority(self):
+        # Other initializers use templates uploaded here
+        return 10
+
     def getMessages(self):
         try:
             template_id = None
@@ -25,6 +25,7 @@ import time
 import subprocess as sp
 
 from c8ydm.core.apt_package_manager import AptPackageManager
+from c8ydm.framework.journal import DONE
 from c8ydm.framework.modulebase import Initializer, Listener
 from c8ydm.framework.smartrest import SmartRESTMessage
 
@@ -34,20 +35,6 @@ class SoftwareManager(Listener, Initializer):
     logger = logging.getLogger(__name__)
     apt_package_manager = AptPackageManager()
 
-    def group(self, seq, sep):
-        result = [[]]
-        for e in seq:
-            #logging.info("e: "+str(e) +" sep: " + str(sep))
-            if sep not in str(e):
-                result[-1].append(e)
-            else:
-                result[-1].append(e[:e.find(sep)])
-                result.append([])
-
-        if result[-1] == []:
-            result.pop()  # thx iBug's comment
-        return result
-    
     def get_filename_from_cd(self, cd):
         """
         Get filename from content-disposition
@@ -63,7 +50,7 @@ class SoftwareManager(Listener, Initializer):
         try:
             if 's/ds' in message.topic and message.messageId == '528':
                 # Software Update without type
-                messages = self.group(message.values, '\n')[0]
+                messages = list(message.values)
                 deviceId = messages.pop(0)
                 binary_included = False
                 self.logger.info('Software update for device ' +
@@ -87,6 +74,7 @@ class SoftwareManager(Listener, Initializer):
                     self.logger.info('Finished all software update')
                     if len(errors) == 0:
                         # finished without errors
+                        self.checkpoint(DONE)
                         finished = SmartRESTMessage(
                             's/us', '503', ['c8y_SoftwareUpdate'])
                     else:
@@ -123,9 +111,8 @@ class SoftwareManager(Listener, Initializer):
 
             if 's/ds' in message.topic and message.messageId == '529':
                 # Software Update with type
-                # When multiple operations received just take the first one for further processing
                 #self.logger.debug("message received :" + str(message.values))
-                messages = self.group(message.values, '\n')[0]
+                messages = list(message.values)
                 deviceId = messages.pop(0)
                 binary_included = False
                 self.logger.info('Software update for device ' +
@@ -160,6 +147,7 @@ class SoftwareManager(Listener, Initializer):
                     self.logger.info('Finished all software update')
                     if len(errors) == 0:
                         # finished without errors
+                        self.checkpoint(DONE)
                         finished = SmartRESTMessage(
                             's/us', '503', ['c8y_SoftwareUpdate'])
                     else:
@@ -192,9 +180,8 @@ class SoftwareManager(Listener, Initializer):
                     
                 
             if 's/ds' in message.topic and message.messageId == '516':
-                # When multiple operations received just take the first one for further processing
                 #self.logger.debug("message received :" + str(message.values))
-                messages = self.group(message.values, '\n')[0]
+                messages = list(message.values)
                 #self.logger.info("message processed:" + str(messages))
                 deviceId = messages.pop(0)
                 self.logger.info('Software update for device ' +
@@ -242,6 +229,13 @@ class SoftwareManager(Listener, Initializer):
     def getSupportedTemplates(self):
         return []
 
+    def getHandledMessages(self):
+        return [('s/ds', '528'), ('s/ds', '529'), ('s/ds', '516')]
+
+    def getIdempotentOperations(self):
+        # apt installs the requested versions again or finds them installed
+        return ['c8y_SoftwareUpdate', 'c8y_SoftwareList']
+
     def getMessages(self):
         installed_software = self.apt_package_manager.get_installed_software_json(False)
         if self.agent.token_received.wait(timeout=self.agent.refresh_token_interval):
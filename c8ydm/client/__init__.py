@@ -17,4 +17,5 @@ limitations under the License.
 """
 from c8ydm.client.mqtt_agent import Agent
 from c8ydm.client.bootstrap_client import Bootstrap
+from c8ydm.client.gateway import Gateway
 from c8ydm.client.rest_client import RestClient
\ No newline at end of file
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import asyncio
+import logging
+import threading
+
+import paho.mqtt.client as mqtt
+
+
+class AsyncioMqttHelper:
+    """
+    Drives the network I/O of a paho MQTT client from an asyncio event loop instead of
+    the paho network thread (loop_start). The socket callbacks may be invoked from any
+    thread, e.g. when a module publishes from a worker thread, so they are always
+    handed over to the loop thread.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, loop, client):
+        # Must be created from the thread running the loop
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.client = client
+        self.misc = None
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def _call(self, fn, *args):
+        if self.loop.is_closed():
+            return
+        if threading.get_ident() == self.loop_thread_id:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self.logger.debug('MQTT socket opened')
+        self._call(self._open, sock)
+
+    def _open(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        if self.misc is None or self.misc.done():
+            self.misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.logger.debug('MQTT socket closed')
+        self._call(self.loop.remove_reader, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self._call(self.loop.add_writer, sock, self.client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self.loop.remove_writer, sock)
+
+    async def misc_loop(self):
+        # Keep alive pings and retries, done by the paho network thread otherwise
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                break
+
+    def close(self):
+        if self.misc is not None:
+            self._call(self.misc.cancel)
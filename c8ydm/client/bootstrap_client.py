@@ -23,6 +23,8 @@ import certifi
 
 import paho.mqtt.client as mqtt
 
+from c8ydm.framework.smartrest import SmartRESTParser
+
 
 class Bootstrap():
     bootstrapped = False
@@ -47,21 +49,22 @@ class Bootstrap():
 
     def on_messageRegistration(self, client, userdata, msg):
         message = msg.payload.decode('utf-8')
-        messageParts = message.split(',')
-        self.logger.debug(messageParts)
-        if messageParts[0] == '70':
-
-            while not self.bootstrapped:
-                try:
-                    self.logger.debug('Storing credentials...')
-                    self.configuration.writeCredentials(messageParts[1], messageParts[2], messageParts[3])
-                    self.logger.debug('Storing credentials successful')
-                    client.unsubscribe('s/dcr')
-                    self.bootstrapped = True
-                except Exception as e:
-                    self.logger.debug('Storing credentials failed. Waiting 5 Sec. to retry..')
-                    self.logger.exception(e)
-                    time.sleep(5)
+        for registration in SmartRESTParser.parse(msg.topic, message):
+            messageParts = [registration.messageId] + registration.values
+            self.logger.debug(messageParts)
+            if messageParts[0] == '70':
+
+                while not self.bootstrapped:
+                    try:
+                        self.logger.debug('Storing credentials...')
+                        self.configuration.writeCredentials(messageParts[1], messageParts[2], messageParts[3])
+                        self.logger.debug('Storing credentials successful')
+                        client.unsubscribe('s/dcr')
+                        self.bootstrapped = True
+                    except Exception as e:
+                        self.logger.debug('Storing credentials failed. Waiting 5 Sec. to retry..')
+                        self.logger.exception(e)
+                        time.sleep(5)
 
     def bootstrap(self):
         self.logger.info('Start bootstrap client')
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import logging
+import random
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+
+class Backoff:
+    """
+    Capped exponential backoff with full jitter.
+
+    The delay before attempt n is drawn uniformly from [0, min(cap, base * 2^n)], so
+    devices losing the broker at the same time spread their reconnects over the whole
+    window instead of retrying in lockstep. `max_attempts` limits the number of
+    consecutive attempts, 0 means unlimited.
+    """
+
+    def __init__(self, base=1, cap=300, max_attempts=0, rand=random.uniform):
+        self.base = max(float(base), 0.001)
+        self.cap = max(float(cap), self.base)
+        self.max_attempts = max(0, int(max_attempts))
+        self.rand = rand
+        self.attempts = 0
+
+    def next_delay(self):
+        """
+        Returns the delay in seconds before the next attempt or None if the attempt
+        budget is used up.
+        """
+        if self.max_attempts and self.attempts >= self.max_attempts:
+            return None
+        delay = self.rand(0, min(self.cap, self.base * 2 ** min(self.attempts, 32)))
+        self.attempts += 1
+        return delay
+
+    def reset(self):
+        self.attempts = 0
+
+
+class ConnectionSupervisor:
+    """
+    State machine keeping the MQTT connection of a paho client alive.
+
+    disconnected -> connecting -> connected, and on any failure -> backoff -> connecting
+    until the connection is up again, the supervisor is stopped or the backoff runs out
+    of attempts (failed). The existing client is reused with reconnect(), so callbacks,
+    TLS settings and credentials are kept. connect_async() must have been called on the
+    client before.
+
+    In the threaded runtime start() runs the network loop on a dedicated thread. With
+    an external event loop only the bookkeeping methods are used: begin_attempt(),
+    connected(), connection_lost(), next_delay() and check_timeout().
+    """
+    logger = logging.getLogger(__name__)
+
+    DISCONNECTED = 'disconnected'
+    CONNECTING = 'connecting'
+    CONNECTED = 'connected'
+    BACKOFF = 'backoff'
+    STOPPED = 'stopped'
+    FAILED = 'failed'
+
+    def __init__(self, client, backoff, connect_timeout=30, on_give_up=None, clock=time.monotonic):
+        self.client = client
+        self.backoff = backoff
+        self.connect_timeout = connect_timeout
+        self.on_give_up = on_give_up
+        self.clock = clock
+        self.state = self.DISCONNECTED
+        self._condition = threading.Condition()
+        self._thread = None
+        self._attempt_started = None
+        self._lost_at = None
+        self.connects = 0
+        self.session_resumes = 0
+        self.disconnects = 0
+        self.failed_attempts = 0
+        self.last_reconnect_latency = None
+        self.max_reconnect_latency = 0.0
+        self.total_reconnect_latency = 0.0
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None or self.state in (self.STOPPED, self.FAILED):
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True, name='MqttSupervisor')
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            state = self.state
+            if state in (self.STOPPED, self.FAILED):
+                return
+            if state == self.DISCONNECTED:
+                self._connect()
+            elif state == self.BACKOFF:
+                self._wait_backoff()
+            else:
+                rc = self.client.loop(timeout=1.0)
+                if rc != mqtt.MQTT_ERR_SUCCESS:
+                    self.connection_lost(rc)
+                else:
+                    self.check_timeout()
+
+    def _connect(self):
+        self.begin_attempt()
+        try:
+            self.client.reconnect()
+        except Exception as ex:
+            self.logger.warning(f'Connecting to MQTT Broker failed: {ex}')
+            self.connection_lost()
+
+    def _wait_backoff(self):
+        delay = self.next_delay()
+        if delay is None:
+            return
+        with self._condition:
+            self._condition.wait_for(lambda: self.state != self.BACKOFF, delay)
+            if self.state == self.BACKOFF:
+                self.state = self.DISCONNECTED
+
+    def begin_attempt(self):
+        with self._condition:
+            if self.state in (self.STOPPED, self.FAILED):
+                return
+            self.state = self.CONNECTING
+            self._attempt_started = self.clock()
+
+    def next_delay(self):
+        """
+        Returns the backoff delay before the next attempt. Returns None and switches to
+        failed once the attempt budget is used up.
+        """
+        delay = self.backoff.next_delay()
+        if delay is not None:
+            self.logger.info(f'Will retry to connect to C8Y in {delay:.1f} sec '
+                             f'(attempt {self.backoff.attempts})...')
+            return delay
+        self.logger.error(f'Giving up after {self.backoff.attempts} reconnect attempts')
+        with self._condition:
+            if self.state != self.STOPPED:
+                self.state = self.FAILED
+            self._condition.notify_all()
+        if self.on_give_up is not None:
+            self.on_give_up()
+        return None
+
+    def check_timeout(self):
+        with self._condition:
+            expired = (self.state == self.CONNECTING
+                       and self.clock() - self._attempt_started > self.connect_timeout)
+        if expired:
+            self.logger.warning(f'No CONNACK received within {self.connect_timeout} sec')
+            self.connection_lost()
+
+    def connected(self, rc, session_present=False):
+        """
+        Reports the result code of a CONNACK and whether the broker resumed a
+        persistent session.
+        """
+        if rc != 0:
+            self.connection_lost(rc)
+            return
+        with self._condition:
+            if self.state in (self.STOPPED, self.FAILED):
+                return
+            self.connects += 1
+            if session_present:
+                self.session_resumes += 1
+            if self._lost_at is not None:
+                latency = self.clock() - self._lost_at
+                self.last_reconnect_latency = latency
+                self.max_reconnect_latency = max(self.max_reconnect_latency, latency)
+                self.total_reconnect_latency += latency
+                self._lost_at = None
+                self.logger.info(f'Reconnected after {latency:.1f} sec '
+                                 f'and {self.backoff.attempts} attempt(s)')
+            self.backoff.reset()
+            self.state = self.CONNECTED
+            self._condition.notify_all()
+
+    def connection_lost(self, rc=None):
+        """
+        Reports a lost connection or a failed attempt. Repeated reports of the same
+        failure are ignored.
+        """
+        with self._condition:
+            if self.state == self.CONNECTED:
+                self.disconnects += 1
+                self._lost_at = self.clock()
+            elif self.state == self.CONNECTING:
+                self.failed_attempts += 1
+            else:
+                return
+            self.logger.debug(f'Connection lost in state {self.state} (rc={rc})')
+            self.state = self.BACKOFF
+            self._condition.notify_all()
+
+    def wait_connected(self, timeout=None):
+        """
+        Blocks until the client is connected. Returns False if the supervisor was
+        stopped, gave up or the timeout elapsed.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.state in (self.CONNECTED, self.STOPPED, self.FAILED), timeout)
+            return self.state == self.CONNECTED
+
+    def stop(self, timeout=5):
+        with self._condition:
+            self.state = self.STOPPED
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'state': self.state,
+                'connects': self.connects,
+                'session_resumes': self.session_resumes,
+                'disconnects': self.disconnects,
+                'failed_attempts': self.failed_attempts,
+                'backoff_attempts': self.backoff.attempts,
+                'last_reconnect_latency': self.last_reconnect_latency,
+                'max_reconnect_latency': self.max_reconnect_latency,
+                'total_reconnect_latency': self.total_reconnect_latency,
+            }
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import configparser
+import logging
+import pathlib
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from c8ydm.client.bootstrap_client import Bootstrap
+from c8ydm.client.mqtt_agent import Agent
+from c8ydm.framework.dispatcher import WorkerPool
+from c8ydm.framework.metrics import MetricsRegistry, register_process_metrics
+from c8ydm.framework.scheduler import Scheduler
+from c8ydm.utils.configutils import Configuration
+
+
+class Gateway:
+    """
+    Hosts several device identities in one process.
+
+    Every identity is an Agent with its own serial, credentials, MQTT connection,
+    outbox and journal, kept in ~/.cumulocity/devices/<serial>. The identities share
+    the module code, the listener and sensor worker pools, the scheduler and the pooled
+    HTTP connections for REST requests. Operation polling and token refresh run on the
+    shared scheduler; each identity keeps the threads of its MQTT network loop and its
+    publisher.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, serials, path, configuration, pidfile, simulated):
+        self.serials = serials
+        self.path = pathlib.Path(path)
+        self.configuration = configuration
+        self.pidfile = pidfile
+        self.simulated = simulated
+        self.watchdog = Agent.create_watchdog(configuration, self._report_stuck_task, self._clear_stuck_task)
+        self.listener_pool = WorkerPool('ListenerThread',
+            workers=configuration.getIntValue('gateway', 'listener.workers', 16),
+            queue_size=configuration.getIntValue('gateway', 'listener.queue.size', 4096),
+            overflow=configuration.getValue('gateway', 'listener.queue.overflow') or 'drop-newest',
+            watchdog=self.watchdog)
+        self.sensor_pool = WorkerPool('SensorThread',
+            workers=configuration.getIntValue('gateway', 'sensor.workers', 16),
+            queue_size=configuration.getIntValue('gateway', 'sensor.queue.size', 4096),
+            watchdog=self.watchdog)
+        self.scheduler = Scheduler(self.sensor_pool)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.listener_pool.max_workers + self.sensor_pool.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.metrics = MetricsRegistry()
+        register_process_metrics(self.metrics)
+        self.metrics.register_stats('listener_pool', self.listener_pool.stats)
+        self.metrics.register_stats('sensor_pool', self.sensor_pool.stats)
+        self.metrics.register_stats('scheduler_job', self.scheduler.stats, label='job')
+        if self.watchdog is not None:
+            self.metrics.register_stats('watchdog', self.watchdog.stats, nested={'pools': 'pool'})
+        self.metrics_server = Agent.create_metrics_server(configuration, self.metrics)
+        self.start_rate = max(configuration.getIntValue('gateway', 'start.rate', 10), 1)
+        self.agents = []
+        self._bootstraps = []
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    @staticmethod
+    def get_serials(configuration, serial):
+        """
+        Returns the serials of the identities configured in the [gateway] section, an
+        empty list if gateway mode is not enabled.
+        """
+        serials = configuration.getValue('gateway', 'serials')
+        if serials:
+            return [s.strip() for s in serials.split(',') if s.strip()]
+        devices = configuration.getIntValue('gateway', 'devices', 0)
+        return [f'{serial}-{index}' for index in range(1, devices + 1)]
+
+    def identity_configuration(self, serial):
+        """
+        Returns the configuration of an identity. It is created from agent.ini on first
+        use and can be edited afterwards, e.g. to set device certificates. Device
+        credentials are not copied if bootstrap credentials are configured, so every
+        identity registers itself.
+        """
+        path = self.path / 'devices' / serial
+        path.mkdir(parents=True, exist_ok=True)
+        if not (path / 'agent.ini').is_file():
+            source = self.configuration.configuration
+            template = configparser.ConfigParser(interpolation=None)
+            for section in source.sections():
+                if section == 'gateway':
+                    continue
+                template.add_section(section)
+                for key, value in source.items(section, raw=True):
+                    template.set(section, key, value)
+            template.remove_option('agent', 'device.id')
+            if self.configuration.getBootstrapCredentials() is not None:
+                for key in (Configuration.tenant, Configuration.user, Configuration.password):
+                    template.remove_option(Configuration.credentialsCategory, key)
+            with open(path / 'agent.ini', 'w') as cfgfile:
+                template.write(cfgfile)
+        return path, Configuration(str(path))
+
+    def run(self):
+        self.logger.info(f'Starting gateway with {len(self.serials)} identities')
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        if self.watchdog is not None:
+            self.watchdog.start()
+        starter = threading.Thread(target=self._start_identities, daemon=True, name='GatewayStarter')
+        starter.start()
+        self.scheduler.run()
+
+    def _start_identities(self):
+        # Staggered, so the identities do not all connect and register at the same time
+        for serial in self.serials:
+            if self._stopped:
+                return
+            thread = threading.Thread(target=self._run_identity, args=(serial,), daemon=True,
+                                      name=f'Identity-{serial}')
+            thread.start()
+            time.sleep(1 / self.start_rate)
+
+    def _run_identity(self, serial):
+        try:
+            path, configuration = self.identity_configuration(serial)
+            if not configuration.getBooleanValue('mqtt', 'cert_auth') and configuration.getCredentials() is None:
+                if configuration.getBootstrapCredentials() is None:
+                    self.logger.error(f'No credentials found for {serial}, identity is not started')
+                    return
+                bootstrap = Bootstrap(serial, str(path), configuration)
+                with self._lock:
+                    if self._stopped:
+                        return
+                    self._bootstraps.append(bootstrap)
+                bootstrap.bootstrap()
+                if configuration.getCredentials() is None:
+                    self.logger.error(f'No credentials found for {serial} after bootstrapping')
+                    return
+            agent = Agent(serial, path, configuration, self.pidfile, self.simulated, gateway=self)
+            with self._lock:
+                if self._stopped:
+                    return
+                self.agents.append(agent)
+            agent.run()
+        except Exception as ex:
+            self.logger.exception(f'Error running identity {serial}: {ex}')
+
+    def _identity_of(self, task):
+        # Tasks of an identity are named with its serial as prefix
+        with self._lock:
+            for agent in self.agents:
+                if task.name.startswith(f'{agent.serial}/'):
+                    return agent
+        return None
+
+    def _report_stuck_task(self, task, stack):
+        agent = self._identity_of(task)
+        if agent is not None:
+            agent.report_stuck_task(task, stack)
+
+    def _clear_stuck_task(self, task):
+        agent = self._identity_of(task)
+        if agent is not None:
+            agent.clear_stuck_task(task)
+
+    def stop(self):
+        """
+        Stops all identities in parallel, each one drains within agent.shutdown.timeout.seconds.
+        """
+        with self._lock:
+            self._stopped = True
+            agents = list(self.agents)
+            bootstraps = list(self._bootstraps)
+        for bootstrap in bootstraps:
+            bootstrap.stop()
+        self.scheduler.stop()
+        threads = [threading.Thread(target=agent.stop, daemon=True, name=f'Stop-{agent.serial}')
+                   for agent in agents]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.listener_pool.shutdown(wait=False)
+        self.sensor_pool.shutdown(wait=False)
+        self.session.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        self.logger.info(f'Gateway stopped {len(agents)} identities')
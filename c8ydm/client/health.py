@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import psutil
+
+from c8ydm.framework.modulebase import Sensor
+from c8ydm.framework.smartrest import SmartRESTMessage
+
+
+class AgentHealthSensor(Sensor):
+    """
+    Publishes the resource usage and message counters of the agent itself as the
+    c8y_AgentHealth measurement.
+    """
+    fragment = 'c8y_AgentHealth'
+
+    def __init__(self, serial, agent, interval):
+        super().__init__(serial, agent)
+        self.interval = interval
+        self.process = psutil.Process()
+        # The first call only starts the CPU measurement
+        self.process.cpu_percent()
+        self._published = 0
+        self._failed = 0
+
+    def getInterval(self):
+        return self.interval
+
+    def getSensorMessages(self):
+        inflight = self.agent.inflight.stats()
+        published, self._published = inflight['published'] - self._published, inflight['published']
+        failed, self._failed = inflight['failed'] - self._failed, inflight['failed']
+        series = [
+            ('memory', round(self.process.memory_info().rss / 1048576, 1), 'MB'),
+            ('cpu', self.process.cpu_percent(), '%'),
+            ('threads', self.process.num_threads(), ''),
+            ('published', published, ''),
+            ('failed', failed, ''),
+            ('outbox', len(self.agent.outbox) if self.agent.outbox is not None else 0, ''),
+            ('listenerQueue', self.agent.listener_pool.stats()['queue_depth'], ''),
+        ]
+        values = [self.fragment, '']
+        for name, value, unit in series:
+            values.extend([self.fragment, name, value, unit])
+        return [SmartRESTMessage('s/us', '201', values)]
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import contextlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+class PublishFuture:
+    """
+    Outcome of a publishMessage call.
+
+    A future is resolved once paho reports the message as published: written to the
+    socket for QoS 0, acknowledged by the broker for QoS 1 and 2. Messages stored in
+    the outbox while offline resolve as queued. Messages that could neither be sent
+    nor stored, e.g. because the outbox is full, resolve as failed.
+    """
+    PENDING = 'pending'
+    PUBLISHED = 'published'
+    QUEUED = 'queued'
+    FAILED = 'failed'
+
+    def __init__(self, topic, qos, clock=time.monotonic, payload=None):
+        self.topic = topic
+        self.qos = qos
+        self.payload = payload
+        self.clock = clock
+        self.created = clock()
+        self.state = self.PENDING
+        self.error = None
+        self.latency = None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self.state != self.PENDING
+
+    @property
+    def published(self):
+        return self.state == self.PUBLISHED
+
+    def wait(self, timeout=None):
+        """
+        Waits until the future is resolved. Returns True if the message was published.
+        """
+        self._event.wait(timeout)
+        return self.published
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if self.state == self.PENDING:
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def resolve(self, state, error=None):
+        with self._lock:
+            if self.state != self.PENDING:
+                return
+            self.state = state
+            self.error = error
+            if state == self.PUBLISHED:
+                self.latency = self.clock() - self.created
+            callbacks, self._callbacks = self._callbacks, []
+        self._event.set()
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as ex:
+                logging.getLogger(__name__).exception(f'Error in publish callback: {ex}')
+
+
+class InflightTracker:
+    """
+    Maps paho message ids to PublishFutures and resolves them from on_publish.
+
+    on_publish can fire before publish() has returned the message id to the caller,
+    so acknowledgements for unknown ids that arrive during publishing() are remembered
+    and matched when the id is tracked afterwards. Acknowledgements of messages that
+    are not tracked at all are dropped, they could match a reused id later.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, early_ack_limit=1024):
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._pending = {}
+        self._early = OrderedDict()
+        self._publishing = 0
+        self.early_ack_limit = early_ack_limit
+        self.published = 0
+        self.failed = 0
+        self.last_latency = None
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    def track(self, mid, futures):
+        with self._lock:
+            if self._early.pop(mid, None) is None:
+                self._pending.setdefault(mid, []).extend(futures)
+                return
+        self._resolve(futures, PublishFuture.PUBLISHED)
+
+    @contextlib.contextmanager
+    def publishing(self):
+        """
+        Wraps a publish whose message id is passed to track() before the block ends.
+        """
+        with self._lock:
+            self._publishing += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._publishing -= 1
+                if not self._publishing:
+                    # Early acknowledgements no publish in progress can claim anymore
+                    self._early.clear()
+
+    def acknowledge(self, mid):
+        with self._lock:
+            futures = self._pending.pop(mid, None)
+            self._drained.notify_all()
+            if futures is None:
+                if not self._publishing:
+                    return
+                self._early[mid] = True
+                while len(self._early) > self.early_ack_limit:
+                    self._early.popitem(last=False)
+                return
+        self._resolve(futures, PublishFuture.PUBLISHED)
+
+    def fail(self, futures, error):
+        self._resolve(futures, PublishFuture.FAILED, error)
+
+    def connection_lost(self):
+        """
+        Fails pending QoS 0 messages, paho drops them with the connection. QoS 1 and 2
+        messages are retransmitted after reconnect and stay pending.
+        """
+        failed = []
+        with self._lock:
+            for mid, futures in list(self._pending.items()):
+                if all(future.qos == 0 for future in futures):
+                    failed.extend(self._pending.pop(mid))
+            self._early.clear()
+            self._drained.notify_all()
+        self._resolve(failed, PublishFuture.FAILED, 'connection lost')
+
+    def drain(self, timeout=None):
+        """
+        Waits until all tracked messages are acknowledged. Returns False on timeout.
+        """
+        with self._drained:
+            return self._drained.wait_for(lambda: not self._pending, timeout)
+
+    def take_pending(self):
+        """
+        Stops tracking the unacknowledged messages and returns their futures unresolved.
+        """
+        with self._lock:
+            futures = [future for futures in self._pending.values() for future in futures]
+            self._pending.clear()
+            return futures
+
+    def _resolve(self, futures, state, error=None):
+        for future in futures:
+            future.resolve(state, error)
+        with self._lock:
+            if state == PublishFuture.PUBLISHED:
+                for future in futures:
+                    if future.latency is None:
+                        continue
+                    self.published += 1
+                    self.last_latency = future.latency
+                    self.max_latency = max(self.max_latency, future.latency)
+                    self.total_latency += future.latency
+            elif state == PublishFuture.FAILED:
+                self.failed += len(futures)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': sum(len(futures) for futures in self._pending.values()),
+                'published': self.published,
+                'failed': self.failed,
+                'last_ack_latency': self.last_latency,
+                'max_ack_latency': self.max_latency,
+                'avg_ack_latency': self.total_latency / self.published if self.published else None,
+            }
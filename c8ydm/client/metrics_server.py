@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import logging
+import os
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    content_type = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', self.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix sockets have no peer address
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        MetricsServer.logger.debug(format % args)
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """
+    Serves the metrics registry in the OpenMetrics format on GET /metrics.
+
+    The endpoint listens on 127.0.0.1:<port> and/or on a Unix socket, so it is only
+    reachable from the device itself.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, registry, port=0, socket_path=None):
+        self.registry = registry
+        self.port = port
+        self.socket_path = socket_path
+        self._servers = []
+
+    def start(self):
+        try:
+            if self.port:
+                self._serve(ThreadingHTTPServer(('127.0.0.1', self.port), _MetricsHandler),
+                            f'http://127.0.0.1:{self.port}/metrics')
+            if self.socket_path:
+                if os.path.exists(self.socket_path):
+                    os.remove(self.socket_path)
+                self._serve(_UnixHTTPServer(self.socket_path, _MetricsHandler), self.socket_path)
+        except OSError as ex:
+            self.logger.error(f'Could not start metrics endpoint: {ex}')
+
+    def _serve(self, server, address):
+        server.registry = self.registry
+        thread = threading.Thread(target=server.serve_forever, daemon=True, name='MetricsServer')
+        thread.start()
+        self._servers.append(server)
+        self.logger.info(f'Serving metrics on {address}')
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
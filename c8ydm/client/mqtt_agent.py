@@ -15,7 +15,9 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import asyncio
 import logging
+import os
 import time
 import ssl
 import _thread
@@ -25,23 +27,55 @@ import paho.mqtt.client as mqtt
 
 
 import c8ydm.utils.moduleloader as moduleloader
+from c8ydm.client.asyncio_helper import AsyncioMqttHelper
+from c8ydm.client.connection_supervisor import Backoff, ConnectionSupervisor
+from c8ydm.client.health import AgentHealthSensor
+from c8ydm.client.inflight import InflightTracker, PublishFuture
+from c8ydm.client.metrics_server import MetricsServer
+from c8ydm.client.operation_poller import OperationPoller
+from c8ydm.client.outbox import Outbox, OutboxReplayer
+from c8ydm.client.publisher import CoalescingPublisher, classify
+from c8ydm.client.rate_limiter import RateLimiter
 from c8ydm.client.rest_client import RestClient
+from c8ydm.client.token_manager import TokenManager
 from c8ydm.core.configuration import ConfigurationManager
-from c8ydm.framework.smartrest import SmartRESTMessage
+from c8ydm.framework.aio import to_thread
+from c8ydm.framework.children import ChildDeviceRegistry
+from c8ydm.framework.dispatcher import WorkerPool
+from c8ydm.framework.journal import OperationJournal
+from c8ydm.framework.metrics import MetricsRegistry, register_process_metrics
+from c8ydm.framework.operations import (DEFAULT_POLICIES, DeduplicationCache, OperationExecutor,
+                                        OperationPolicy, current_operation, is_operation, is_suppressed)
+from c8ydm.framework.router import MessageRouter
+from c8ydm.framework.scheduler import Scheduler
+from c8ydm.framework.startup import StartupGraph, StartupTrace
+from c8ydm.framework.smartrest import SmartRESTMessage, SmartRESTParser
+from c8ydm.framework.watchdog import Watchdog
 
 
 class Agent():
-    __sensors = []
-    __listeners = []
-    __supportedOperations = set()
-    __supportedTemplates = set()
     stopmarker = 0
 
-    def __init__(self, serial, path, configuration, pidfile, simulated):
-        self.logger = logging.getLogger(__name__)
+    def __init__(self, serial, path, configuration, pidfile, simulated, gateway=None, trace=None):
+        """
+        With a Gateway the agent is one of several identities in the process and uses
+        the worker pools, the scheduler and the HTTP session of the gateway. The start
+        phases are recorded in `trace`, by default from the creation of the agent.
+        """
+        self.logger = logging.getLogger(__name__ if gateway is None else f'{__name__}.{serial}')
         self.serial = serial
         self.simulated = simulated
-        self.__client = mqtt.Client(serial)
+        self.gateway = gateway
+        self.trace = trace if trace is not None else StartupTrace()
+        self.__sensors = []
+        self.__listeners = []
+        self.__supportedOperations = set()
+        self.__supportedTemplates = set()
+        # Sensor jobs of all identities share the scheduler of a gateway
+        self.__job_prefix = '' if gateway is None else f'{serial}/'
+        # With a persistent session the broker keeps subscriptions and queues operations while offline
+        self.clean_session = configuration.getBooleanValue('mqtt', 'clean.session') is not False
+        self.__client = mqtt.Client(serial, clean_session=self.clean_session)
         self.configuration = configuration
         self.pidfile = pidfile
         self.path = path
@@ -59,13 +93,94 @@ class Agent():
             'agent', 'main.loop.interval.seconds'))
         self.device_name = f'{self.configuration.getValue("agent", "name")}-{serial}'
         self.device_type = self.configuration.getValue('agent', 'type')
+        # 'threads' (default) or 'asyncio'
+        self.runtime = self.configuration.getValue('agent', 'runtime') or 'threads'
+        if gateway is not None and self.runtime != 'threads':
+            self.logger.warning(f'Runtime {self.runtime} is not supported in gateway mode, using threads')
+            self.runtime = 'threads'
+        self.__loop = None
 
-        self.stop_event = threading.Event()
-        self.token_received = threading.Event()
         self.refresh_token_interval = 60
         self.token = None
+        self.token_manager = TokenManager(self.__request_token, os.path.join(str(path), 'token'),
+            refresh_margin=self.configuration.getIntValue('mqtt', 'token.refresh.margin.seconds', 60),
+            retry_interval=self.refresh_token_interval)
+        # Kept for modules waiting until REST requests can be authenticated
+        self.token_received = self.token_manager.token_received
+        self.started_at = time.monotonic()
+        self.startup_report = None
         self.is_connected = False
-        self.rest_client = RestClient(self)
+        # Identities of a gateway share its registry and are told apart by the device label
+        self.metrics = MetricsRegistry() if gateway is None else gateway.metrics
+        self.metric_labels = {} if gateway is None else {'device': serial}
+        self.messages_received = self.metrics.counter('mqtt_messages_received', 'Received MQTT messages')
+        if gateway is not None:
+            self.watchdog = gateway.watchdog
+            self.rest_client = RestClient(self, gateway.session)
+            self.listener_pool = gateway.listener_pool
+        else:
+            self.watchdog = self.create_watchdog(self.configuration, self.report_stuck_task, self.clear_stuck_task)
+            self.rest_client = RestClient(self)
+            self.listener_pool = WorkerPool('ListenerThread',
+                workers=self.configuration.getIntValue('agent', 'listener.workers', 4),
+                queue_size=self.configuration.getIntValue('agent', 'listener.queue.size', 256),
+                # Messages are submitted from the MQTT network loop, which must not block
+                overflow=self.configuration.getValue('agent', 'listener.queue.overflow') or 'drop-newest',
+                watchdog=self.watchdog)
+        self.router = MessageRouter()
+        self.journal = self.create_journal()
+        self.operations = OperationExecutor(self.__run_operation, self.__report_operation_timeout,
+            policies=self.create_operation_policies(),
+            max_concurrent=self.configuration.getIntValue('agent', 'operations.max.concurrent',
+                                                          self.listener_pool.max_workers),
+            journal=self.journal)
+        self.recent_operations = DeduplicationCache(
+            ttl=self.configuration.getIntValue('agent', 'operations.dedup.ttl.seconds', 60))
+        self.operation_poller = None
+        if self.configuration.getBooleanValue('agent', 'operations.poll.enabled') is not False:
+            self.operation_poller = OperationPoller(self.pollPendingOperations,
+                min_interval=self.configuration.getIntValue('agent', 'operations.poll.min.seconds', 5),
+                max_interval=self.configuration.getIntValue('agent', 'operations.poll.max.seconds', 300),
+                # Identities of a gateway poll on the shared scheduler
+                scheduler=None if gateway is None else gateway.scheduler,
+                name=f'{self.__job_prefix}OperationPoller')
+        if gateway is not None:
+            self.sensor_pool = gateway.sensor_pool
+            self.scheduler = gateway.scheduler
+        else:
+            self.sensor_pool = WorkerPool('SensorThread',
+                workers=self.configuration.getIntValue('agent', 'sensor.workers', 4),
+                queue_size=self.configuration.getIntValue('agent', 'sensor.queue.size', 64),
+                watchdog=self.watchdog)
+            self.scheduler = Scheduler(self.sensor_pool)
+        self.supervisor = ConnectionSupervisor(self.__client, self.create_backoff(),
+                                               on_give_up=self.__stop_jobs)
+        self.__initialized = False
+        self.__stopping = False
+        self.__pending_messages = []
+        self.__pending_lock = threading.Lock()
+        self.__startup_pending = {'init', 'initializers'}
+        self.__reconnecting = False
+        self.__token_thread = None
+        self.inflight = InflightTracker()
+        self.rate_limiter = self.create_rate_limiter()
+        self.publisher = CoalescingPublisher(self.__send,
+            window=self.configuration.getIntValue('mqtt', 'publish.coalesce.window.ms', 50) / 1000,
+            max_payload=self.configuration.getIntValue('mqtt', 'publish.max.payload.bytes', 16384),
+            can_send=self.__can_send)
+        self.outbox = self.create_outbox()
+        self.children = ChildDeviceRegistry(os.path.join(str(self.path), 'children.json'), self.publishMessage,
+            max_age=self.configuration.getIntValue('agent', 'children.refresh.hours', 168) * 3600)
+        self.outbox_replayer = None
+        if self.outbox is not None:
+            self.outbox_replayer = OutboxReplayer(
+                self.outbox, self.__publish_stored, self.__client_connected,
+                rate=self.configuration.getIntValue('agent', 'outbox.replay.rate', 20))
+
+        self.register_metrics()
+        self.metrics_server = None
+        if gateway is None:
+            self.metrics_server = self.create_metrics_server(self.configuration, self.metrics)
 
         if self.simulated:
             self.model = 'docker'
@@ -78,6 +193,18 @@ class Agent():
             for message in messages:
                 self.publishMessage(message)
 
+    def get_main_loop_interval(self):
+        self.interval = int(self.configuration.getValue(
+            'agent', 'main.loop.interval.seconds'))
+        return self.interval
+
+    def schedule_sensor(self, sensor):
+        interval = sensor.getInterval()
+        if interval is None:
+            interval = self.get_main_loop_interval
+        self.scheduler.add_job(f'{self.__job_prefix}{sensor.__module__}.{sensor.__class__.__name__}',
+                               lambda: self.handle_sensor_message(sensor), interval)
+
     def handle_initializer_message(self, initializer):
         messages = initializer.getMessages()
         if messages is not None and len(messages) > 0:
@@ -87,151 +214,546 @@ class Agent():
                                     message.topic, message.getMessage())
                     self.publishMessage(message)
 
-    def run(self):
+    def create_backoff(self):
+        return Backoff(
+            base=self.configuration.getIntValue('mqtt', 'reconnect.backoff.base.seconds', 1),
+            cap=self.configuration.getIntValue('mqtt', 'reconnect.backoff.max.seconds', 300),
+            max_attempts=self.configuration.getIntValue('mqtt', 'reconnect.max.attempts', 0))
+
+    def create_journal(self):
+        if self.configuration.getBooleanValue('agent', 'journal.enabled') is False:
+            return None
         try:
-            self.logger.info('Starting agent')
-            self.__client = mqtt.Client(self.serial)
-            credentials = self.configuration.getCredentials()
-            self.__client = self.connect(
-                credentials, self.serial, self.url, int(self.port), int(self.ping))
-            self.__client.loop_start()
-            while not self.is_connected:
-                time.sleep(1)
-                self.logger.debug('Waiting for MQTT Client to be connected')
-            self.__init_agent()
-            while not self.stopmarker:
-                self.logger.debug('New cycle')
-                self.interval = int(self.configuration.getValue(
-                    'agent', 'main.loop.interval.seconds'))
-                for sensor in self.__sensors:
-                    sensor_thread = threading.Thread(target=self.handle_sensor_message, args=(sensor,))
-                    sensor_thread.daemon = True
-                    sensor_thread.name = f'SensorThread-{sensor.__class__.__name__}'
-                    sensor_thread.start()
-                    #_thread.start_new_thread(self.handle_sensor_message, (sensor,))
-                time.sleep(self.interval)
-        except Exception as e:
-            self.logger.exception(f'Error in C8Y Agent: {e}', e)
+            return OperationJournal(os.path.join(str(self.path), 'operations.db'))
+        except Exception as ex:
+            self.logger.exception(f'Could not open operation journal, interrupted operations will be failed: {ex}')
+            return None
+
+    def create_operation_policies(self):
+        policies = {}
+        for fragment, policy in DEFAULT_POLICIES.items():
+            timeout = self.configuration.getIntValue('agent', f'operations.timeout.{fragment}', policy.timeout)
+            policies[fragment] = OperationPolicy(policy.serial_group, timeout or None)
+        return policies
+
+    def create_rate_limiter(self):
+        return RateLimiter(
+            messages_per_second=self.configuration.getIntValue('mqtt', 'publish.rate.messages', 0),
+            bytes_per_second=self.configuration.getIntValue('mqtt', 'publish.rate.bytes', 0),
+            message_burst=self.configuration.getIntValue('mqtt', 'publish.burst.messages'),
+            byte_burst=self.configuration.getIntValue('mqtt', 'publish.burst.bytes'))
+
+    def register_metrics(self):
+        labels = self.metric_labels
+        register = self.metrics.register_stats
+        if self.gateway is None:
+            register_process_metrics(self.metrics)
+            register('listener_pool', self.listener_pool.stats)
+            register('sensor_pool', self.sensor_pool.stats)
+            register('scheduler_job', self.scheduler.stats, label='job')
+            if self.watchdog is not None:
+                register('watchdog', self.watchdog.stats, nested={'pools': 'pool'})
+        register('connection', self.supervisor.stats, labels)
+        register('token', self.token_manager.stats, labels)
+        register('startup_initializer', lambda: self.startup_report or {}, labels, label='initializer')
+        register('publisher', self.publisher.stats, labels, nested={'lanes': 'lane'})
+        register('inflight', self.inflight.stats, labels)
+        register('rate_limiter', self.rate_limiter.stats, labels)
+        if self.outbox is not None:
+            register('outbox', self.outbox.stats, labels)
+        register('operations', self.operations.stats, labels, nested={'fragments': 'fragment'})
+        register('operation_dedup', self.recent_operations.stats, labels)
+        if self.operation_poller is not None:
+            register('operation_poller', self.operation_poller.stats, labels)
+        register('children', self.children.stats, labels)
+
+    @staticmethod
+    def create_metrics_server(configuration, registry):
+        port = configuration.getIntValue('agent', 'metrics.port', 0)
+        socket_path = configuration.getValue('agent', 'metrics.socket')
+        if not port and not socket_path:
+            return None
+        return MetricsServer(registry, port, socket_path)
+
+    @staticmethod
+    def create_watchdog(configuration, on_stuck, on_recovered):
+        budget = configuration.getIntValue('agent', 'watchdog.budget.seconds', 300)
+        if budget <= 0:
+            return None
+        return Watchdog(budget, interval=configuration.getIntValue('agent', 'watchdog.interval.seconds', 10),
+                        on_stuck=on_stuck, on_recovered=on_recovered)
+
+    def report_stuck_task(self, task, stack):
+        text = (f'Task {task.name} is running for {time.monotonic() - task.started:.0f} sec, '
+                f'exceeding its budget of {task.budget} sec, at {task.location}')
+        self.publishMessage(SmartRESTMessage('s/us', '302', ['c8y_AgentStuckTask', text]))
+
+    def clear_stuck_task(self, task):
+        if not self.watchdog.stuck(self.__job_prefix):
+            self.publishMessage(SmartRESTMessage('s/us', '306', ['c8y_AgentStuckTask']))
+
+    def create_module_manifest(self):
+        return moduleloader.ModuleManifest(os.path.join(str(self.path), 'modules.json'))
+
+    def get_module_names(self, key):
+        value = self.configuration.getValue('agent', key)
+        if not value:
+            return set()
+        return {name.strip() for name in value.split(',') if name.strip()}
+
+    def create_outbox(self):
+        if self.configuration.getBooleanValue('agent', 'outbox.enabled') is False:
+            return None
+        try:
+            return Outbox(os.path.join(str(self.path), 'outbox.db'),
+                max_messages=self.configuration.getIntValue('agent', 'outbox.max.messages', 10000),
+                max_bytes=self.configuration.getIntValue('agent', 'outbox.max.bytes', 5000000),
+                max_age=self.configuration.getIntValue('agent', 'outbox.max.age.seconds', 86400),
+                overflow=self.configuration.getValue('agent', 'outbox.overflow') or 'drop-oldest',
+                priority=lambda topic, payload: classify(topic, payload) == 'control')
+        except Exception as ex:
+            self.logger.exception(f'Could not open outbox, messages will be dropped while offline: {ex}')
+            return None
+
+    def run(self):
+        if self.runtime == 'asyncio':
+            asyncio.run(self.__run_async())
+            return
+        self.logger.info('Starting agent')
+        self.started_at = time.monotonic()
+        self.trace.begin('connect')
+        credentials = self.configuration.getCredentials()
+        self.connect(credentials, self.serial, self.url, int(self.port), int(self.ping))
+        self.publisher.start()
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        if self.watchdog is not None and self.gateway is None:
+            self.watchdog.start()
+        if self.outbox_replayer is not None:
+            self.outbox_replayer.start()
+        # The connection itself is kept alive by the supervisor, failing initialization
+        # steps (e.g. REST calls) are retried with the same backoff policy.
+        backoff = self.create_backoff()
+        while not self.stopmarker:
+            if not self.supervisor.wait_connected():
+                break
+            self.trace.end('connect')
+            try:
+                self.trace.begin('init')
+                self.__init_agent()
+                self.__startup_phase_done('init')
+                break
+            except Exception as e:
+                self.logger.exception(f'Error on initializing C8Y Agent: {e}')
+                delay = backoff.next_delay()
+                if delay is None:
+                    break
+                self.logger.info(f'Will retry to initialize C8Y Agent in {delay:.1f} sec...')
+                time.sleep(delay)
+        if self.__initialized:
+            for sensor in self.__sensors:
+                self.schedule_sensor(sensor)
+            # A gateway runs the shared scheduler itself
+            if not self.stopmarker and self.gateway is None:
+                self.scheduler.run()
+        if not self.stopmarker and (self.supervisor.state == ConnectionSupervisor.FAILED
+                                    or not self.__initialized):
+            self.logger.error('Agent could not connect to C8Y, stopping agent')
             self.disconnect(self.__client)
-            self.logger.info('Will retry to connect to C8Y in 5 sec...')
-            time.sleep(5)
-            # Run again after 5 sec. delay.
-            self.run()
 
-    def connect(self, credentials, serial, url, port, ping):
-        try:
-            self.__client.on_connect = self.__on_connect
-            self.__client.on_message = self.__on_message
-            self.__client.on_disconnect = self.__on_disconnect
-            #self.__client.on_subscribe = self.__on_subscribe
-            self.__client.on_log = self.__on_log
-
-            if self.tls:
-                if self.cert_auth:
-                    self.logger.debug('Using certificate authenticaiton')
-                    self.__client.tls_set(certifi.where(),
-                                          certfile=self.client_cert,
-                                          keyfile=self.client_key,
-                                          tls_version=ssl.PROTOCOL_TLSv1_2,
-                                          cert_reqs=ssl.CERT_NONE
-                                          )
-                else:
-                    self.__client.tls_set(certifi.where())
-                    self.__client.username_pw_set(
-                        credentials[0]+'/' + credentials[1], credentials[2])
+    def configure_client(self, credentials):
+        self.__client.on_connect = self.__on_connect
+        self.__client.on_message = self.__on_message
+        self.__client.on_disconnect = self.__on_disconnect
+        self.__client.on_publish = self.__on_publish
+        # Window of unacknowledged QoS 1/2 messages, paho queues everything beyond it
+        self.__client.max_inflight_messages_set(
+            self.configuration.getIntValue('mqtt', 'max.inflight.messages', 20))
+        #self.__client.on_subscribe = self.__on_subscribe
+        self.__client.on_log = self.__on_log
+
+        if self.tls:
+            if self.cert_auth:
+                self.logger.debug('Using certificate authenticaiton')
+                self.__client.tls_set(certifi.where(),
+                                      certfile=self.client_cert,
+                                      keyfile=self.client_key,
+                                      tls_version=ssl.PROTOCOL_TLSv1_2,
+                                      cert_reqs=ssl.CERT_NONE
+                                      )
             else:
+                self.__client.tls_set(certifi.where())
                 self.__client.username_pw_set(
                     credentials[0]+'/' + credentials[1], credentials[2])
+        else:
+            self.__client.username_pw_set(
+                credentials[0]+'/' + credentials[1], credentials[2])
 
-            self.__client.connect(url, int(port), int(ping))
-            self.__client.loop_start()
-            return self.__client
-        except Exception as e:
-            self.logger.exception(f'Error on connecting C8Y Agent: {e}', e)
+    def connect(self, credentials, serial, url, port, ping):
+        self.configure_client(credentials)
+        self.__client.connect_async(url, int(port), int(ping))
+        self.supervisor.start()
+        return self.__client
+
+    async def __run_async(self):
+        self.logger.info('Starting agent with asyncio runtime')
+        self.started_at = time.monotonic()
+        self.trace.begin('connect')
+        self.__loop = asyncio.get_running_loop()
+        self.__async_stop = asyncio.Event()
+        self.configure_client(self.configuration.getCredentials())
+        self.__client.connect_async(self.url, int(self.port), int(self.ping))
+        mqtt_helper = AsyncioMqttHelper(self.__loop, self.__client)
+        self.publisher.start()
+        if self.metrics_server is not None:
+            self.metrics_server.start()
+        if self.watchdog is not None and self.gateway is None:
+            self.watchdog.start()
+        if self.outbox_replayer is not None:
+            self.outbox_replayer.start()
+        tasks = []
+        backoff = self.create_backoff()
+        while not self.stopmarker:
+            if not await self.__connect_async():
+                break
+            self.trace.end('connect')
+            try:
+                self.trace.begin('init')
+                await to_thread(self.__init_agent)
+                self.__startup_phase_done('init')
+                break
+            except Exception as e:
+                self.logger.exception(f'Error on initializing C8Y Agent: {e}')
+                delay = backoff.next_delay()
+                if delay is None:
+                    break
+                self.logger.info(f'Will retry to initialize C8Y Agent in {delay:.1f} sec...')
+                await asyncio.sleep(delay)
+        if self.__initialized:
+            tasks = [asyncio.ensure_future(self.__run_sensor_async(sensor)) for sensor in self.__sensors]
+            await self.__async_stop.wait()
+        elif not self.stopmarker:
+            self.logger.error('Agent could not connect to C8Y, stopping agent')
             self.disconnect(self.__client)
-            self.logger.info('Will retry to connect to C8Y in 5 sec...')
-            time.sleep(5)
-            # Run again after 5 sec. delay.
-            return self.run()
+        for task in tasks:
+            task.cancel()
+        mqtt_helper.close()
+
+    async def __run_sensor_async(self, sensor):
+        name = f'{sensor.__module__}.{sensor.__class__.__name__}'
+        deadline = self.__loop.time()
+        while not self.stopmarker:
+            try:
+                messages = await sensor.getSensorMessagesAsync()
+                if messages:
+                    for message in messages:
+                        self.publishMessage(message)
+            except Exception as ex:
+                self.logger.exception(f'Error in sensor {name}: {ex}')
+            interval = sensor.getInterval() or self.get_main_loop_interval()
+            deadline += interval
+            now = self.__loop.time()
+            if deadline <= now:
+                missed = int((now - deadline) // interval) + 1
+                deadline += missed * interval
+                self.logger.warning(f'Sensor {name} missed {missed} deadline(s)')
+            await asyncio.sleep(deadline - now)
+
+    async def __connect_async(self):
+        # Same state machine and backoff as the threaded supervisor, driven by the loop
+        supervisor = self.supervisor
+        while not self.stopmarker:
+            if supervisor.state == supervisor.BACKOFF:
+                delay = supervisor.next_delay()
+                if delay is None:
+                    return False
+                await asyncio.sleep(delay)
+            supervisor.begin_attempt()
+            try:
+                await to_thread(self.__client.reconnect)
+            except Exception as e:
+                self.logger.warning(f'Connecting to MQTT Broker failed: {e}')
+                supervisor.connection_lost()
+            while supervisor.state == supervisor.CONNECTING:
+                await asyncio.sleep(0.1)
+                supervisor.check_timeout()
+            if supervisor.state == supervisor.CONNECTED:
+                return True
+            if supervisor.state in (supervisor.STOPPED, supervisor.FAILED):
+                return False
+        return False
+
+    async def __reconnect_async(self):
+        if self.__reconnecting:
+            return
+        self.__reconnecting = True
+        try:
+            if not await self.__connect_async() and self.supervisor.state == self.supervisor.FAILED:
+                self.stop()
+        finally:
+            self.__reconnecting = False
+
+    async def __refresh_token_async(self):
+        while not self.stopmarker:
+            # A received token changes the next refresh time, so check regularly
+            await asyncio.sleep(min(self.token_manager.poll(), 5))
+
+    def __start_initializers(self, initializers):
+        if self.__loop is not None:
+            asyncio.run_coroutine_threadsafe(
+                to_thread(self.__run_initializers, initializers), self.__loop)
+            return
+        startup_thread = threading.Thread(target=self.__run_initializers, args=(initializers,))
+        startup_thread.daemon = True
+        startup_thread.name = 'StartupThread'
+        startup_thread.start()
+
+    def __run_initializers(self, initializers):
+        pool = WorkerPool('InitializerThread',
+            workers=self.configuration.getIntValue('agent', 'startup.workers', 4),
+            queue_size=max(1, len(initializers)),
+            watchdog=self.watchdog)
+        graph = StartupGraph(initializers, self.handle_initializer_message, pool)
+        self.trace.begin('initializers')
+        completed = graph.run(self.configuration.getIntValue('agent', 'startup.budget.seconds', 120))
+        self.trace.end('initializers')
+        graph.close()
+        elapsed = time.monotonic() - self.started_at
+        self.startup_report = graph.report()
+        for name, entry in self.startup_report.items():
+            if entry['duration'] is not None:
+                self.logger.debug(f'Initializer {name} took {entry["duration"]:.2f} sec')
+            if entry['start'] is not None:
+                self.trace.add(name, graph.started + entry['start'], entry['duration'], 'initializers',
+                               failed=entry['failed'])
+        self.__startup_phase_done('initializers')
+        if completed:
+            text = f'C8Y DM Agent ready after {elapsed:.1f} sec'
+        else:
+            text = f'C8Y DM Agent startup budget exceeded after {elapsed:.1f} sec, pending: {", ".join(graph.pending())}'
+        self.logger.info(text)
+        self.publishMessage(SmartRESTMessage('s/us', '400', ['c8y_AgentStartupComplete', text]))
+
+    def __startup_phase_done(self, phase):
+        # The agent is ready once it is initialized and its initializers are finished
+        self.trace.end(phase)
+        with self.__pending_lock:
+            if self.__startup_pending is None:
+                return
+            self.__startup_pending.discard(phase)
+            if self.__startup_pending:
+                return
+            self.__startup_pending = None
+        self.__publish_startup_trace()
+
+    def __publish_startup_trace(self):
+        # Time to ready counts from the start of the process, see StartupTrace
+        series = [('ready', self.trace.finish())] + list(self.trace.durations().items())
+        values = ['c8y_AgentStartup', '']
+        for name, seconds in series:
+            values.extend(['c8y_AgentStartup', name, round(seconds, 3), 's'])
+        self.publishMessage(SmartRESTMessage('s/us', '201', values))
+
+    def __dispatch(self, listener, message):
+        self.operations.submit(listener, message)
+
+    def __run_operation(self, operation):
+        if self.__loop is not None:
+            asyncio.run_coroutine_threadsafe(self.operations.execute_async(operation), self.__loop)
+            return True
+        return self.listener_pool.submit(self.operations.execute, operation,
+                                         name=f'{self.__job_prefix}{operation.listener.__class__.__name__}',
+                                         budget=operation.policy.timeout)
+
+    def __report_operation_timeout(self, operation, reason):
+        return self.publishMessage(SmartRESTMessage('s/us', '502', [operation.fragment, reason]))
+
+    def __reconcile_operations(self, executing):
+        if self.journal is None:
+            self.rest_client.set_operations_to_failed(executing)
+            return
+        idempotent = set()
+        listeners = {}
+        for listener in self.__listeners:
+            idempotent.update(listener.getIdempotentOperations() or [])
+            listeners[listener.__class__.__name__] = listener
+        for action, operation, entry in self.journal.reconcile(executing, idempotent):
+            if action == 'resume':
+                listener = listeners.get(entry.listener)
+                if listener is not None:
+                    self.logger.info(f'Resuming {entry.fragment} operation {operation["id"]} after restart')
+                    self.operations.submit(listener, entry.message(), entry)
+                    continue
+                action = 'failed'
+            if action == 'successful':
+                self.logger.info(f'Operation {operation["id"]} was finished before the restart, setting it to SUCCESSFUL')
+                done = self.rest_client.set_operation_status(operation['id'], 'SUCCESSFUL')
+            elif action == 'failed':
+                self.logger.info(f'Operation {operation["id"]} was interrupted, setting it to FAILED')
+                done = self.rest_client.set_operation_status(
+                    operation['id'], 'FAILED', 'Operation unexpectedly interrupted. Check logs for details')
+            else:
+                done = True
+            if entry is not None and done:
+                self.journal.remove(entry.id)
 
     def disconnect(self, client):
         self.logger.info("Disconnecting MQTT Client")
+        self.operations.stop()
+        if self.operation_poller is not None:
+            self.operation_poller.stop()
+        self.publisher.stop()
         self.__client = None
+        self.is_connected = False
+        # Stop the supervisor first, the requested disconnect must not trigger a reconnect
+        self.supervisor.stop()
+        if self.outbox_replayer is not None:
+            self.outbox_replayer.stop()
         if client == None:
             return
-        client.loop_stop()  # stop the loop
         client.disconnect()
         if self.cert_auth:
             self.logger.info("Stopping refresh token thread")
-            self.stop_event.set()
+            self.token_manager.stop()
+            if self.gateway is not None:
+                self.scheduler.remove_job(f'{self.__job_prefix}TokenManager')
         
 
     def stop(self):
-        msg = SmartRESTMessage('s/us', '400', ['c8y_AgentStopEvent', 'C8Y DM Agent stopped'])
-        self.publishMessage(msg, qos=0, wait_for_publish=True)
+        """
+        Shuts the agent down gracefully. No new operations are accepted, running
+        operations and pending messages get up to agent.shutdown.timeout.seconds to
+        finish. Messages that were not acknowledged by then are kept in the outbox and
+        sent after the next start.
+        """
+        started = time.monotonic()
+        # With the asyncio runtime nothing can run or be sent once the event loop has ended
+        loop_running = self.__loop is None or self.__loop.is_running()
+        timeout = self.configuration.getIntValue('agent', 'shutdown.timeout.seconds', 30) if loop_running else 0
+        deadline = started + timeout
+
+        def remaining():
+            return max(deadline - time.monotonic(), 0)
+
+        self.logger.info('Shutting down, waiting for running operations and pending messages')
+        self.__stopping = True
+        self.__stop_jobs()
+        if self.operation_poller is not None:
+            self.operation_poller.stop()
+        self.sensor_pool.join(remaining())
+        unfinished = self.operations.drain(remaining())
+        for operation in unfinished:
+            self.logger.warning(f'Operation {operation.name} did not finish before shutdown, '
+                                'it is reconciled after the next start')
+        if loop_running:
+            msg = SmartRESTMessage('s/us', '400', ['c8y_AgentStopEvent', 'C8Y DM Agent stopped'])
+            self.publishMessage(msg, qos=0)
+        self.publisher.stop(remaining())
+        self.inflight.drain(remaining())
+        if self.outbox_replayer is not None:
+            self.outbox_replayer.stop(remaining())
+        kept, dropped = self.__keep_unacknowledged()
         self.disconnect(self.__client)
+        if not unfinished:
+            # Listeners still running might write to them
+            if self.outbox is not None:
+                self.outbox.close()
+            if self.journal is not None:
+                self.journal.close()
+        self.logger.info(f'Shutdown finished in {time.monotonic() - started:.1f} sec: '
+                         f'{len(unfinished)} unfinished operation(s), {kept} message(s) kept in outbox, '
+                         f'{dropped} message(s) dropped')
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.watchdog is not None and self.gateway is None:
+            self.watchdog.stop()
         self.stopmarker = 1
+        if self.__loop is not None and self.__loop.is_running():
+            self.__loop.call_soon_threadsafe(self.__async_stop.set)
+
+    def __keep_unacknowledged(self):
+        kept = dropped = 0
+        for future in self.inflight.take_pending():
+            if self.outbox is not None and future.payload is not None \
+                    and self.outbox.put(future.topic, future.payload, future.qos):
+                future.resolve(PublishFuture.QUEUED)
+                kept += 1
+            else:
+                self.logger.warning(f'Dropping unacknowledged message on {future.topic}: {future.payload}')
+                future.resolve(PublishFuture.FAILED, 'shutdown')
+                dropped += 1
+        return kept, dropped
+
+    def __stop_jobs(self):
+        if self.gateway is None:
+            self.scheduler.stop()
+        else:
+            self.scheduler.clear(self.__job_prefix)
 
     def pollPendingOperations(self):
-        while not self.stopmarker:
-            try:
-                time.sleep(15)
-                self.logger.debug('Polling for pending Operations')
-                pending = SmartRESTMessage('s/us', '500', [])
-                self.publishMessage(pending)
-            except Exception as e:
-                self.logger.error(
-                    'Error on polling for Pending Operations: ' + str(e))
+        if self.__client_connected():
+            self.logger.debug('Polling for pending Operations')
+            pending = SmartRESTMessage('s/us', '500', [])
+            self.publishMessage(pending)
 
     def __init_agent(self):
         self.__listeners = []
         self.__sensors = []
+        self.scheduler.clear(self.__job_prefix)
 
         self.__client.subscribe('s/e')
-        #self.__client.subscribe('s/dat',2)
+        # Token responses arrive on s/dat
+        self.__client.subscribe('s/dat',2)
 
         # Refresh Token for REST Requests
-        if self.cert_auth:
+        # The scheduler jobs of a gateway identity were cleared above, its job is added again
+        if self.cert_auth and (self.__token_thread is None or self.gateway is not None):
+            if self.token_manager.load():
+                self.__update_token(self.token_manager.get_token())
             self.logger.info("Starting refresh token thread ")
-            token_thread = threading.Thread(target=self.refresh_token)
-            token_thread.daemon = True
-            token_thread.name = f'TokenThread-1'
-            token_thread.start()
+            if self.__loop is not None:
+                self.__token_thread = asyncio.run_coroutine_threadsafe(
+                    self.__refresh_token_async(), self.__loop)
+            elif self.gateway is not None:
+                # Like the asyncio runtime, check regularly as a received token changes the refresh time
+                self.__token_thread = self.scheduler.add_job(
+                    f'{self.__job_prefix}TokenManager', self.token_manager.poll, 5)
+            else:
+                self.__token_thread = threading.Thread(target=self.refresh_token)
+                self.__token_thread.daemon = True
+                self.__token_thread.name = f'TokenThread-1'
+                self.__token_thread.start()
         else:
             # For non cert-auth don't wait for token retrieval.
             self.token_received.set()
         
         # set Device Name
         msg = SmartRESTMessage('s/us', '100', [self.device_name, self.device_type])
-        self.publishMessage(msg, 2, wait_for_publish=True)
+        device_created = self.publishMessage(msg, 2)
 
         #self.logger.info(f'Device published!')
         configurationManager = ConfigurationManager(
             self.serial, self, self.configuration)
+        # The device has to exist before anything else is sent for it
+        if not device_created.wait():
+            self.logger.warning(f'Device creation message was not published: {device_created.state}')
 
         messages = configurationManager.getMessages()
         for message in messages:
             self.logger.debug('Send topic: %s, msg: %s',
                               message.topic, message.getMessage())
-            self.__client.publish(message.topic, message.getMessage())
+            self.publishMessage(message)
         self.__listeners.append(configurationManager)
         self.__supportedOperations.update(
             configurationManager.getSupportedOperations())
 
         # Load custom modules
-        modules = moduleloader.findAgentModules()
-        classCache = {}
-
-        for sensor in modules['sensors']:
-            currentSensor = sensor(self.serial, self)
-            classCache[sensor.__name__] = currentSensor
-            self.__sensors.append(currentSensor)
-        for listener in modules['listeners']:
-            if listener.__name__ in classCache:
-                currentListener = classCache[listener.__name__]
-            else:
-                currentListener = listener(self.serial, self)
-                classCache[listener.__name__] = currentListener
+        modules = moduleloader.loadAgentModules(self.serial, self, self.create_module_manifest(), self.trace,
+            enabled=self.get_module_names('modules.enabled'),
+            disabled=self.get_module_names('modules.disabled'),
+            lazy=self.configuration.getBooleanValue('agent', 'modules.lazy') is not False)
+        self.__sensors.extend(modules['sensors'])
+        for currentListener in modules['listeners']:
             supportedOperations = currentListener.getSupportedOperations()
             supportedTemplates = currentListener.getSupportedTemplates()
             if supportedOperations is not None:
@@ -239,20 +761,12 @@ class Agent():
             if supportedTemplates is not None:
                 self.__supportedTemplates.update(supportedTemplates)
             self.__listeners.append(currentListener)
-        for initializer in modules['initializers']:
-            if initializer.__name__ in classCache:
-                currentInitializer = classCache[initializer.__name__]
-            else:
-                currentInitializer = initializer(self.serial, self)
-                classCache[initializer.__name__] = currentInitializer
-            
-            init_thread = threading.Thread(target=self.handle_initializer_message, args=(currentInitializer,))
-            init_thread.daemon = True
-            init_thread.name = f'InitializerThread-{currentInitializer.__class__.__name__}'
-            init_thread.start()
-            #_thread.start_new_thread(self.handle_initializer_message, (currentInitializer,))
+        self.__start_initializers(modules['initializers'])
 
-        classCache = None
+        health_interval = self.configuration.getIntValue('agent', 'health.interval.seconds', 0)
+        if health_interval > 0:
+            self.__sensors.append(AgentHealthSensor(self.serial, self, health_interval))
+        self.router = MessageRouter(self.__listeners)
 
         # set supported operations
         self.logger.info('Supported operations:')
@@ -276,92 +790,210 @@ class Agent():
             's/us', 110, [self.serial, self.model, '1.0'])
         self.publishMessage(modelMsg)
 
+        # Reconcile operations left EXECUTING by the previous run before new ones arrive
+        if self.cert_auth:
+            self.token_manager.await_token(self.refresh_token_interval)
+        internald_id = self.rest_client.get_internal_id(self.serial)
+        ops = self.rest_client.get_all_dangling_operations(internald_id)
+        if ops is None:
+            self.logger.warning('Could not retrieve EXECUTING operations, skipping reconciliation')
+        else:
+            self.__reconcile_operations(ops)
+
         # If supported Operations is set subscribe to s/ds
-        self.__client.subscribe('s/ds')
+        self.__subscribe()
+        with self.__pending_lock:
+            self.__initialized = True
+            pending, self.__pending_messages = self.__pending_messages, []
+        for message in pending:
+            self.__handle_message(message)
+        if self.operation_poller is not None:
+            self.operation_poller.start()
+
+    def __subscribe(self):
+        # QoS 1 lets the broker queue operations for a persistent session
+        qos = 0 if self.clean_session else 1
+        self.__client.subscribe('s/e')
+        self.__client.subscribe('s/ds', qos)
         self.__client.subscribe('s/dat',2)
 
         # subscribe additional topics
         for xid in self.__supportedTemplates:
             self.logger.info('Subscribing to XID: %s', xid)
-            self.__client.subscribe('s/dc/' + xid)
-
-        # Set all dangling Operations to failed on Agent start
-      
-        internald_id = self.rest_client.get_internal_id(self.serial)
-        ops = self.rest_client.get_all_dangling_operations(internald_id)
-        self.rest_client.set_operations_to_failed(ops)
-
+            self.__client.subscribe('s/dc/' + xid, qos)
 
     def __on_connect(self, client, userdata, flags, rc):
         try:
             self.logger.info('Agent connected with result code: ' + str(rc))
+            self.is_connected = rc == 0
+            session_present = bool(flags.get('session present')) and not self.clean_session
+            self.supervisor.connected(rc, session_present)
             if rc > 0:
-                self.logger.warning(
-                    'Disconnecting Agent and try to re-connect manually..')
-                # TODO What should be done when rc != 0? Reconnect? Abort?
-                self.disconnect(self.__client)
-                time.sleep(5)
-                self.logger.info('Restarting Agent ..')
-                self.run()
-            else:
-                self.is_connected = True
+                self.logger.warning('Connection refused, trying to re-connect..')
+                if self.__loop is not None and self.__initialized:
+                    asyncio.run_coroutine_threadsafe(self.__reconnect_async(), self.__loop)
+            elif self.__initialized:
+                if session_present:
+                    self.logger.info('Resumed persistent session, subscriptions are still active')
+                else:
+                    # Subscriptions are gone with the old session
+                    self.__subscribe()
+                if self.operation_poller is not None:
+                    self.operation_poller.reset()
+            if rc == 0 and self.outbox_replayer is not None:
+                self.outbox_replayer.wake()
         except Exception as ex:
             self.logger.error(ex)
 
     def __on_message(self, client, userdata, msg):
         try:
             decoded = msg.payload.decode('utf-8')
-            messageParts = decoded.split(',')
-            message = SmartRESTMessage(
-                msg.topic, messageParts[0], messageParts[1:])
-            self.logger.info('Received: topic=%s msg=%s',
-                          message.topic, message.getMessage())
-            if message.messageId == '71':
-                self.token = message.values[0]
-                self.logger.debug('New JWT Token received')
-                self.rest_client.update_token(self.token)
-                self.token_received.set()
-            for listener in self.__listeners:
-                self.logger.debug('Trigger listener ' +
-                              listener.__class__.__name__)
-                listener_thread = threading.Thread(target=listener.handleOperation, args=(message,))
-                listener_thread.daemon = True
-                listener_thread.name = f'ListenerThread-{listener.__class__.__name__}'
-                listener_thread.start()
-                #_thread.start_new_thread(listener.handleOperation, (message,))
+            # One payload can contain several operations, one per line
+            self.messages_received.inc(topic=msg.topic, **self.metric_labels)
+            for message in SmartRESTParser.parse(msg.topic, decoded):
+                self.__handle_message(message)
         except Exception as e:
             self.logger.error(f'Error on handling MQTT Message.', e)
 
+    def __handle_message(self, message):
+        self.logger.info('Received: topic=%s msg=%s',
+                      message.topic, message.getMessage())
+        if is_operation(message):
+            if self.__stopping:
+                # The operation stays pending in the platform and is polled after the next start
+                self.logger.info(f'Shutting down, ignoring operation: {message.getMessage()}')
+                return
+            with self.__pending_lock:
+                if not self.__initialized:
+                    # A persistent session delivers queued operations before the listeners are loaded
+                    self.__pending_messages.append(message)
+                    return
+            if self.recent_operations.seen(message):
+                self.logger.warning(f'Ignoring duplicate operation: {message.getMessage()}')
+                return
+            if self.operation_poller is not None:
+                self.operation_poller.reset()
+        if message.messageId == '71':
+            self.logger.debug('New JWT Token received')
+            self.token_manager.update(message.values[0])
+            self.__update_token(message.values[0])
+        for listener in self.router.route(message):
+            self.logger.debug('Trigger listener ' +
+                          listener.__class__.__name__)
+            self.__dispatch(listener, message)
+
     def __on_disconnect(self, client, userdata, rc):
         self.logger.debug("on_disconnect rc: " + str(rc))
         # if rc==5:
         #     self.reset()
         #     return
+        self.is_connected = False
+        self.inflight.connection_lost()
         if rc != 0:
             self.logger.error(f'Disconnected with result code {rc}! Trying to reconnect...')
-            #self.__client.reconnect()
-            time.sleep(5)
-            # Run again after 5 sec. delay.
-            return self.run()
+            self.supervisor.connection_lost(rc)
+            if self.__loop is not None and self.__initialized:
+                asyncio.run_coroutine_threadsafe(self.__reconnect_async(), self.__loop)
 
     def __on_log(self, client, userdata, level, buf):
         self.logger.log(level, buf)
 
+    def __on_publish(self, client, userdata, mid):
+        self.inflight.acknowledge(mid)
+
     def publishMessage(self, message, qos=0, wait_for_publish=False):
-        self.logger.debug(f'Send: topic={message.topic} msg={message.getMessage()}')
-        if self.__client is not None and self.__client.is_connected:
-            if wait_for_publish:
-                self.__client.publish(message.topic, message.getMessage(), qos).wait_for_publish()
+        """
+        Publishes a SmartREST message and returns a PublishFuture. The future resolves
+        when the message was written (QoS 0) or acknowledged by the broker (QoS 1/2),
+        so callers can pipeline acknowledged publishes and wait for them later.
+        With wait_for_publish the call blocks until the future is resolved.
+        """
+        client = self.__client
+        payload = message.getMessage()
+        future = PublishFuture(message.topic, qos, payload=payload)
+        if is_suppressed(message):
+            self.logger.info(f'Dropping status update of timed out operation: {payload}')
+            self.inflight.fail([future], 'operation timed out')
+            return future
+        self.logger.debug(f'Send: topic={message.topic} msg={payload}')
+        # While a backlog exists new messages are queued behind it to keep the order,
+        # only control messages like operation updates may skip it
+        if self.outbox is not None and (not self.__client_connected()
+                                        or self.outbox.holds_back(message.topic, payload)):
+            self.__store(message.topic, payload, qos, [future])
+        elif client is None or not client.is_connected():
+            self.inflight.fail([future], 'not connected')
+        elif wait_for_publish:
+            # Lines still waiting in the publisher go first
+            self.publisher.flush()
+            self.__send(message.topic, payload, qos, [future])
+            future.wait()
+        else:
+            future = self.publisher.publish(message.topic, payload, qos)
+        operation = current_operation()
+        if operation is not None and message.topic == 's/us':
+            self.operations.status(operation, message.messageId, future)
+        return future
+
+    def __send(self, topic, payload, qos, futures=()):
+        client = self.__client
+        if client is not None and client.is_connected():
+            self.rate_limiter.acquire(len(payload.encode('utf-8')))
+        with self.inflight.publishing():
+            info = client.publish(topic, payload, qos) if client is not None else None
+            if (info is None or info.rc == mqtt.MQTT_ERR_NO_CONN) and self.outbox is not None:
+                self.__store(topic, payload, qos, futures)
+                return None
+            if info is None:
+                self.inflight.fail(futures, 'not connected')
+            elif info.rc == mqtt.MQTT_ERR_SUCCESS or (info.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0):
+                # QoS 1/2 messages stay queued in paho and are sent after reconnect
+                self.inflight.track(info.mid, futures)
             else:
-                self.__client.publish(message.topic, message.getMessage(), qos)
-
+                self.inflight.fail(futures, mqtt.error_string(info.rc))
+            return info
+
+    def __can_send(self):
+        client = self.__client
+        # Let lines wait in the publisher lanes while the socket still has data to write,
+        # offline they go to the outbox right away
+        return client is None or not client.is_connected() or not client.want_write()
+
+    def __client_connected(self):
+        client = self.__client
+        return client is not None and client.is_connected()
+
+    def __store(self, topic, payload, qos, futures=()):
+        self.logger.debug(f'Offline, storing message for {topic} in outbox')
+        if not self.outbox.put(topic, payload, qos):
+            self.logger.warning(f'Outbox rejected message on {topic}, dropping it: {payload}')
+            self.inflight.fail(futures, 'outbox rejected message')
+            return
+        self.outbox_replayer.wake()
+        for future in futures:
+            future.resolve(PublishFuture.QUEUED)
+
+    def __publish_stored(self, topic, payload, qos):
+        client = self.__client
+        if client is None or not client.is_connected():
+            return False
+        self.rate_limiter.acquire(len(payload.encode('utf-8')))
+        info = client.publish(topic, payload, qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            return False
+        info.wait_for_publish(timeout=10)
+        return info.is_published()
+
+
+    def __update_token(self, token):
+        self.token = token
+        self.rest_client.update_token(token)
+
+    def __request_token(self):
+        client = self.__client
+        if client is not None:
+            client.publish('s/uat','',0)
 
     def refresh_token(self):
-        self.stop_event.clear()
-        time.sleep(5)
-        while True:
-            self.logger.debug("Refreshing Token")
-            self.__client.publish('s/uat','',0)
-            if self.stop_event.wait(timeout=self.refresh_token_interval):
-                self.logger.info("Exit Refreshing Token Thread")
-                break
+        self.token_manager.run()
+        self.logger.info("Exit Refreshing Token Thread")
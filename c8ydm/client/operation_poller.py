@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import logging
+import threading
+import time
+
+
+class OperationPoller:
+    """
+    Requests pending operations with an adaptive interval.
+
+    Right after a (re)connect or a received operation the platform is polled every
+    `min_interval` seconds, more operations are likely then. Every poll without news
+    doubles the interval up to `max_interval`, so an idle device hardly adds traffic.
+    With a Scheduler the polls run as its job `name` instead of on an own thread.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, poll, min_interval=5, max_interval=300, factor=2, clock=time.monotonic,
+                 scheduler=None, name='OperationPoller'):
+        self.poll = poll
+        self.min_interval = max(float(min_interval), 0.1)
+        self.max_interval = max(float(max_interval), self.min_interval)
+        self.factor = max(float(factor), 1.0)
+        self.clock = clock
+        self.interval = self.min_interval
+        self._next = clock() + self.interval
+        self._condition = threading.Condition()
+        self.scheduler = scheduler
+        self.name = name
+        self._thread = None
+        self._job = None
+        self._stopped = False
+        self.polls = 0
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None or self._job is not None:
+                return
+            self._stopped = False
+            if self.scheduler is not None:
+                self._schedule(self.interval)
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True, name='OperationPoller')
+        self._thread.start()
+
+    def reset(self):
+        """
+        Switches back to the fast interval, the next poll happens within `min_interval`.
+        """
+        with self._condition:
+            self.interval = self.min_interval
+            self._next = min(self._next, self.clock() + self.interval)
+            self._condition.notify_all()
+            if self._job is not None and self._job.deadline - self.scheduler.clock() > self.interval:
+                self._schedule(self.interval)
+
+    def _schedule(self, delay):
+        # The scheduler takes the interval after a poll before the poll runs
+        self._job = self.scheduler.add_job(
+            self.name, self._tick, lambda: min(self.interval * self.factor, self.max_interval), delay=delay)
+
+    def _tick(self):
+        with self._condition:
+            if self._stopped:
+                return
+            self.interval = min(self.interval * self.factor, self.max_interval)
+        self._poll()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and self.clock() < self._next:
+                    self._condition.wait(self._next - self.clock())
+                if self._stopped:
+                    return
+                self.interval = min(self.interval * self.factor, self.max_interval)
+                self._next = self.clock() + self.interval
+            self._poll()
+
+    def _poll(self):
+        try:
+            self.polls += 1
+            self.poll()
+        except Exception as ex:
+            self.logger.error(f'Error on polling for pending operations: {ex}')
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+            if self._job is not None:
+                self.scheduler.remove_job(self.name)
+                self._job = None
+
+    def stats(self):
+        with self._condition:
+            return {'polls': self.polls, 'interval': self.interval}
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+
+class Outbox:
+    """
+    Persistent store-and-forward queue for outbound MQTT messages.
+
+    Messages are journaled in a SQLite database and kept in insertion order. The
+    outbox is bounded by number of messages, bytes and age. Expired messages are
+    removed first; when a budget is still exceeded the overflow policy decides
+    which messages are evicted:
+
+    - drop-oldest: discard the oldest stored messages (default)
+    - drop-newest: reject the new message
+
+    Messages for which `priority(topic, payload)` is True may skip a backlog as long
+    as no other priority message is stored, see holds_back().
+    """
+    logger = logging.getLogger(__name__)
+    OVERFLOW_POLICIES = ('drop-oldest', 'drop-newest')
+
+    def __init__(self, path, max_messages=10000, max_bytes=5000000, max_age=86400,
+                 overflow='drop-oldest', clock=time.time, priority=None):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy {overflow}. Use one of {self.OVERFLOW_POLICIES}')
+        self.path = path
+        self.max_messages = max(1, int(max_messages))
+        self.max_bytes = max(1, int(max_bytes))
+        # 0 disables the age limit
+        self.max_age = max(0, int(max_age))
+        self.overflow = overflow
+        self.clock = clock
+        self.priority = priority
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS outbox ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, '
+                         'payload TEXT NOT NULL, qos INTEGER NOT NULL, '
+                         'created REAL NOT NULL, size INTEGER NOT NULL)')
+        self.depth, self.bytes = self._db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM outbox').fetchone()
+        self.peak_depth = self.depth
+        self.priority_depth = 0
+        if self.depth and priority is not None:
+            self.priority_depth = sum(self._is_priority(topic, payload) for topic, payload in
+                                      self._db.execute('SELECT topic, payload FROM outbox'))
+        self.enqueued = 0
+        self.replayed = 0
+        self.evicted = 0
+        self.expired = 0
+        self.errors = 0
+        if self.depth:
+            self.logger.info(f'Outbox contains {self.depth} message(s) ({self.bytes} bytes) from a previous run')
+
+    def put(self, topic, payload, qos=0):
+        """
+        Stores a message. Returns False if the message was rejected because the
+        outbox is full or could not be written.
+        """
+        size = len(topic) + len(payload.encode('utf-8'))
+        with self._lock:
+            try:
+                return self._put(topic, payload, qos, size)
+            except sqlite3.Error as ex:
+                self.errors += 1
+                self.logger.error(f'Could not store message on {topic} in outbox: {ex}')
+                return False
+
+    def _put(self, topic, payload, qos, size):
+        self._expire()
+        if self.depth + 1 > self.max_messages or self.bytes + size > self.max_bytes:
+            if self.overflow == 'drop-newest' or size > self.max_bytes:
+                self.evicted += 1
+                self.logger.warning(f'Outbox full ({self.depth} messages, {self.bytes} bytes), '
+                                    f'dropping message on {topic}')
+                return False
+            self._evict(size)
+        self._db.execute('INSERT INTO outbox (topic, payload, qos, created, size) VALUES (?, ?, ?, ?, ?)',
+                         (topic, payload, qos, self.clock(), size))
+        self.depth += 1
+        self.bytes += size
+        self.priority_depth += self._is_priority(topic, payload)
+        self.enqueued += 1
+        self.peak_depth = max(self.peak_depth, self.depth)
+        return True
+
+    def _evict(self, size):
+        evicted = 0
+        while self.depth and (self.depth + 1 > self.max_messages or self.bytes + size > self.max_bytes):
+            row = self._db.execute('SELECT id, size, topic, payload FROM outbox ORDER BY id LIMIT 1').fetchone()
+            self._db.execute('DELETE FROM outbox WHERE id = ?', (row[0],))
+            self.depth -= 1
+            self.bytes -= row[1]
+            self.priority_depth -= self._is_priority(row[2], row[3])
+            evicted += 1
+        self.evicted += evicted
+        self.logger.warning(f'Outbox full, dropped {evicted} oldest message(s)')
+
+    def _expire(self):
+        if not self.max_age or not self.depth:
+            return
+        limit = self.clock() - self.max_age
+        count, size = self._db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM outbox WHERE created < ?', (limit,)).fetchone()
+        if count:
+            if self.priority_depth:
+                self.priority_depth -= sum(self._is_priority(topic, payload) for topic, payload in
+                                           self._db.execute('SELECT topic, payload FROM outbox WHERE created < ?',
+                                                            (limit,)).fetchall())
+            self._db.execute('DELETE FROM outbox WHERE created < ?', (limit,))
+            self.depth -= count
+            self.bytes -= size
+            self.expired += count
+            self.logger.warning(f'Dropped {count} message(s) older than {self.max_age} sec from outbox')
+
+    def peek(self, limit=50):
+        """
+        Returns up to `limit` of the oldest messages as (id, topic, payload, qos).
+        """
+        with self._lock:
+            self._expire()
+            return self._db.execute('SELECT id, topic, payload, qos FROM outbox ORDER BY id LIMIT ?',
+                                    (limit,)).fetchall()
+
+    def remove(self, message_id):
+        with self._lock:
+            row = self._db.execute('SELECT size, topic, payload FROM outbox WHERE id = ?',
+                                   (message_id,)).fetchone()
+            if row is None:
+                return
+            self._db.execute('DELETE FROM outbox WHERE id = ?', (message_id,))
+            self.depth -= 1
+            self.bytes -= row[0]
+            self.priority_depth -= self._is_priority(row[1], row[2])
+            self.replayed += 1
+
+    def holds_back(self, topic, payload):
+        """
+        Returns True if a new message has to be stored behind the backlog to keep the
+        order. Priority messages skip it unless older priority messages are stored.
+        """
+        if not self.depth:
+            return False
+        return self.priority_depth > 0 or not self._is_priority(topic, payload)
+
+    def _is_priority(self, topic, payload):
+        return self.priority is not None and bool(self.priority(topic, payload))
+
+    def __len__(self):
+        return self.depth
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': self.depth,
+                'bytes': self.bytes,
+                'peak_depth': self.peak_depth,
+                'priority_depth': self.priority_depth,
+                'enqueued': self.enqueued,
+                'replayed': self.replayed,
+                'evicted': self.evicted,
+                'expired': self.expired,
+                'errors': self.errors,
+            }
+
+
+class OutboxReplayer:
+    """
+    Drains an Outbox at a limited rate while the connection is up.
+
+    `publish(topic, payload, qos)` must return True once the broker accepted the
+    message; the message is only removed from the outbox afterwards, so a
+    connection loss during replay does not lose anything. The replay thread only
+    exists while the outbox is drained, an idle replayer holds no thread.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, outbox, publish, is_connected, rate=20, batch=50):
+        self.outbox = outbox
+        self.publish = publish
+        self.is_connected = is_connected
+        self.rate = max(float(rate), 0.1)
+        self.batch = batch
+        self._lock = threading.Lock()
+        self._started = False
+        self._pending = False
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            self._started = True
+        self.wake()
+
+    def wake(self):
+        """
+        Starts a replay of the stored messages once the connection is up.
+        """
+        with self._lock:
+            self._pending = True
+            if not self._started or self._stopped or self._thread is not None:
+                return
+            if not len(self.outbox) or not self.is_connected():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True, name='OutboxReplay')
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._stopped or not self._pending:
+                    self._thread = None
+                    return
+                self._pending = False
+            self._drain()
+
+    def _drain(self):
+        replayed = 0
+        while not self._stopped and self.is_connected() and len(self.outbox):
+            for message_id, topic, payload, qos in self.outbox.peek(self.batch):
+                if self._stopped or not self.is_connected() or not self.publish(topic, payload, qos):
+                    self.logger.info(f'Outbox replay interrupted after {replayed} message(s)')
+                    return
+                self.outbox.remove(message_id)
+                replayed += 1
+                time.sleep(1 / self.rate)
+        if replayed:
+            self.logger.info(f'Replayed {replayed} message(s) from outbox')
+
+    def stop(self, timeout=None):
+        """
+        Stops the replay. With a timeout the call waits for a running replay step to end.
+        """
+        with self._lock:
+            self._stopped = True
+            thread = self._thread
+        if timeout is not None and thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from c8ydm.client.inflight import PublishFuture
+
+# Lanes in order of priority with their share of payloads while all of them are busy
+LANES = (('control', 8), ('default', 4), ('telemetry', 1))
+
+
+def classify(topic, payload):
+    """
+    Returns the lane of a SmartREST line by its message id. Operation updates (5xx)
+    and alarms (3xx) are control traffic, measurements (2xx) are telemetry.
+    """
+    if not topic.startswith('s/us'):
+        return 'default'
+    message_id = payload[:3]
+    if message_id[:1] in ('3', '5'):
+        return 'control'
+    if message_id[:1] == '2':
+        return 'telemetry'
+    return 'default'
+
+
+class _Batch:
+
+    def __init__(self, key, deadline, created):
+        self.key = key
+        self.topic, self.qos, _ = key
+        self.deadline = deadline
+        self.created = created
+        self.lines = []
+        self.futures = []
+        self.size = 0
+
+
+class _Lane:
+
+    def __init__(self, name, weight):
+        self.name = name
+        self.weight = max(int(weight), 1)
+        self.credit = self.weight
+        self.batches = deque()
+        self.payloads = 0
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+        self.total_wait = 0.0
+
+    def stats(self):
+        return {
+            'pending': sum(len(batch.lines) for batch in self.batches),
+            'payloads': self.payloads,
+            'last_wait': self.last_wait,
+            'max_wait': self.max_wait,
+            'avg_wait': self.total_wait / self.payloads if self.payloads else None,
+        }
+
+
+class CoalescingPublisher:
+    """
+    Groups SmartREST lines published to the same topic with the same QoS within a
+    short window into one newline separated MQTT payload and drains them by priority.
+
+    Only topics starting with one of `prefixes` are coalesced, everything else is
+    passed to `send(topic, payload, qos, futures)` immediately. Lines are sorted into
+    the lanes of `LANES` by `classify(topic, payload)` and batched per lane. A batch
+    becomes ready when its window expires or when the next line would exceed
+    `max_payload` bytes. Ready batches are only handed to `send` while `can_send()`
+    reports free capacity of the transport, so a backlog builds up here and not behind
+    the socket. The lanes are drained by weighted round robin: while all lanes have
+    ready batches every lane gets its weight of payloads per round, so operation
+    updates overtake measurements without starving them. Lines of one lane are always
+    sent in the order they were published. Every published line gets a PublishFuture,
+    the lines of a batch share the outcome of their payload.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, send, window=0.05, max_payload=16384, prefixes=('s/us', 's/uc/'),
+                 can_send=None, lanes=LANES, classify=classify, clock=time.monotonic):
+        self.send = send
+        self.window = max(float(window), 0)
+        self.max_payload = max(int(max_payload), 1)
+        self.prefixes = tuple(prefixes)
+        self.can_send = can_send or (lambda: True)
+        self.classify = classify
+        self.clock = clock
+        self._lanes = [_Lane(name, weight) for name, weight in lanes]
+        self._lane_by_name = {lane.name: lane for lane in self._lanes}
+        # Batch per (topic, qos, lane) that still accepts lines
+        self._open = {}
+        self._condition = threading.Condition()
+        # Serializes sending so batches of one lane can not overtake each other
+        self._send_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        self.messages = 0
+        self.payloads = 0
+        self.bytes = 0
+        self.max_lines = 0
+        self.throttled = 0
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, daemon=True, name='PublisherThread')
+        self._thread.start()
+
+    def publish(self, topic, payload, qos=0):
+        future = PublishFuture(topic, qos, self.clock, payload)
+        size = len(payload.encode('utf-8'))
+        lane = self._lane_by_name.get(self.classify(topic, payload), self._lanes[-1])
+        if self._thread is None or not topic.startswith(self.prefixes) or size >= self.max_payload:
+            self.flush(lane.name)
+            with self._send_lock:
+                self._send(topic, payload, qos, [future])
+            return future
+        key = (topic, qos, lane.name)
+        with self._condition:
+            batch = self._open.get(key)
+            if batch is not None and batch.size + 1 + size > self.max_payload:
+                # Full batches stay in the lane until they are sent
+                batch.deadline = min(batch.deadline, self.clock())
+                batch = None
+            if batch is None:
+                now = self.clock()
+                batch = self._open[key] = _Batch(key, now + self.window, now)
+                lane.batches.append(batch)
+            batch.lines.append(payload)
+            batch.futures.append(future)
+            batch.size += size + (1 if len(batch.lines) > 1 else 0)
+            self._condition.notify_all()
+        return future
+
+    def flush(self, lane=None):
+        """
+        Sends the pending batches of `lane` or of all lanes in order of priority,
+        regardless of the capacity of the transport.
+        """
+        with self._send_lock:
+            with self._condition:
+                batches = []
+                for pending in self._lanes:
+                    if lane is None or pending.name == lane:
+                        batches.extend((pending, batch) for batch in pending.batches)
+                        pending.batches.clear()
+                for _, batch in batches:
+                    self._close(batch)
+            for pending, batch in batches:
+                self._send_batch(pending, batch)
+
+    def _close(self, batch):
+        if self._open.get(batch.key) is batch:
+            del self._open[batch.key]
+
+    def _send_batch(self, lane, batch):
+        wait = self.clock() - batch.created
+        lane.payloads += 1
+        lane.last_wait = wait
+        lane.max_wait = max(lane.max_wait, wait)
+        lane.total_wait += wait
+        self._send(batch.topic, '\n'.join(batch.lines), batch.qos, batch.futures)
+
+    def _send(self, topic, payload, qos, futures):
+        lines = len(futures)
+        self.messages += lines
+        self.payloads += 1
+        self.bytes += len(payload)
+        self.max_lines = max(self.max_lines, lines)
+        try:
+            self.send(topic, payload, qos, futures)
+        except Exception as ex:
+            self.logger.exception(f'Error publishing {lines} line(s) on {topic}: {ex}')
+            for future in futures:
+                future.resolve(PublishFuture.FAILED, str(ex))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._wait_ready():
+                    return
+            with self._send_lock:
+                with self._condition:
+                    # A flush may have taken the batches in the meantime
+                    lane = self._next_lane()
+                    if lane is None:
+                        continue
+                    batch = lane.batches.popleft()
+                    self._close(batch)
+                self._send_batch(lane, batch)
+
+    def _ready_lanes(self):
+        now = self.clock()
+        return [lane for lane in self._lanes
+                if lane.batches and (lane.batches[0].deadline <= now or self._stopped)]
+
+    def _wait_ready(self):
+        while True:
+            if not self._ready_lanes():
+                if self._stopped:
+                    return False
+                deadlines = [lane.batches[0].deadline for lane in self._lanes if lane.batches]
+                self._condition.wait(min(deadlines) - self.clock() if deadlines else None)
+            elif not self._stopped and not self.can_send():
+                self.throttled += 1
+                # Nothing signals free capacity of the socket, check again shortly
+                self._condition.wait(0.005)
+            else:
+                return True
+
+    def _next_lane(self):
+        ready = self._ready_lanes()
+        if not ready:
+            return None
+        if all(lane.credit <= 0 for lane in ready):
+            for lane in self._lanes:
+                lane.credit = lane.weight
+        for lane in ready:
+            if lane.credit > 0:
+                lane.credit -= 1
+                return lane
+
+    def stop(self, timeout=5):
+        """
+        Sends all pending batches and stops the publisher thread.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'messages': self.messages,
+                'payloads': self.payloads,
+                'bytes': self.bytes,
+                'max_lines': self.max_lines,
+                'throttled': self.throttled,
+                'pending': sum(len(batch.lines) for lane in self._lanes for batch in lane.batches),
+                'lanes': {lane.name: lane.stats() for lane in self._lanes},
+            }
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import logging
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket refilled with `rate` tokens per second up to `burst` tokens.
+
+    Reservations are taken immediately and may drive the bucket negative; the caller
+    has to wait the returned time before using them. Requests larger than the burst
+    are allowed and simply wait longer.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = max(float(burst or rate), 1.0)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+
+    def reserve(self, amount=1):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    """
+    Paces outbound MQTT messages by messages and bytes per second.
+
+    A rate of 0 disables the respective limit. The burst defaults to one second worth
+    of the rate, so short peaks pass unshaped while sustained traffic is spread out.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, messages_per_second=0, bytes_per_second=0, message_burst=None,
+                 byte_burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.sleep = sleep
+        self._buckets = []
+        if messages_per_second > 0:
+            self._buckets.append((TokenBucket(messages_per_second, message_burst, clock), lambda size: 1))
+        if bytes_per_second > 0:
+            self._buckets.append((TokenBucket(bytes_per_second, byte_burst, clock), lambda size: size))
+        self._lock = threading.Lock()
+        self.passed = 0
+        self.shaped = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+
+    @property
+    def enabled(self):
+        return bool(self._buckets)
+
+    def acquire(self, size):
+        """
+        Waits until a message of `size` bytes may be sent. Returns the time waited.
+        """
+        if not self._buckets:
+            return 0.0
+        with self._lock:
+            delay = max(bucket.reserve(cost(size)) for bucket, cost in self._buckets)
+            self.passed += 1
+            if delay > 0:
+                self.shaped += 1
+                self.total_delay += delay
+                self.max_delay = max(self.max_delay, delay)
+        if delay > 0:
+            self.logger.debug(f'Rate limit reached, delaying message by {delay:.3f} sec')
+            self.sleep(delay)
+        return delay
+
+    def stats(self):
+        with self._lock:
+            return {
+                'passed': self.passed,
+                'shaped': self.shaped,
+                'total_delay': self.total_delay,
+                'max_delay': self.max_delay,
+            }
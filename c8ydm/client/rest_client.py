@@ -21,13 +21,20 @@ import logging
 import json
 import datetime
 import re
+import time
 from base64 import b64encode
 
 
 class RestClient():
     """ C8Y REST Client """
-    def __init__(self, agent):
+    def __init__(self, agent, session=None):
         self.logger = logging.getLogger(__name__)
+        # Keeps connections to the platform open, a gateway shares one session between its identities
+        self.session = session if session is not None else requests.Session()
+        self.metric_labels = agent.metric_labels
+        self.request_duration = agent.metrics.histogram('rest_request_duration_seconds',
+            'Duration of REST requests to the platform')
+        self.requests = agent.metrics.counter('rest_requests', 'REST requests by method and status code')
         self.serial = agent.serial
         self.configuration = agent.configuration
         self.file_path = agent.path / 'binaries'
@@ -37,6 +44,17 @@ class RestClient():
             self.base_url = f'https://{self.base_url}'
         self.token = agent.token
 
+    def _request(self, method, url, **kwargs):
+        start = time.monotonic()
+        status = 'error'
+        try:
+            response = self.session.request(method, url, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            self.request_duration.observe(time.monotonic() - start, method=method, **self.metric_labels)
+            self.requests.inc(method=method, status=status, **self.metric_labels)
+
     def update_token(self, token):
         self.token = token
     
@@ -60,7 +78,7 @@ class RestClient():
             headers = self.get_auth_header()
             headers['Content-Type'] = 'application/json'
             self.logger.debug(f'Sending Request to url {url}')
-            response = requests.request(
+            response = self._request(
                 "PUT", url, headers=headers, data=payload)
             self.logger.debug('Response from request: ' + str(response.text))
             self.logger.debug(
@@ -82,7 +100,7 @@ class RestClient():
             headers = self.get_auth_header()
             headers['Content-Type'] = 'application/json'
             headers['Accept'] = 'application/json'
-            response = requests.request("GET", url, headers=headers)
+            response = self._request("GET", url, headers=headers)
             self.logger.debug('Response from request: ' + str(response.text))
             self.logger.debug(
                 'Response from request with code : ' + str(response.status_code))
@@ -111,7 +129,7 @@ class RestClient():
             headers['Content-Type'] = 'multipart/form-data'
             headers['Accept'] = 'application/json'
             self.logger.debug(f'Sending Request to url {url}')
-            response = requests.request(
+            response = self._request(
                 "POST", url, headers=headers, data=payload, files=file)
             print("Responsestatuscode:" + str(response.status_code))
             print("RESPONSEMSG: "+str(response.text))
@@ -145,7 +163,7 @@ class RestClient():
                 "source": { "id" : mo_id}
             }
             self.logger.debug(f'Sending Request to url {url}')
-            response = requests.request(
+            response = self._request(
                 "POST", url, headers=headers, data=json.dumps(payload))
             self.logger.debug(
                 'Response from request: ' + str(response.text))
@@ -178,7 +196,7 @@ class RestClient():
                 "source": { "id" : mo_id}
             }
             self.logger.debug(f'Sending Request to url {url}')
-            response = requests.request(
+            response = self._request(
                 "POST", url, headers=headers, data=json.dumps(payload))
             self.logger.debug(
                 'Response from request: ' + str(response.text))
@@ -208,7 +226,7 @@ class RestClient():
             headers['Content-Type'] = 'multipart/form-data'
             headers['Accept'] = 'application/json'
             self.logger.debug(f'Sending Request to url {url}')
-            response = requests.request(
+            response = self._request(
                 "POST", url, headers=headers, files=file)
             self.logger.debug('Response from request: ' + str(response.text))
             self.logger.debug(
@@ -236,7 +254,7 @@ class RestClient():
             headers['Content-Type'] = 'multipart/form-data'
             headers['Accept'] = 'application/json'
             self.logger.debug(f'Sending Request to url {url}')
-            response = requests.request(
+            response = self._request(
                 "POST", url, headers=headers, files=file)
             self.logger.debug('Response from request: ' + str(response.text))
             self.logger.debug(
@@ -272,7 +290,7 @@ class RestClient():
             headers['Content-Type'] = 'multipart/form-data'
             headers['Accept'] = 'application/json'
             self.logger.info(f'Sending Request to url {url}')
-            response = requests.request(
+            response = self._request(
                 "GET", url, headers=headers, allow_redirects=True)
             self.logger.debug('Response from request: ' + str(response.text))
             self.logger.debug('Response from request with code : ' + str(response.status_code))
@@ -295,7 +313,7 @@ class RestClient():
             headers = self.get_auth_header()
             headers['Content-Type'] = 'application/json'
             headers['Accept'] = 'application/json'
-            response = requests.request("GET", url, headers=headers)
+            response = self._request("GET", url, headers=headers)
             self.logger.debug('Response from request: ' + str(response.text))
             self.logger.debug(
                 'Response from request with code : ' + str(response.status_code))
@@ -317,29 +335,31 @@ class RestClient():
             self.logger.error('The following error occured: %s' % (str(e)))
 
     def set_operations_to_failed(self, operations):
-        if len(operations) > 0:
-            try:
-                for op in operations:
-                    url = f'{self.base_url}/devicecontrol/operations/{op["id"]}'
-                    headers = self.get_auth_header()
-                    headers['Content-Type'] = 'application/json'
-                    headers['Accept'] = 'application/json'
-                    payload = {
-                        "status": "FAILED",
-                        "failureReason": "Operation unexpectedly interrupted. Check logs for details"
-                    }
-                    response = requests.request(
-                        "PUT", url, headers=headers, data=json.dumps(payload))
-                    self.logger.debug(
-                        'Response from request: ' + str(response.text))
-                    self.logger.debug(
-                        'Response from request with code : ' + str(response.status_code))
-                    if response.status_code == 200:
-                        return True
-                    else:
-                        return False
-            except Exception as e:
-                self.logger.error('The following error occured: %s' % (str(e)))
+        result = True
+        for op in operations:
+            result = self.set_operation_status(
+                op['id'], 'FAILED', 'Operation unexpectedly interrupted. Check logs for details') and result
+        return result
+
+    def set_operation_status(self, operation_id, status, failure_reason=None):
+        try:
+            url = f'{self.base_url}/devicecontrol/operations/{operation_id}'
+            headers = self.get_auth_header()
+            headers['Content-Type'] = 'application/json'
+            headers['Accept'] = 'application/json'
+            payload = {'status': status}
+            if failure_reason is not None:
+                payload['failureReason'] = failure_reason
+            response = self._request(
+                "PUT", url, headers=headers, data=json.dumps(payload))
+            self.logger.debug(
+                'Response from request: ' + str(response.text))
+            self.logger.debug(
+                'Response from request with code : ' + str(response.status_code))
+            return response.status_code == 200
+        except Exception as e:
+            self.logger.error('The following error occured: %s' % (str(e)))
+            return False
 
     def create_SmartRest_template(self,template,template_id):
         try:
@@ -349,14 +369,14 @@ class RestClient():
             headers = self.get_auth_header()
             headers['Content-Type'] ='application/json'
             headers['Accept'] = 'application/json'
-            response = requests.request("POST", url, headers=headers, data = json.dumps(payload))
+            response = self._request("POST", url, headers=headers, data = json.dumps(payload))
             if response.status_code == 200 or response.status_code==201:
                 json_data = json.loads(response.text)
                 self.logger.info(f'Template created with id {json_data["id"]}')
                 payload = json.loads(f'{{"externalId": "{template_id}","type": "c8y_SmartRest2DeviceIdentifier"}}')
                 url = f'{self.base_url}/identity/globalIds/{json_data["id"]}/externalIds'
                 self.logger.debug(f'Sending Request for idenenity of smart rest template to url {url}')
-                response = requests.request("POST", url, headers=headers, data = json.dumps(payload))
+                response = self._request("POST", url, headers=headers, data = json.dumps(payload))
                 if response.status_code == 200 or response.status_code==201:
                     self.logger.debug('Response from request of identity API for smart rest template: ' + str(response.text))
                     return True
@@ -380,7 +400,7 @@ class RestClient():
             headers = self.get_auth_header()
             headers['Content-Type'] ='application/json'
             headers['Accept'] = 'application/json'
-            response = requests.request("GET", url, headers=headers)
+            response = self._request("GET", url, headers=headers)
             self.logger.info('Checking against indentity service')
             if response.status_code == 200:
                 self.logger.info('Managed object exists in C8Y')
@@ -405,7 +425,7 @@ class RestClient():
             headers['Content-Type'] = 'application/json'
             headers['Accept'] = 'application/json'
             self.logger.debug(f'Sending Request to url {url} with payload {software_list_json}')
-            response = requests.request(
+            response = self._request(
                 "POST", url, headers=headers, data=json.dumps(software_list_json))
             self.logger.debug(
                 'Response from request: ' + str(response.text))
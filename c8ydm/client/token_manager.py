@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import base64
+import json
+import logging
+import os
+import threading
+import time
+
+
+class TokenManager:
+    """
+    Keeps the JWT used for REST requests valid when authenticating with device
+    certificates.
+
+    The expiry is read from the `exp` claim of the token and a new token is requested
+    `refresh_margin` seconds before it. Tokens without a readable expiry are refreshed
+    every `retry_interval` seconds, which is also the time to wait for an answer
+    before requesting again. The last token is persisted (readable by the owner only)
+    so a restarted agent can use it right away as long as it is not expired.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, request, path=None, refresh_margin=60, retry_interval=60, clock=time.time):
+        self.request = request
+        self.path = path
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.clock = clock
+        # Set as soon as REST requests can be authenticated
+        self.token_received = threading.Event()
+        self._condition = threading.Condition()
+        self._token = None
+        self._expires = None
+        # Time the next token is requested, None until a token was received
+        self._refresh_at = None
+        self._requested = None
+        self._stopped = False
+        self.refreshes = 0
+
+    @staticmethod
+    def decode_expiry(token):
+        """
+        Returns the `exp` claim of a JWT as epoch seconds or None.
+        """
+        try:
+            payload = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+            return float(exp) if exp is not None else None
+        except (IndexError, ValueError, TypeError, AttributeError):
+            return None
+
+    def load(self):
+        """
+        Loads the persisted token. Returns it if it is still valid.
+        """
+        if self.path is None or not os.path.isfile(self.path):
+            return None
+        try:
+            with open(self.path) as f:
+                token = f.read().strip()
+        except OSError as ex:
+            self.logger.warning(f'Could not read persisted token: {ex}')
+            return None
+        expires = self.decode_expiry(token)
+        if expires is None or expires - self.refresh_margin <= self.clock():
+            self.logger.info('Persisted token is expired')
+            self._remove()
+            return None
+        self.logger.info('Using persisted token')
+        self._set(token, expires)
+        return token
+
+    def update(self, token):
+        self._set(token, self.decode_expiry(token))
+        self.refreshes += 1
+        self._persist(token)
+
+    def _set(self, token, expires):
+        with self._condition:
+            self._token = token
+            self._expires = expires
+            if expires is not None:
+                self._refresh_at = expires - self.refresh_margin
+            else:
+                self._refresh_at = self.clock() + self.retry_interval
+            self._requested = None
+            self._condition.notify_all()
+        self.token_received.set()
+
+    def _persist(self, token):
+        if self.path is None:
+            return
+        tmp_path = self.path + '.tmp'
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(token)
+            os.replace(tmp_path, self.path)
+        except OSError as ex:
+            self.logger.warning(f'Could not persist token: {ex}')
+
+    def _remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def get_token(self):
+        """
+        Returns the current token or None if there is no valid one. Never blocks.
+        """
+        with self._condition:
+            return self._valid_token()
+
+    def _valid_token(self):
+        if self._token is None:
+            return None
+        if self._expires is not None and self._expires <= self.clock():
+            return None
+        return self._token
+
+    def await_token(self, timeout=None):
+        """
+        Waits up to `timeout` seconds for a valid token. Returns None on timeout.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._valid_token() is not None or self._stopped, timeout)
+            return self._valid_token()
+
+    def poll(self):
+        """
+        Requests a new token if the current one is about to expire. Returns the number
+        of seconds until the next check.
+        """
+        now = self.clock()
+        with self._condition:
+            if self._refresh_at is not None and self._refresh_at > now:
+                return self._refresh_at - now
+            if self._requested is not None and now - self._requested < self.retry_interval:
+                return self._requested + self.retry_interval - now
+            self._requested = now
+        self.logger.debug('Refreshing Token')
+        self.request()
+        return self.retry_interval
+
+    def run(self):
+        """
+        Refreshes the token in the calling thread until stop() is called. Returns
+        right away if stop() was called before.
+        """
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+            delay = self.poll()
+            with self._condition:
+                if not self._stopped:
+                    self._condition.wait(delay)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'valid': self._valid_token() is not None,
+                'expires_in': None if self._expires is None else self._expires - self.clock(),
+                'refreshes': self.refreshes,
+            }
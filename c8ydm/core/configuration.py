@@ -30,29 +30,14 @@ class ConfigurationManager(Listener, Initializer):
         self.agent = agent
         self.serial = serial
 
-    def group(self, seq, sep):
-        result = [[]]
-        for e in seq:
-          if sep not in e:
-            result[-1].append(e)
-          else:
-            result[-1].append(e[:e.find(sep)])
-            result.append([])
-
-        if result[-1] == []:
-          result.pop()
-        return result
-
     def handleOperation(self, message):
         try:
             if 's/ds' in message.topic and message.messageId == '513':
-                ## When multiple operations received just take the first one for further processing
                 self.logger.info('Configuration Operation received: ' + str(message.values))
-                message.values = self.group(message.values, '\n513')[0]
                 executing = SmartRESTMessage('s/us', '501', ['c8y_Configuration'])
                 self.agent.publishMessage(executing)
 
-                self.configuration.writeConfigString(message.values[1][1:-1])
+                self.configuration.writeConfigString(message.values[1])
                 success = SmartRESTMessage('s/us', '503', ['c8y_Configuration'])
                 configs = self.configuration.getConfigString()
                 self.agent.publishMessage(SmartRESTMessage('s/us', '113', [configs]))
@@ -71,6 +56,9 @@ class ConfigurationManager(Listener, Initializer):
     def getSupportedTemplates(self):
         return []
 
+    def getHandledMessages(self):
+        return [('s/ds', '513')]
+
 
     def getMessages(self):
         configs = self.configuration.getConfigString()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class SamplingProfiler:
+    """
+    Statistical CPU profiler sampling the stacks of all threads of the running process.
+
+    cProfile only traces the thread it was enabled in, while the agent does its work in
+    pool threads. Each sample is weighted with the CPU time the thread consumed since the
+    previous sample, so threads waiting on locks or sockets do not show up. On platforms
+    without per thread CPU clocks every sample counts the same.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, interval=0.005, limit=30):
+        self.interval = interval
+        self.limit = limit
+
+    def _cpu_time(self, ident):
+        try:
+            return time.clock_gettime(time.pthread_getcpuclockid(ident))
+        except (AttributeError, OSError):
+            return None
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def run(self, duration):
+        """
+        Samples all threads for `duration` seconds and returns the report as text.
+        """
+        own = threading.get_ident()
+        names = {}
+        stacks = collections.Counter()
+        cpu_start = {}
+        cpu_last = {}
+        samples = 0
+        frame = None
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                cpu = self._cpu_time(ident)
+                if cpu is None:
+                    weight = 1
+                else:
+                    cpu_start.setdefault(ident, cpu)
+                    weight = round((cpu - cpu_last.get(ident, cpu)) * 1000000)
+                    cpu_last[ident] = cpu
+                if weight > 0:
+                    stacks[(names.get(ident, str(ident)),) + tuple(self._stack(frame))] += weight
+            samples += 1
+            time.sleep(self.interval)
+        frame = None
+        cpu_used = {names.get(ident, str(ident)): cpu_last[ident] - cpu_start[ident] for ident in cpu_last}
+        return self._report(duration, samples, stacks, cpu_used)
+
+    def _report(self, duration, samples, stacks, cpu_used):
+        unit = 'us cpu' if cpu_used else 'samples'
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, weight in stacks.items():
+            own[stack[-1]] += weight
+            for function in set(stack[1:]):
+                total[function] += weight
+        lines = [f'# CPU profile over {duration} seconds, {samples} samples every {self.interval} seconds', '']
+        if cpu_used:
+            lines.append('# CPU seconds per thread')
+            for name, seconds in sorted(cpu_used.items(), key=lambda item: -item[1])[:self.limit]:
+                lines.append(f'{seconds:10.3f}  {name}')
+            lines.append('')
+        lines.append(f'# Top functions by own time ({unit})')
+        lines.extend(f'{weight:10d}  {function}' for function, weight in own.most_common(self.limit))
+        lines.append('')
+        lines.append(f'# Top functions by total time ({unit})')
+        lines.extend(f'{weight:10d}  {function}' for function, weight in total.most_common(self.limit))
+        lines.append('')
+        lines.append('# Collapsed stacks, usable with flamegraph.pl or speedscope')
+        lines.extend(f'{";".join(stack)} {weight}' for stack, weight in stacks.most_common())
+        return '\n'.join(lines) + '\n'
+
+
+class MemoryProfiler:
+    """
+    Traces memory allocations with tracemalloc and reports the allocations that were
+    made during the capture and are still alive at its end, grouped by traceback.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, frames=10, limit=30):
+        self.frames = frames
+        self.limit = limit
+
+    def run(self, duration):
+        """
+        Traces allocations for `duration` seconds and returns the report as text.
+        """
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(self.frames)
+        try:
+            before = tracemalloc.take_snapshot()
+            time.sleep(duration)
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started:
+                tracemalloc.stop()
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ]
+        before = before.filter_traces(filters)
+        after = after.filter_traces(filters)
+        return self._report(duration, after.compare_to(before, 'traceback'), current, peak)
+
+    def _report(self, duration, differences, current, peak):
+        growth = sum(stat.size_diff for stat in differences)
+        lines = [
+            f'# Memory profile over {duration} seconds',
+            f'# Traced memory: {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB, growth {growth / 1024:+.1f} KiB',
+            '',
+        ]
+        differences = sorted(differences, key=lambda stat: -stat.size_diff)
+        for stat in differences[:self.limit]:
+            if stat.size_diff <= 0:
+                break
+            lines.append(f'{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d} blocks), {stat.size / 1024:.1f} KiB in total')
+            lines.extend(f'    {line}' for line in stat.traceback.format(most_recent_first=True))
+            lines.append('')
+        return '\n'.join(lines) + '\n'
+
+
+_lock = threading.Lock()
+
+PROFILERS = {
+    'cpu': SamplingProfiler,
+    'memory': MemoryProfiler,
+}
+
+
+def capture(kind, duration):
+    """
+    Runs the profiler of the given kind ('cpu' or 'memory') in the calling thread for
+    `duration` seconds and returns its report. Only one capture can run at a time.
+    """
+    if kind not in PROFILERS:
+        raise ValueError(f'Unknown profile type {kind}, use one of {", ".join(PROFILERS)}')
+    if not _lock.acquire(blocking=False):
+        raise RuntimeError('Another profile is already being captured')
+    try:
+        return PROFILERS[kind]().run(duration)
+    finally:
+        _lock.release()
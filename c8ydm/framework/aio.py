@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import asyncio
+import contextvars
+import functools
+
+
+async def to_thread(fn, *args, **kwargs):
+    """
+    Runs a blocking function on the default executor of the running event loop.
+    Uses asyncio.to_thread where available (Python 3.9+). Like asyncio.to_thread,
+    the function sees the context variables of the caller, e.g. the current operation.
+    """
+    if hasattr(asyncio, 'to_thread'):
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    loop = asyncio.get_event_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, functools.partial(context.run, fn, *args, **kwargs))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from c8ydm.framework.smartrest import SmartRESTMessage
+
+
+class ChildDeviceRegistry:
+    """
+    Remembers the child devices and services registered for the agent.
+
+    Modules call register_device() or register_service() for every child they see
+    and update_status() with its current status. A registration is only published
+    if the child is unknown, its name or type changed, or the registration is older
+    than `max_age` seconds. A status update is only published when the status changed.
+    All children talk through the agent's own connection on s/us/<child id>.
+
+    The registry is kept in a JSON file, so a restart does not register all children
+    again. A child is forgotten if its registration could not be published.
+    """
+    logger = logging.getLogger(__name__)
+    DEVICE = 'device'
+    SERVICE = 'service'
+
+    def __init__(self, path, publish, max_age=7 * 86400, clock=time.time):
+        self.path = path
+        self.publish = publish
+        # 0 disables periodic re-registration
+        self.max_age = max(0, int(max_age))
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._children = self._load()
+        self.registrations = 0
+        self.status_updates = 0
+        self.suppressed = 0
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                children = json.load(f)
+            self.logger.info(f'Loaded {len(children)} known child device(s)')
+            return children
+        except (OSError, ValueError) as ex:
+            self.logger.warning(f'Could not load child devices, registering them again: {ex}')
+            return {}
+
+    def _save(self):
+        if self.path is None:
+            return
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._children, f)
+            os.replace(tmp_path, self.path)
+        except OSError as ex:
+            self.logger.warning(f'Could not persist child devices: {ex}')
+
+    def register_device(self, child_id, name, device_type):
+        """
+        Registers a child device (101). Returns the PublishFuture of the registration
+        or None if the child is already known.
+        """
+        return self._register(child_id, self.DEVICE, name, device_type,
+                              SmartRESTMessage('s/us', '101', [child_id, name, device_type]))
+
+    def register_service(self, service_id, service_type, name, status):
+        """
+        Registers a service (102) with its initial status. Returns the PublishFuture of
+        the registration or None if the service is already known.
+        """
+        future = self._register(service_id, self.SERVICE, name, service_type,
+                                SmartRESTMessage('s/us', '102', [service_id, service_type, name, status]),
+                                status)
+        if future is None:
+            self.update_status(service_id, status)
+        return future
+
+    def _register(self, child_id, kind, name, child_type, message, status=None):
+        now = self.clock()
+        with self._lock:
+            known = self._children.get(child_id)
+            if (known is not None and known['kind'] == kind and known['name'] == name
+                    and known['type'] == child_type
+                    and not (self.max_age and now - known['registered'] > self.max_age)):
+                self.suppressed += 1
+                return None
+            self._children[child_id] = {'kind': kind, 'name': name, 'type': child_type,
+                                        'status': status, 'registered': now}
+            self.registrations += 1
+            self._save()
+        self.logger.debug(f'Registering {kind} {child_id}')
+        future = self.publish(message, qos=1)
+        future.add_done_callback(lambda future: self._registered(child_id, now, future))
+        return future
+
+    def _registered(self, child_id, registered, future):
+        if future.published or future.state == future.QUEUED:
+            return
+        with self._lock:
+            known = self._children.get(child_id)
+            if known is None or known['registered'] != registered:
+                return
+            del self._children[child_id]
+            self._save()
+        self.logger.warning(f'Registration of child {child_id} was not published: {future.error}')
+
+    def update_status(self, child_id, status):
+        """
+        Publishes the status (104) of a registered service if it changed. Returns the
+        PublishFuture or None.
+        """
+        with self._lock:
+            known = self._children.get(child_id)
+            if known is None or known.get('status') == status:
+                self.suppressed += 1
+                return None
+            known['status'] = status
+            self.status_updates += 1
+            self._save()
+        return self.publish(SmartRESTMessage(f's/us/{child_id}', '104', [status]))
+
+    def is_registered(self, child_id):
+        with self._lock:
+            return child_id in self._children
+
+    def children(self, kind=None):
+        """
+        Returns the ids of the known children, optionally only devices or services.
+        """
+        with self._lock:
+            return [child_id for child_id, known in self._children.items()
+                    if kind is None or known['kind'] == kind]
+
+    def forget(self, child_id):
+        """
+        Removes a child from the registry, e.g. a deleted container. The child is not
+        deleted in the platform; it is registered again when it comes back.
+        """
+        with self._lock:
+            if self._children.pop(child_id, None) is not None:
+                self._save()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'children': len(self._children),
+                'registrations': self.registrations,
+                'status_updates': self.status_updates,
+                'suppressed': self.suppressed,
+            }
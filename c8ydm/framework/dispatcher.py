@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import logging
+import threading
+from collections import deque
+
+
+class WorkerPool:
+    """
+    Bounded pool of worker threads fed by a queue with a depth limit.
+
+    Workers are spawned lazily up to `workers` and stay alive afterwards, so an idle
+    agent does not hold more threads than it ever needed. When the queue is full the
+    overflow policy decides what happens with a new task:
+
+    - block:       wait until a slot becomes free (default)
+    - drop-newest: reject the new task
+    - drop-oldest: discard the oldest queued task and enqueue the new one
+    - caller-runs: execute the task in the submitting thread
+
+    Running tasks are reported to the optional watchdog, which detects tasks exceeding
+    their budget.
+    """
+    logger = logging.getLogger(__name__)
+    OVERFLOW_POLICIES = ('block', 'drop-newest', 'drop-oldest', 'caller-runs')
+
+    def __init__(self, name, workers=4, queue_size=256, overflow='block', watchdog=None):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy {overflow}. Use one of {self.OVERFLOW_POLICIES}')
+        self.name = name
+        self.max_workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.overflow = overflow
+        self.watchdog = watchdog
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._idle = 0
+        self._shutdown = False
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        # Accepted tasks that were later discarded by the drop-oldest policy
+        self._discarded = 0
+        self.peak_queue_depth = 0
+
+    def submit(self, fn, *args, name=None, budget=None):
+        """
+        Queues fn(*args) for execution. Returns False if the task was dropped. The
+        watchdog reports the task when it runs longer than `budget` seconds, by default
+        the budget of the watchdog.
+        """
+        task = (fn, args, name or getattr(fn, '__qualname__', str(fn)), budget)
+        run_inline = False
+        with self._condition:
+            if self._shutdown:
+                self.dropped += 1
+                return False
+            if len(self._queue) >= self.queue_size:
+                if self.overflow == 'block':
+                    self._condition.wait_for(
+                        lambda: len(self._queue) < self.queue_size or self._shutdown)
+                    if self._shutdown:
+                        self.dropped += 1
+                        return False
+                elif self.overflow == 'drop-newest':
+                    self.dropped += 1
+                    self.logger.warning(f'{self.name} queue full ({self.queue_size}), dropping task {task[2]}')
+                    return False
+                elif self.overflow == 'drop-oldest':
+                    oldest = self._queue.popleft()
+                    self.dropped += 1
+                    self._discarded += 1
+                    self.logger.warning(f'{self.name} queue full ({self.queue_size}), dropping oldest task {oldest[2]}')
+                else:
+                    run_inline = True
+            self.submitted += 1
+            if not run_inline:
+                self._queue.append(task)
+                self.peak_queue_depth = max(self.peak_queue_depth, len(self._queue))
+                if len(self._queue) > self._idle and len(self._threads) < self.max_workers:
+                    self._spawn_worker()
+                self._condition.notify_all()
+        if run_inline:
+            self._run(task)
+        return True
+
+    def _spawn_worker(self):
+        thread = threading.Thread(target=self._worker, daemon=True,
+                                  name=f'{self.name}-{len(self._threads) + 1}')
+        self._threads.append(thread)
+        thread.start()
+
+    def _worker(self):
+        thread = threading.current_thread()
+        base_name = thread.name
+        while True:
+            with self._condition:
+                self._idle += 1
+                while not self._queue and not self._shutdown:
+                    self._condition.wait()
+                self._idle -= 1
+                if not self._queue:
+                    return
+                task = self._queue.popleft()
+                # Wake up producers waiting for a free slot
+                self._condition.notify_all()
+            thread.name = f'{self.name}-{task[2]}'
+            try:
+                self._run(task)
+            finally:
+                thread.name = base_name
+
+    def _run(self, task):
+        fn, args, name, budget = task
+        tracked = self.watchdog.begin(self.name, name, budget) if self.watchdog is not None else None
+        try:
+            fn(*args)
+        except Exception as ex:
+            with self._condition:
+                self.failed += 1
+            self.logger.exception(f'Error in {self.name} task {name}: {ex}')
+        finally:
+            if tracked is not None:
+                self.watchdog.end(tracked)
+            with self._condition:
+                self.completed += 1
+                self._condition.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Waits until all queued and running tasks are done. Returns False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self.completed + self._discarded >= self.submitted, timeout)
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stops accepting new tasks. Queued tasks are still executed.
+        """
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for thread in list(self._threads):
+                thread.join(timeout)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'workers': len(self._threads),
+                'idle': self._idle,
+                'queue_depth': len(self._queue),
+                'peak_queue_depth': self.peak_queue_depth,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'dropped': self.dropped,
+            }
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from c8ydm.framework.smartrest import SmartRESTMessage
+
+RECEIVED = 'RECEIVED'
+EXECUTING = 'EXECUTING'
+SUCCESSFUL = 'SUCCESSFUL'
+FAILED = 'FAILED'
+
+# Checkpoint of operations whose work is finished, only the status update is missing
+DONE = 'done'
+
+
+class JournalEntry:
+
+    def __init__(self, entry_id, fragment, listener, topic, message_id, arguments, state, step, received):
+        self.id = entry_id
+        self.fragment = fragment
+        self.listener = listener
+        self.topic = topic
+        self.message_id = message_id
+        self.arguments = arguments
+        self.state = state
+        self.step = step
+        self.received = received
+
+    def message(self):
+        return SmartRESTMessage(self.topic, self.message_id, json.loads(self.arguments))
+
+
+class OperationJournal:
+    """
+    On-disk record of the lifecycle of operations handed to listeners.
+
+    An entry is written when an operation is dispatched and follows its status
+    updates (501/502/503) and the checkpoints of the listener. Entries are removed
+    once the final status was delivered. Entries left behind by a previous run are
+    reconciled with the operations the platform still lists as EXECUTING.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS journal ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, fragment TEXT NOT NULL, '
+                         'listener TEXT NOT NULL, topic TEXT NOT NULL, message_id TEXT NOT NULL, arguments TEXT NOT NULL, '
+                         'state TEXT NOT NULL, step TEXT, received REAL NOT NULL, updated REAL NOT NULL)')
+        # Entries of earlier runs, reconciled once after connecting
+        self.previous = self.entries()
+        if self.previous:
+            self.logger.info(f'Operation journal contains {len(self.previous)} operation(s) from a previous run')
+
+    def record(self, fragment, listener, message):
+        now = self.clock()
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT INTO journal (fragment, listener, topic, message_id, arguments, state, received, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (fragment, listener, message.topic, str(message.messageId), json.dumps(list(message.values)),
+                 RECEIVED, now, now))
+            return cursor.lastrowid
+
+    def transition(self, entry_id, state):
+        with self._lock:
+            self._db.execute('UPDATE journal SET state = ?, updated = ? WHERE id = ?',
+                             (state, self.clock(), entry_id))
+
+    def checkpoint(self, entry_id, step):
+        with self._lock:
+            self._db.execute('UPDATE journal SET step = ?, updated = ? WHERE id = ?',
+                             (step, self.clock(), entry_id))
+
+    def remove(self, entry_id):
+        with self._lock:
+            self._db.execute('DELETE FROM journal WHERE id = ?', (entry_id,))
+
+    def entries(self):
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id, fragment, listener, topic, message_id, arguments, state, step, received '
+                'FROM journal ORDER BY id').fetchall()
+        return [JournalEntry(*row) for row in rows]
+
+    def reconcile(self, executing, idempotent):
+        """
+        Matches the entries of the previous run with the platform operations in
+        `executing` and returns a list of (action, operation, entry):
+
+        - successful: the work was done, only the final status got lost
+        - failed:     the operation failed, was interrupted or is unknown to the journal
+        - resume:     the interrupted operation is idempotent and is executed again
+        - drop:       the journal entry has no EXECUTING operation anymore
+
+        Like SmartREST status updates, entries of a fragment are matched with the
+        platform operations of that fragment from oldest to newest.
+        """
+        pending = list(self.previous)
+        self.previous = []
+        actions = []
+        for operation in sorted(executing, key=lambda op: (op.get('creationTime', ''), int(op.get('id', 0)))):
+            entry = next((entry for entry in pending if entry.fragment in operation), None)
+            if entry is None:
+                actions.append(('failed', operation, None))
+                continue
+            pending.remove(entry)
+            if entry.state == FAILED:
+                actions.append(('failed', operation, entry))
+            elif entry.state == SUCCESSFUL or entry.step == DONE:
+                actions.append(('successful', operation, entry))
+            elif entry.fragment in idempotent:
+                actions.append(('resume', operation, entry))
+            else:
+                actions.append(('failed', operation, entry))
+        actions.extend(('drop', None, entry) for entry in pending)
+        return actions
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM journal').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
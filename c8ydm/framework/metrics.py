@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import bisect
+import logging
+import math
+import threading
+import time
+
+import psutil
+
+# Upper bounds in seconds, from fast listener calls up to long running installations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+class Histogram:
+    """
+    Distribution of observed values in fixed buckets with cumulative counts, the
+    layout used by Prometheus and OpenMetrics.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """
+        Returns the cumulative count per upper bound, including '+Inf', with count and sum.
+        """
+        with self._lock:
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(self.buckets + ('+Inf',), self._counts):
+                cumulative += count
+                buckets[bound] = cumulative
+            return {'buckets': buckets, 'count': self.count, 'sum': self.sum}
+
+
+class _Family:
+    """
+    A metric with one value per label set.
+    """
+
+    def __init__(self, name, kind, help, factory):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _child(self, labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self.factory()
+            return child
+
+    def items(self):
+        with self._lock:
+            return [(dict(key), child) for key, child in self._children.items()]
+
+
+class Counter(_Family):
+
+    def __init__(self, name, help=''):
+        super().__init__(name, 'counter', help, lambda: [0])
+
+    def inc(self, amount=1, **labels):
+        child = self._child(labels)
+        with self._lock:
+            child[0] += amount
+
+    def samples(self):
+        return [(f'{self.name}_total', labels, value[0]) for labels, value in self.items()]
+
+
+class Gauge(_Family):
+    """
+    A gauge that is either set or read from `fn` when the metrics are collected.
+    """
+
+    def __init__(self, name, help='', fn=None):
+        super().__init__(name, 'gauge', help, lambda: [0])
+        self.fn = fn
+
+    def set(self, value, **labels):
+        child = self._child(labels)
+        with self._lock:
+            child[0] = value
+
+    def samples(self):
+        if self.fn is not None:
+            return [(self.name, {}, self.fn())]
+        return [(self.name, labels, value[0]) for labels, value in self.items()]
+
+
+class LabeledHistogram(_Family):
+
+    def __init__(self, name, help='', buckets=DEFAULT_BUCKETS):
+        super().__init__(name, 'histogram', help, lambda: Histogram(buckets))
+
+    def observe(self, value, **labels):
+        self._child(labels).observe(value)
+
+    def samples(self):
+        samples = []
+        for labels, histogram in self.items():
+            samples.extend(_histogram_samples(self.name, labels, histogram.snapshot()))
+        return samples
+
+
+def _histogram_samples(name, labels, snapshot):
+    samples = [(f'{name}_bucket', dict(labels, le=str(bound)), count)
+               for bound, count in snapshot['buckets'].items()]
+    samples.append((f'{name}_count', labels, snapshot['count']))
+    samples.append((f'{name}_sum', labels, snapshot['sum']))
+    return samples
+
+
+class MetricsRegistry:
+    """
+    Metrics of the agent, rendered in the OpenMetrics text format.
+
+    Counters, gauges and histograms created here are written by the agent, the REST
+    client and the modules. The statistics the components already keep are read from
+    their stats() when the metrics are collected, see register_stats(). Metric names
+    are prefixed with the namespace; asking twice for the same metric returns the
+    same object, so several agents can share a registry.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, namespace='c8ydm'):
+        self.namespace = namespace
+        self._metrics = {}
+        self._stats = []
+        self._lock = threading.Lock()
+
+    def _metric(self, cls, name, *args, **kwargs):
+        name = f'{self.namespace}_{name}'
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, help=''):
+        return self._metric(Counter, name, help)
+
+    def gauge(self, name, help='', fn=None):
+        return self._metric(Gauge, name, help, fn)
+
+    def histogram(self, name, help='', buckets=DEFAULT_BUCKETS):
+        return self._metric(LabeledHistogram, name, help, buckets)
+
+    def register_stats(self, name, stats, labels=None, label=None, nested=None):
+        """
+        Exports the dictionary returned by `stats()` as gauges named <name>_<key>.
+
+        With `label` the keys of the dictionary are values of that label, e.g. job
+        names. `nested` maps keys holding such a dictionary to their label, e.g.
+        {'lanes': 'lane'}. Strings become a gauge of 1 with the string as label, None
+        values are left out and Histogram snapshots are exported as histograms.
+        """
+        with self._lock:
+            self._stats.append((f'{self.namespace}_{name}', stats, dict(labels or {}), label, nested or {}))
+
+    def collect(self):
+        """
+        Returns the metric families as (name, type, help, samples) with samples as
+        (name, labels, value).
+        """
+        families = {}
+        with self._lock:
+            metrics = list(self._metrics.values())
+            registered = list(self._stats)
+        for metric in metrics:
+            families[metric.name] = [metric.kind, metric.help, metric.samples()]
+        for name, stats, labels, label, nested in registered:
+            try:
+                values = stats()
+            except Exception as ex:
+                self.logger.warning(f'Could not collect metrics {name}: {ex}')
+                continue
+            if label is not None:
+                for key, value in values.items():
+                    self._flatten(families, name, value, dict(labels, **{label: key}), nested)
+            else:
+                self._flatten(families, name, values, labels, nested)
+        return [(name, kind, help, samples) for name, (kind, help, samples) in families.items()]
+
+    def _flatten(self, families, name, stats, labels, nested):
+        for key, value in stats.items():
+            metric = f'{name}_{key}'
+            if value is None:
+                continue
+            if isinstance(value, dict):
+                if 'buckets' in value:
+                    self._add(families, metric, 'histogram', _histogram_samples(metric, labels, value))
+                elif key in nested:
+                    for sub_key, sub_stats in value.items():
+                        self._flatten(families, metric, sub_stats, dict(labels, **{nested[key]: sub_key}), nested)
+                else:
+                    self._flatten(families, metric, value, labels, nested)
+            elif isinstance(value, str):
+                self._add(families, metric, 'gauge', [(metric, dict(labels, **{key: value}), 1)])
+            else:
+                self._add(families, metric, 'gauge', [(metric, labels, value)])
+
+    def _add(self, families, name, kind, samples):
+        family = families.setdefault(name, [kind, '', []])
+        family[2].extend(samples)
+
+    def render(self):
+        """
+        Returns all metrics in the OpenMetrics text format.
+        """
+        lines = []
+        for name, kind, help, samples in self.collect():
+            lines.append(f'# TYPE {name} {kind}')
+            if help:
+                lines.append(f'# HELP {name} {_escape(help)}')
+            for sample, labels, value in samples:
+                lines.append(f'{sample}{_labels(labels)} {_number(value)}')
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _number(value):
+    value = float(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(int(value)) if value.is_integer() else repr(value)
+
+
+def register_process_metrics(registry):
+    """
+    Adds resident memory, CPU time, threads and open files of the agent process.
+    """
+    process = psutil.Process()
+    started = time.time()
+    registry.gauge('process_resident_memory_bytes', 'Resident memory of the agent process',
+                   lambda: process.memory_info().rss)
+    registry.gauge('process_cpu_seconds', 'CPU time used by the agent process',
+                   lambda: sum(process.cpu_times()[:2]))
+    registry.gauge('process_threads', 'Number of threads of the agent process', process.num_threads)
+    registry.gauge('process_uptime_seconds', 'Time since the agent process was started',
+                   lambda: time.time() - started)
+    if hasattr(process, 'num_fds'):
+        registry.gauge('process_open_fds', 'Number of open file descriptors', process.num_fds)
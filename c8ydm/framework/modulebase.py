@@ -18,6 +18,8 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 from abc import ABCMeta, abstractmethod
+from c8ydm.framework.aio import to_thread
+from c8ydm.framework import operations
 
 class Sensor:
   __metaclass__ = ABCMeta
@@ -32,6 +34,18 @@ class Sensor:
   @abstractmethod
   def getSensorMessages(self): pass
 
+  '''
+  Returns the interval in seconds between two calls of getSensorMessages. None uses main.loop.interval.seconds.
+  '''
+  def getInterval(self):
+    return None
+
+  '''
+  Async variant of getSensorMessages used by the asyncio runtime. Runs getSensorMessages in a worker thread by default.
+  '''
+  async def getSensorMessagesAsync(self):
+    return await to_thread(self.getSensorMessages)
+
 class Listener:
   __metaclass__ = ABCMeta
 
@@ -45,6 +59,12 @@ class Listener:
   @abstractmethod
   def handleOperation(self, message): pass
 
+  '''
+  Async variant of handleOperation used by the asyncio runtime. Runs handleOperation in a worker thread by default.
+  '''
+  async def handleOperationAsync(self, message):
+    return await to_thread(self.handleOperation, message)
+
   '''
   Returns a list of supported operations
   '''
@@ -57,6 +77,27 @@ class Listener:
   @abstractmethod
   def getSupportedTemplates(self): pass
 
+  '''
+  Returns a list of (topic, messageId) tuples the listener handles. A topic of None matches any topic.
+  Listeners returning None receive every message.
+  '''
+  def getHandledMessages(self):
+    return None
+
+  '''
+  Returns a list of operation fragments that can safely be executed again when the agent was restarted during their execution.
+  Interrupted operations of other fragments are set to FAILED.
+  '''
+  def getIdempotentOperations(self):
+    return []
+
+  '''
+  Records a step of the operation currently handled in the operation journal. Use journal.DONE once the work is finished,
+  the operation is then reported as successful even if the agent is restarted before the final status was sent.
+  '''
+  def checkpoint(self, step):
+    operations.checkpoint(step)
+
 class Initializer:
   __metaclass__ = ABCMeta
 
@@ -68,3 +109,15 @@ class Initializer:
   '''
   @abstractmethod
   def getMessages(self): pass
+
+  '''
+  Returns a list of initializer class names that have to be finished before getMessages is called.
+  '''
+  def getDependencies(self):
+    return None
+
+  '''
+  Returns the priority of the initializer. Initializers with a higher priority are started first when several are ready.
+  '''
+  def getPriority(self):
+    return 0
@@ -0,0 +1,471 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from c8ydm.framework.journal import EXECUTING, FAILED, SUCCESSFUL
+from c8ydm.framework.metrics import Histogram
+
+# Operation fragments of the static SmartREST templates received on s/ds
+FRAGMENTS = {
+    '510': 'c8y_Restart',
+    '511': 'c8y_Command',
+    '513': 'c8y_Configuration',
+    '515': 'c8y_Firmware',
+    '516': 'c8y_SoftwareList',
+    '517': 'c8y_MeasurementRequestOperation',
+    '520': 'c8y_UploadConfigFile',
+    '522': 'c8y_LogfileRequest',
+    '524': 'c8y_DownloadConfigFile',
+    '526': 'c8y_UploadConfigFile',
+    '527': 'c8y_DeviceProfile',
+    '528': 'c8y_SoftwareUpdate',
+    '529': 'c8y_SoftwareUpdate',
+    '530': 'c8y_RemoteAccessConnect',
+}
+
+STATUS_MESSAGE_IDS = ('501', '502', '503')
+_STATES = {'501': EXECUTING, '502': FAILED, '503': SUCCESSFUL}
+
+_current = contextvars.ContextVar('c8ydm_operation', default=None)
+
+
+class OperationPolicy:
+    """
+    Operations with the same serial group never run at the same time. Operations
+    running longer than `timeout` seconds are marked FAILED, None means no deadline.
+    """
+
+    def __init__(self, serial_group=None, timeout=None):
+        self.serial_group = serial_group
+        self.timeout = timeout
+
+
+DEFAULT_POLICIES = {
+    # Everything using apt shares the apt/dpkg lock
+    'c8y_SoftwareUpdate': OperationPolicy('packages', 1800),
+    'c8y_Firmware': OperationPolicy('packages', 1800),
+    'c8y_DeviceProfile': OperationPolicy('packages', 1800),
+    'c8y_SoftwareList': OperationPolicy('packages', 300),
+    'c8y_Configuration': OperationPolicy('configuration', 60),
+    'c8y_DownloadConfigFile': OperationPolicy('configuration', 300),
+    'c8y_Restart': OperationPolicy('restart', 60),
+    'c8y_Command': OperationPolicy(None, 120),
+    'c8y_UploadConfigFile': OperationPolicy(None, 300),
+    'c8y_LogfileRequest': OperationPolicy(None, 300),
+    'c8y_MeasurementRequestOperation': OperationPolicy(None, 60),
+    'c8y_RemoteAccessConnect': OperationPolicy(None, 120),
+}
+
+
+def fragment_of(listener, message):
+    """
+    Returns the operation fragment of a message for a listener, None if the message
+    is not an operation.
+    """
+    if message.topic == 's/ds':
+        return FRAGMENTS.get(str(message.messageId))
+    if message.topic.startswith('s/dc/'):
+        return getattr(listener, 'fragment', None)
+    return None
+
+
+def is_operation(message):
+    """
+    True for messages carrying an operation, independent of the listener.
+    """
+    if message.topic == 's/ds':
+        return str(message.messageId) in FRAGMENTS
+    return message.topic.startswith('s/dc/')
+
+
+def current_operation():
+    """
+    Returns the Operation executed by the calling thread or task, if any.
+    """
+    return _current.get()
+
+
+def checkpoint(step):
+    """
+    Records a step of the operation executed by the calling thread or task in the
+    operation journal. Operations that reached the DONE checkpoint are reported as
+    successful if the agent is restarted before their final status was sent.
+    """
+    operation = _current.get()
+    if operation is not None and operation.journal is not None and operation.journal_id is not None:
+        operation.journal.checkpoint(operation.journal_id, step)
+        operation.step = step
+
+
+def is_suppressed(message):
+    """
+    True for status updates sent by an operation that already timed out. The platform
+    has been told that it FAILED, a late success must not overwrite that.
+    """
+    operation = _current.get()
+    return (operation is not None and operation.timed_out
+            and message.topic == 's/us' and str(message.messageId) in STATUS_MESSAGE_IDS)
+
+
+class Operation:
+
+    def __init__(self, listener, message, fragment, policy, enqueued):
+        self.listener = listener
+        self.message = message
+        self.fragment = fragment
+        self.policy = policy
+        self.enqueued = enqueued
+        self.started = None
+        self.deadline = None
+        self.timed_out = False
+        self.journal = None
+        self.journal_id = None
+        self.state = None
+        self.step = None
+        # True if the operation was interrupted by a restart and is executed again
+        self.resumed = False
+
+    @property
+    def name(self):
+        return f'{self.listener.__class__.__name__}:{self.fragment}'
+
+    @property
+    def key(self):
+        return (self.listener, self.message.topic, str(self.message.messageId),
+                tuple(self.message.values))
+
+
+class DeduplicationCache:
+    """
+    Remembers operation messages received within the last `ttl` seconds, at most
+    `max_entries` of them. Redeliveries after a reconnect or a pending operations
+    request carry the same message and are recognized as duplicates. A duplicate
+    does not extend the lifetime of an entry, so a legitimately repeated operation
+    that is still PENDING is picked up by a later poll.
+    """
+
+    def __init__(self, ttl=60, max_entries=1024, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max(int(max_entries), 1)
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def seen(self, message):
+        """
+        Returns True if the message was seen within the TTL, records it otherwise.
+        """
+        if not self.ttl:
+            return False
+        key = (message.topic, str(message.messageId), tuple(message.values))
+        now = self.clock()
+        with self._lock:
+            while self._entries:
+                oldest, received = next(iter(self._entries.items()))
+                if now - received < self.ttl:
+                    break
+                del self._entries[oldest]
+            if key in self._entries:
+                self.duplicates += 1
+                return True
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+            self._entries[key] = now
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'duplicates': self.duplicates}
+
+
+class _FragmentStats:
+
+    def __init__(self):
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.queue_wait = Histogram()
+        self.run_time = Histogram()
+
+    def stats(self):
+        return {
+            'completed': self.completed,
+            'failed': self.failed,
+            'timed_out': self.timed_out,
+            'queue_wait': self.queue_wait.snapshot(),
+            'run_time': self.run_time.snapshot(),
+        }
+
+
+class OperationExecutor:
+    """
+    Admission control for operations handed to listeners.
+
+    Operations are started in arrival order by `run(operation)`, which has to execute
+    them via execute() or execute_async() and return False if it could not. At most
+    `max_concurrent` operations run at once and operations of the same serial group
+    run one after the other; an operation waiting for its group does not block other
+    fragments behind it. While operations with a deadline run, a monitor thread marks
+    the ones exceeding it as FAILED with `report_failed(operation, reason)`. The
+    operation keeps its slot and serial group until the listener returns. Status
+    updates the listener sends afterwards are suppressed, see is_suppressed().
+    Messages that are no operations are started right away.
+
+    With a journal every operation is recorded until its final status was
+    published, see status().
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, run, report_failed, policies=None, max_concurrent=4, journal=None,
+                 clock=time.monotonic):
+        self.run = run
+        self.report_failed = report_failed
+        self.journal = journal
+        self.policies = dict(DEFAULT_POLICIES if policies is None else policies)
+        self.default_policy = OperationPolicy()
+        self.max_concurrent = max(int(max_concurrent), 1)
+        self.clock = clock
+        self._queue = deque()
+        self._running = set()
+        self._busy_groups = set()
+        self._condition = threading.Condition()
+        self._monitor = None
+        self._stopped = False
+        self._stats = {}
+        self.duplicates = 0
+
+    def submit(self, listener, message, entry=None):
+        """
+        Queues the message for the listener. `entry` is the JournalEntry of an
+        operation resumed after a restart. Returns None if the same operation is
+        still queued or running, e.g. redelivered by a poll after it dropped out of
+        the DeduplicationCache while waiting for its serial group.
+        """
+        fragment = fragment_of(listener, message)
+        operation = Operation(listener, message, fragment,
+                              self.policies.get(fragment, self.default_policy), self.clock())
+        if fragment is None:
+            self.run(operation)
+            return operation
+        with self._condition:
+            if self._is_active(operation):
+                self.duplicates += 1
+                self.logger.warning(f'Operation {operation.name} is already queued or running, ignoring it')
+                return None
+            if self.journal is not None:
+                operation.journal = self.journal
+                if entry is not None:
+                    operation.journal_id = entry.id
+                    operation.step = entry.step
+                    operation.resumed = True
+                else:
+                    operation.journal_id = self.journal.record(fragment, listener.__class__.__name__, message)
+            self._queue.append(operation)
+            if len(self._queue) > 1 or len(self._running) >= self.max_concurrent:
+                self.logger.debug(f'Operation {operation.name} queued, {len(self._running)} running')
+        self._admit()
+        return operation
+
+    def _is_active(self, operation):
+        key = operation.key
+        return any(other.key == key for other in self._queue) \
+            or any(other.key == key for other in self._running)
+
+    def _admit(self):
+        admitted = []
+        with self._condition:
+            for operation in list(self._queue):
+                if len(self._running) >= self.max_concurrent:
+                    break
+                group = operation.policy.serial_group
+                if group is not None and group in self._busy_groups:
+                    continue
+                self._queue.remove(operation)
+                self._running.add(operation)
+                if group is not None:
+                    self._busy_groups.add(group)
+                operation.started = self.clock()
+                if operation.policy.timeout:
+                    operation.deadline = operation.started + operation.policy.timeout
+                    self._start_monitor()
+                self._fragment_stats(operation.fragment).queue_wait.observe(
+                    operation.started - operation.enqueued)
+                admitted.append(operation)
+            self._condition.notify_all()
+        for operation in admitted:
+            if self.run(operation) is False:
+                self.logger.warning(f'Operation {operation.name} could not be started')
+                self._finish(operation, failed=True)
+
+    def execute(self, operation):
+        """
+        Runs the operation in the calling thread.
+        """
+        token = _current.set(operation)
+        failed = False
+        try:
+            operation.listener.handleOperation(operation.message)
+        except Exception as ex:
+            failed = True
+            self.logger.exception(f'Error in listener {operation.listener.__class__.__name__}: {ex}')
+        finally:
+            _current.reset(token)
+            self._finish(operation, failed)
+
+    async def execute_async(self, operation):
+        """
+        Runs the operation in the calling event loop task.
+        """
+        token = _current.set(operation)
+        failed = False
+        try:
+            await operation.listener.handleOperationAsync(operation.message)
+        except Exception as ex:
+            failed = True
+            self.logger.exception(f'Error in listener {operation.listener.__class__.__name__}: {ex}')
+        finally:
+            _current.reset(token)
+            self._finish(operation, failed)
+
+    def status(self, operation, message_id, future):
+        """
+        Follows a status update of the operation in the journal. The entry is removed
+        once the final status was published.
+        """
+        state = _STATES.get(str(message_id))
+        if state is None or operation.journal_id is None:
+            return
+        operation.state = state
+        self.journal.transition(operation.journal_id, state)
+        if state != EXECUTING:
+            self._forget_when_published(operation, future)
+
+    def _forget_when_published(self, operation, future):
+        entry_id = operation.journal_id
+
+        def forget(future):
+            if future.published:
+                self.journal.remove(entry_id)
+        future.add_done_callback(forget)
+
+    def _finish(self, operation, failed=False):
+        if operation.fragment is None:
+            return
+        if operation.journal_id is not None and operation.state is None and not operation.resumed:
+            # The listener did not take up the operation
+            self.journal.remove(operation.journal_id)
+        with self._condition:
+            stats = self._fragment_stats(operation.fragment)
+            if operation.started is not None:
+                stats.run_time.observe(self.clock() - operation.started)
+            if failed:
+                stats.failed += 1
+            elif not operation.timed_out:
+                stats.completed += 1
+            if operation.timed_out:
+                self.logger.info(f'Operation {operation.name} finished after its deadline')
+            released = self._release(operation)
+        if released:
+            self._admit()
+
+    def _release(self, operation):
+        if operation not in self._running:
+            return False
+        self._running.discard(operation)
+        if operation.policy.serial_group is not None:
+            self._busy_groups.discard(operation.policy.serial_group)
+        self._condition.notify_all()
+        return True
+
+    def _fragment_stats(self, fragment):
+        stats = self._stats.get(fragment)
+        if stats is None:
+            stats = self._stats[fragment] = _FragmentStats()
+        return stats
+
+    def _start_monitor(self):
+        if self._monitor is None:
+            self._monitor = threading.Thread(target=self._watch, daemon=True, name='OperationMonitor')
+            self._monitor.start()
+
+    def _watch(self):
+        while True:
+            with self._condition:
+                expired = self._next_expired()
+                if expired is None:
+                    # Started again by the next operation with a deadline
+                    self._monitor = None
+                    return
+                expired.timed_out = True
+                self._fragment_stats(expired.fragment).timed_out += 1
+            reason = f'Operation timed out after {expired.policy.timeout} seconds'
+            self.logger.warning(f'{expired.name}: {reason}')
+            try:
+                future = self.report_failed(expired, reason)
+                if expired.journal_id is not None:
+                    expired.state = FAILED
+                    self.journal.transition(expired.journal_id, FAILED)
+                    if future is not None:
+                        self._forget_when_published(expired, future)
+            except Exception as ex:
+                self.logger.exception(f'Could not report timeout of {expired.name}: {ex}')
+
+    def _next_expired(self):
+        while not self._stopped:
+            deadlines = [operation for operation in self._running
+                         if operation.deadline is not None and not operation.timed_out]
+            if not deadlines:
+                return None
+            operation = min(deadlines, key=lambda operation: operation.deadline)
+            timeout = operation.deadline - self.clock()
+            if timeout > 0:
+                self._condition.wait(timeout)
+                continue
+            return operation
+        return None
+
+    def drain(self, timeout=None):
+        """
+        Waits until the running and queued operations are finished. Returns the
+        operations that are still unfinished when the timeout expired.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: not self._running and not self._queue, timeout)
+            return list(self._running) + list(self._queue)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._queue.clear()
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'running': len(self._running),
+                'queued': len(self._queue),
+                'duplicates': self.duplicates,
+                'fragments': {fragment: stats.stats() for fragment, stats in self._stats.items()},
+            }
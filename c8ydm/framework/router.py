@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import logging
+
+
+class MessageRouter:
+    """
+    Routing index from (topic, messageId) to the listeners handling it.
+
+    Listeners declare their messages via Listener.getHandledMessages(). Listeners
+    that do not declare anything are called for every message.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, listeners=None):
+        self._routes = {}
+        self._broadcast = []
+        for listener in listeners or []:
+            self.add(listener)
+
+    def add(self, listener):
+        handled = listener.getHandledMessages()
+        if handled is None:
+            self.logger.debug(f'Listener {listener.__class__.__name__} receives all messages')
+            self._broadcast.append(listener)
+            return
+        for topic, message_id in handled:
+            self.logger.debug(f'Routing topic={topic} messageId={message_id} to {listener.__class__.__name__}')
+            self._routes.setdefault((topic, str(message_id)), []).append(listener)
+
+    def route(self, message):
+        """
+        Returns the listeners interested in the given SmartRESTMessage.
+        """
+        message_id = str(message.messageId)
+        exact = self._routes.get((message.topic, message_id))
+        wildcard = self._routes.get((None, message_id))
+        if not exact and not wildcard:
+            return self._broadcast
+        listeners = (exact or []) + (wildcard or []) + self._broadcast
+        if exact and wildcard:
+            # A listener may be registered for both the topic and any topic
+            listeners = list(dict.fromkeys(listeners))
+        return listeners
+
+    def routes(self):
+        return {key: [listener.__class__.__name__ for listener in listeners]
+                for key, listeners in self._routes.items()}
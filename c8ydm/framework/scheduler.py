@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class ScheduledJob:
+    """
+    A periodic job. The interval is either a number of seconds or a callable returning
+    it, so jobs can follow configuration changes at runtime.
+    """
+
+    def __init__(self, name, fn, interval, deadline):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.deadline = deadline
+        self.running = False
+        self.cancelled = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.missed = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.max_lateness = 0.0
+
+    def get_interval(self):
+        interval = self.interval() if callable(self.interval) else self.interval
+        return max(float(interval), 0.001)
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'failures': self.failures,
+            'skipped': self.skipped,
+            'missed': self.missed,
+            'running': self.running,
+            'last_duration': self.last_duration,
+            'max_duration': self.max_duration,
+            'max_lateness': self.max_lateness,
+        }
+
+
+class Scheduler:
+    """
+    Heap based scheduler firing periodic jobs on drift-free deadlines.
+
+    The next deadline of a job is always derived from its previous deadline, not from
+    the time the job finished. A job that is still running when its next deadline is
+    reached is not started a second time; the cycle is skipped and counted. Deadlines
+    that passed completely while the scheduler was late are counted as missed.
+    Jobs are executed on the given WorkerPool.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, pool, clock=time.monotonic):
+        self.pool = pool
+        self.clock = clock
+        self._heap = []
+        self._jobs = {}
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def add_job(self, name, fn, interval, delay=0):
+        """
+        Adds a periodic job. The first run happens after `delay` seconds.
+        """
+        with self._condition:
+            job = ScheduledJob(name, fn, interval, self.clock() + delay)
+            old = self._jobs.get(name)
+            if old is not None:
+                old.cancelled = True
+            self._jobs[name] = job
+            heapq.heappush(self._heap, (job.deadline, next(self._counter), job))
+            self._condition.notify_all()
+            return job
+
+    def remove_job(self, name):
+        with self._condition:
+            job = self._jobs.pop(name, None)
+            if job is not None:
+                job.cancelled = True
+
+    def clear(self, prefix=''):
+        """
+        Cancels all jobs, or the jobs whose name starts with `prefix`.
+        """
+        with self._condition:
+            for name in [name for name in self._jobs if name.startswith(prefix)]:
+                self._jobs.pop(name).cancelled = True
+            if not self._jobs:
+                self._heap = []
+
+    def run(self):
+        """
+        Runs the scheduler loop in the calling thread until stop() is called. Returns
+        right away if stop() was called before.
+        """
+        while True:
+            with self._condition:
+                job = self._next_due_job()
+                if job is None:
+                    return
+            self._fire(job)
+
+    def _next_due_job(self):
+        while not self._stopped:
+            if not self._heap:
+                self._condition.wait()
+                continue
+            deadline, _, job = self._heap[0]
+            if job.cancelled:
+                heapq.heappop(self._heap)
+                continue
+            timeout = deadline - self.clock()
+            if timeout > 0:
+                self._condition.wait(timeout)
+                continue
+            heapq.heappop(self._heap)
+            return job
+        return None
+
+    def _fire(self, job):
+        now = self.clock()
+        interval = job.get_interval()
+        job.max_lateness = max(job.max_lateness, now - job.deadline)
+        if job.running:
+            job.skipped += 1
+            self.logger.warning(f'Job {job.name} is still running, skipping cycle')
+        else:
+            job.running = True
+            if not self.pool.submit(self._execute, job, name=job.name):
+                job.running = False
+                job.skipped += 1
+        next_deadline = job.deadline + interval
+        if next_deadline <= now:
+            missed = int((now - job.deadline) // interval)
+            job.missed += missed
+            next_deadline = job.deadline + (missed + 1) * interval
+            self.logger.warning(f'Job {job.name} missed {missed} deadline(s)')
+        job.deadline = next_deadline
+        with self._condition:
+            if not job.cancelled:
+                heapq.heappush(self._heap, (job.deadline, next(self._counter), job))
+
+    def _execute(self, job):
+        start = self.clock()
+        try:
+            job.fn()
+        except Exception as ex:
+            job.failures += 1
+            self.logger.exception(f'Error in scheduled job {job.name}: {ex}')
+        finally:
+            job.last_duration = self.clock() - start
+            job.max_duration = max(job.max_duration, job.last_duration)
+            job.runs += 1
+            job.running = False
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {name: job.stats() for name, job in self._jobs.items()}
@@ -17,6 +17,9 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import re
+
+
 class SmartRESTMessage:
 
   def __init__(self, topic, messageId, values):
@@ -40,3 +43,92 @@ class SmartRESTMessage:
       values.append(value)
     msg = str(self.messageId) + ',' + ','.join(map(str,values))
     return msg.rstrip(', ')
+
+
+class SmartRESTParser:
+  '''
+  Incremental parser for SmartREST CSV payloads. Values can be quoted with '"', a '""'
+  inside a quoted value is an escaped quote and quoted values can span multiple lines.
+  Every line is returned as its own SmartRESTMessage, so payloads containing several
+  operations are split into one message per operation. Data can be fed in chunks,
+  incomplete lines are kept until the next feed() or close().
+  '''
+  _field = re.compile(r'"((?:[^"]+|"")*)"|([^,\r\n"]*)')
+  _rest = re.compile(r'[^,\r\n]*')
+
+  def __init__(self, topic):
+    self.topic = topic
+    self._buffer = ''
+
+  @classmethod
+  def parse(cls, topic, payload):
+    '''
+    Parses a complete payload and returns the list of messages
+    '''
+    parser = cls(topic)
+    parser._buffer = payload
+    return parser._parse(final=True)
+
+  def feed(self, data):
+    self._buffer += data
+    return self._parse(final=False)
+
+  def close(self):
+    return self._parse(final=True)
+
+  def _parse(self, final):
+    buffer = self._buffer
+    messages = []
+    if '"' not in buffer:
+      # Fast path without quoting
+      lines = buffer.split('\n')
+      self._buffer = '' if final else lines.pop()
+      for line in lines:
+        line = line.rstrip('\r')
+        if line:
+          values = line.split(',')
+          messages.append(SmartRESTMessage(self.topic, values[0], values[1:]))
+      return messages
+    pos = 0
+    while pos < len(buffer):
+      values, end = self._parse_row(buffer, pos, final)
+      if values is None:
+        break
+      pos = end
+      if values != ['']:
+        messages.append(SmartRESTMessage(self.topic, values[0], values[1:]))
+    self._buffer = buffer[pos:]
+    return messages
+
+  def _parse_row(self, buffer, row_start, final):
+    values = []
+    pos = row_start
+    length = len(buffer)
+    while True:
+      match = self._field.match(buffer, pos)
+      if match.group(1) is not None:
+        value = match.group(1).replace('""', '"')
+      else:
+        value = match.group(2)
+      end = match.end()
+      if end < length and buffer[end] not in ',\r\n':
+        if match.group(1) is None and end == pos:
+          # Opening quote without a closing quote
+          if not final:
+            return None, row_start
+          value, end = buffer[pos + 1:], length
+        else:
+          # Stray characters after or inside a value are kept as they are
+          rest = self._rest.match(buffer, end)
+          value, end = value + rest.group(0), rest.end()
+      values.append(value)
+      if end >= length:
+        if not final:
+          return None, row_start
+        return values, length
+      if buffer[end] == ',':
+        pos = end + 1
+      elif buffer.startswith('\r\n', end):
+        return values, end + 2
+      else:
+        return values, end + 1
@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import contextlib
+import importlib.abc
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+
+class StartupTask:
+
+    def __init__(self, initializer):
+        self.initializer = initializer
+        self.name = initializer.__class__.__name__
+        self.qualname = f'{initializer.__class__.__module__}.{self.name}'
+        self.dependencies = list(initializer.getDependencies() or [])
+        self.priority = initializer.getPriority() or 0
+        self.dependents = []
+        self.waiting = 0
+        self.started = None
+        self.duration = None
+        self.failed = False
+
+
+class StartupGraph:
+    """
+    Runs initializers as a dependency graph on a WorkerPool.
+
+    An initializer is started once all initializers it depends on have finished
+    (successfully or not). Among initializers that become ready at the same time
+    the ones with a higher priority are queued first. Dependencies are given as class
+    names or module qualified class names; unknown dependencies are ignored.
+    Initializers in a dependency cycle do not wait for each other, only for their
+    dependencies outside the cycle.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, initializers, run, pool, clock=time.monotonic):
+        self.run_initializer = run
+        self.pool = pool
+        self.clock = clock
+        self.tasks = [StartupTask(initializer) for initializer in initializers]
+        self._condition = threading.Condition()
+        self._finished = 0
+        self._closing = False
+        self.started = None
+        self.duration = None
+        self._link()
+
+    def _link(self):
+        by_name = {}
+        for task in self.tasks:
+            by_name.setdefault(task.name, []).append(task)
+            by_name.setdefault(task.qualname, []).append(task)
+        for task in self.tasks:
+            for dependency in task.dependencies:
+                providers = [provider for provider in by_name.get(dependency, []) if provider is not task]
+                if not providers:
+                    self.logger.warning(f'Initializer {task.name} depends on unknown initializer {dependency}, ignoring')
+                for provider in providers:
+                    provider.dependents.append(task)
+                    task.waiting += 1
+        for cycle in self._cycles():
+            names = ', '.join(sorted(task.name for task in cycle))
+            self.logger.error(f'Initializers {names} form a dependency cycle, they do not wait for each other')
+            for provider in cycle:
+                for dependent in [dependent for dependent in provider.dependents if dependent in cycle]:
+                    provider.dependents.remove(dependent)
+                    dependent.waiting -= 1
+
+    def _cycles(self):
+        # Tarjan's algorithm, strongly connected components of more than one task are cycles
+        index = {}
+        lowlink = {}
+        stack = []
+        cycles = []
+
+        def visit(task):
+            index[task] = lowlink[task] = len(index)
+            stack.append(task)
+            for dependent in task.dependents:
+                if dependent not in index:
+                    visit(dependent)
+                    lowlink[task] = min(lowlink[task], lowlink[dependent])
+                elif dependent in stack:
+                    lowlink[task] = min(lowlink[task], index[dependent])
+            if lowlink[task] == index[task]:
+                component = set()
+                while True:
+                    member = stack.pop()
+                    component.add(member)
+                    if member is task:
+                        break
+                if len(component) > 1:
+                    cycles.append(component)
+
+        for task in self.tasks:
+            if task not in index:
+                visit(task)
+        return cycles
+
+    def run(self, budget=None):
+        """
+        Runs all initializers and waits until they are finished. Returns False if
+        the budget in seconds was exceeded; remaining initializers keep running, see
+        close().
+        """
+        self.started = self.clock()
+        with self._condition:
+            ready = [task for task in self.tasks if task.waiting == 0]
+        self._submit(ready)
+        with self._condition:
+            completed = self._condition.wait_for(
+                lambda: self._finished == len(self.tasks), budget)
+        self.duration = self.clock() - self.started
+        if not completed:
+            pending = ', '.join(self.pending())
+            self.logger.warning(f'Startup budget of {budget} sec exceeded, still running: {pending}')
+        return completed
+
+    def close(self):
+        """
+        Shuts the pool down once all initializers are finished, including the ones
+        that become ready after the budget was exceeded.
+        """
+        with self._condition:
+            drained = self._finished == len(self.tasks)
+            self._closing = not drained
+        if drained:
+            self.pool.shutdown(wait=False)
+
+    def _submit(self, tasks):
+        for task in sorted(tasks, key=lambda task: -task.priority):
+            self.pool.submit(self._execute, task, name=task.name)
+
+    def _execute(self, task):
+        task.started = self.clock()
+        try:
+            self.run_initializer(task.initializer)
+        except Exception as ex:
+            task.failed = True
+            self.logger.exception(f'Error in initializer {task.name}: {ex}')
+        finally:
+            task.duration = self.clock() - task.started
+            ready = []
+            with self._condition:
+                self._finished += 1
+                for dependent in task.dependents:
+                    dependent.waiting -= 1
+                    if dependent.waiting == 0:
+                        ready.append(dependent)
+                drained = self._closing and self._finished == len(self.tasks)
+                self._condition.notify_all()
+            self._submit(ready)
+            if drained:
+                self.pool.shutdown(wait=False)
+
+    def pending(self):
+        return [task.name for task in self.tasks if task.duration is None]
+
+    def report(self):
+        """
+        Returns the start offset and duration in seconds of every initializer.
+        """
+        return {task.qualname: {
+                    'start': None if task.started is None else task.started - self.started,
+                    'duration': task.duration,
+                    'failed': task.failed,
+                } for task in self.tasks}
+
+
+class _TimedLoader:
+    """
+    Wraps the loader of a module while it is imported, see ImportTimer.
+    """
+
+    def __init__(self, loader, timer):
+        self.loader = loader
+        self.timer = timer
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        # Extension modules are loaded here
+        with self.timer.measure(spec.name):
+            return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        try:
+            with self.timer.measure(module.__name__):
+                self.loader.exec_module(module)
+        finally:
+            module.__loader__ = self.loader
+            if getattr(module, '__spec__', None) is not None:
+                module.__spec__.loader = self.loader
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """
+    Measures the time every module takes to import, like python -X importtime. The
+    own time of a module excludes the modules it imports, the cumulative time
+    includes them.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._timings = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(spec.loader, self)
+        return spec
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        stack = self._local.__dict__.setdefault('stack', [])
+        started = self.clock()
+        stack.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - started
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                timing = self._timings.setdefault(name, [0.0, 0.0])
+                timing[0] += elapsed - children
+                timing[1] += elapsed
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def report(self):
+        with self._lock:
+            timings = sorted(self._timings.items(), key=lambda item: -item[1][1])
+        return [{'module': name, 'self': own, 'cumulative': cumulative}
+                for name, (own, cumulative) in timings]
+
+
+import_timer = None
+
+
+def install_import_timer():
+    """
+    Starts recording the import time of all modules imported from now on.
+    """
+    global import_timer
+    if import_timer is None:
+        import_timer = ImportTimer()
+        import_timer.install()
+    return import_timer
+
+
+def process_start(clock=time.monotonic):
+    """
+    Returns the time the process was started on the given monotonic clock, so the
+    interpreter start and the imports before the agent code runs are included.
+    """
+    try:
+        import psutil
+        return clock() - max(time.time() - psutil.Process().create_time(), 0)
+    except Exception:
+        return clock()
+
+
+class StartupTrace:
+    """
+    Records when the phases of the agent start began and how long they took, relative
+    to `origin`. Phases are kept in groups, e.g. the top level phases, the agent
+    modules and the initializers. A phase is recorded once, phases repeated by retries
+    keep their first start and their first completion.
+
+    When a `path` is set, finish() writes the report as JSON to it.
+    """
+    logger = logging.getLogger(__name__)
+    PHASES = 'phases'
+
+    def __init__(self, origin=None, path=None, import_timer=None, clock=time.monotonic):
+        self.clock = clock
+        self.origin = clock() if origin is None else origin
+        self.path = path
+        self.import_timer = import_timer
+        self.ready = None
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def begin(self, name, group=PHASES):
+        with self._lock:
+            self._groups.setdefault(group, {}).setdefault(
+                name, {'name': name, 'start': self.clock() - self.origin, 'duration': None})
+
+    def end(self, name, group=PHASES):
+        with self._lock:
+            entry = self._groups.get(group, {}).get(name)
+            if entry is not None and entry['duration'] is None:
+                entry['duration'] = self.clock() - self.origin - entry['start']
+
+    @contextlib.contextmanager
+    def phase(self, name, group=PHASES):
+        self.begin(name, group)
+        try:
+            yield
+        finally:
+            self.end(name, group)
+
+    def add(self, name, start, duration, group=PHASES, **details):
+        """
+        Records a phase measured elsewhere, `start` is a time of the trace clock.
+        """
+        with self._lock:
+            self._groups.setdefault(group, {}).setdefault(
+                name, dict({'name': name, 'start': start - self.origin, 'duration': duration}, **details))
+
+    def durations(self, group=PHASES):
+        with self._lock:
+            return {name: entry['duration'] for name, entry in self._groups.get(group, {}).items()
+                    if entry['duration'] is not None}
+
+    def report(self):
+        with self._lock:
+            report = {'ready': self.ready}
+            report.update({group: list(entries.values()) for group, entries in self._groups.items()})
+        if self.import_timer is not None:
+            report['imports'] = self.import_timer.report()
+        return report
+
+    def finish(self):
+        """
+        Marks the agent as ready and writes the report. Returns the time to ready in
+        seconds.
+        """
+        if self.ready is None:
+            self.ready = self.clock() - self.origin
+        if self.import_timer is not None:
+            self.import_timer.uninstall()
+        if self.path is not None:
+            try:
+                tmp = f'{self.path}.tmp'
+                with open(tmp, 'w') as file:
+                    json.dump(self.report(), file, indent=2)
+                os.replace(tmp, self.path)
+                self.logger.info(f'Startup trace written to {self.path}')
+            except OSError as ex:
+                self.logger.error(f'Could not write startup trace to {self.path}: {ex}')
+        return self.ready
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import logging
+import sys
+import threading
+import time
+import traceback
+
+
+class TrackedTask:
+    """
+    A task running on a worker pool, see Watchdog.
+    """
+
+    def __init__(self, pool, name, thread, started, budget):
+        self.pool = pool
+        self.name = name
+        self.thread_ident = thread.ident
+        self.thread_name = thread.name
+        self.started = started
+        self.budget = budget
+        self.stuck = False
+        # Innermost frame of the thread when the task was found stuck
+        self.location = None
+
+
+class Watchdog:
+    """
+    Keeps track of the tasks running on the worker pools and reports the ones running
+    longer than their budget.
+
+    A stuck task is reported once: the stack of its thread is logged and `on_stuck` is
+    called with the task and the formatted stack. When the task finishes after all,
+    `on_recovered` is called. The watchdog checks the tasks from its own thread, so it
+    keeps working when all pool workers are blocked.
+    """
+    logger = logging.getLogger(__name__)
+    AGE_BUCKETS = (1, 10, 60, 300, 900, 3600)
+
+    def __init__(self, budget=300, interval=10, on_stuck=None, on_recovered=None, clock=time.monotonic):
+        self.budget = budget
+        self.interval = interval
+        self.on_stuck = on_stuck
+        self.on_recovered = on_recovered
+        self.clock = clock
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stuck_total = 0
+        self.recovered_total = 0
+
+    def begin(self, pool, name, budget=None):
+        """
+        Starts tracking a task executed by the calling thread.
+        """
+        task = TrackedTask(pool, name, threading.current_thread(), self.clock(), budget or self.budget)
+        with self._lock:
+            self._tasks.add(task)
+        return task
+
+    def end(self, task):
+        with self._lock:
+            self._tasks.discard(task)
+            if task.stuck:
+                self.recovered_total += 1
+        if task.stuck:
+            self.logger.warning(f'Task {task.name} finished after {self.clock() - task.started:.0f} seconds')
+            self._notify(self.on_recovered, task)
+
+    def stuck(self, prefix=''):
+        """
+        Returns the stuck tasks, or the stuck tasks whose name starts with `prefix`.
+        """
+        with self._lock:
+            return [task for task in self._tasks if task.stuck and task.name.startswith(prefix)]
+
+    def check(self):
+        """
+        Reports the tasks that exceeded their budget since the last check.
+        """
+        now = self.clock()
+        with self._lock:
+            exceeded = [task for task in self._tasks if not task.stuck and now - task.started > task.budget]
+            for task in exceeded:
+                task.stuck = True
+            self.stuck_total += len(exceeded)
+        if not exceeded:
+            return exceeded
+        frames = sys._current_frames()
+        for task in exceeded:
+            frame = frames.get(task.thread_ident)
+            stack = ''
+            if frame is not None:
+                summary = traceback.extract_stack(frame)
+                stack = ''.join(summary.format())
+                task.location = f'{summary[-1].filename}:{summary[-1].lineno} in {summary[-1].name}'
+            self.logger.warning(f'Task {task.name} on {task.pool} is running for {now - task.started:.0f} seconds, '
+                                f'exceeding its budget of {task.budget} seconds. Stack of {task.thread_name}:\n{stack}')
+            self._notify(self.on_stuck, task, stack)
+        return exceeded
+
+    def _notify(self, callback, *args):
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as ex:
+            self.logger.exception(f'Error reporting task {args[0].name}: {ex}')
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='Watchdog')
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as ex:
+                self.logger.exception(f'Error in watchdog: {ex}')
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def stats(self):
+        now = self.clock()
+        with self._lock:
+            tasks = list(self._tasks)
+            stuck_total = self.stuck_total
+            recovered_total = self.recovered_total
+        pools = {}
+        ages = [now - task.started for task in tasks]
+        for task in tasks:
+            pool = pools.setdefault(task.pool, {'running': 0, 'stuck': 0})
+            pool['running'] += 1
+            pool['stuck'] += task.stuck
+        buckets = {bound: sum(1 for age in ages if age <= bound) for bound in self.AGE_BUCKETS}
+        buckets['+Inf'] = len(ages)
+        return {
+            'threads': threading.active_count(),
+            'running': len(tasks),
+            'stuck': sum(1 for task in tasks if task.stuck),
+            'stuck_total': stuck_total,
+            'recovered_total': recovered_total,
+            'oldest_age_seconds': max(ages, default=0),
+            'task_age_seconds': {'buckets': buckets, 'count': len(ages), 'sum': sum(ages)},
+            'pools': pools,
+        }
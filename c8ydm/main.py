@@ -33,12 +33,16 @@ from paho.mqtt.client import LOGGING_LEVEL
 import c8ydm.utils.systemutils as systemutils
 from c8ydm.client import Agent
 from c8ydm.client import Bootstrap
+from c8ydm.client import Gateway
+from c8ydm.framework import startup
 from c8ydm.utils import Configuration
 
 agent = None
 bootstrap_agent = None
 terminated = False
 simulated = False
+# Time the daemon gets on top of agent.shutdown.timeout.seconds to exit on c8ydm.stop
+SHUTDOWN_SLACK_SECONDS = 10
 
 def handle_sigterm(*args):
     global terminated
@@ -68,6 +72,9 @@ def keyboard_interupt_hook(exctype, value, traceback):
 
 def start():
     try:
+        trace = startup.StartupTrace(origin=startup.process_start(), import_timer=startup.import_timer)
+        trace.add('imports', trace.origin, trace.clock() - trace.origin)
+        trace.begin('configuration')
         sys.excepthook = keyboard_interupt_hook
         global agent
         global simulated
@@ -81,6 +88,8 @@ def start():
         config_path = pathlib.Path(path / 'agent.ini')
         if not config_path.is_file():
             sys.exit(f'No agent.ini found in "{path}". Create it to properly configure the agent.')
+        if '--trace-startup' in sys.argv:
+            trace.path = path / 'startup-trace.json'
         config = Configuration(str(path))
         loglevel = config.getValue('agent', 'loglevel')
         logger.setLevel(loglevel)
@@ -105,6 +114,8 @@ def start():
         # Log to Rotating File
         logger.addHandler(rotate_handler)
 
+        trace.end('configuration')
+        trace.begin('serial')
         containerId = None
         serial = None
         
@@ -129,14 +140,23 @@ def start():
                 simulated = True
         if config.getValue('agent','device.id'):
             serial = config.getValue('agent','device.id')
+        trace.end('serial')
         #if not simulated:
         startDaemon(str(path) + '/agent.pid')
         logging.info(f'Serial: {serial}')
 
+        serials = Gateway.get_serials(config, serial)
+        if serials:
+            # The gateway is stopped like a single agent
+            agent = Gateway(serials, path, config, str(path) + '/agent.pid', simulated)
+            agent.run()
+            return
+
         credentials = config.getCredentials()
         #logging.debug('Credentials:')
         #logging.debug(credentials)
-        agent = Agent(serial, path, config, str(path) + '/agent.pid', simulated)
+        with trace.phase('agent'):
+            agent = Agent(serial, path, config, str(path) + '/agent.pid', simulated, trace=trace)
         cert_auth = config.getBooleanValue('mqtt','cert_auth')
         logging.debug(f'cert_auth: {cert_auth}')
         if not cert_auth and credentials is None:
@@ -146,7 +166,8 @@ def start():
                 logging.error('No bootstrap credentials found. Stopping agent.')
                 return
             bootstrapAgent = Bootstrap(serial, str(path), config)
-            bootstrapAgent.bootstrap()
+            with trace.phase('bootstrap'):
+                bootstrapAgent.bootstrap()
             credentials = config.getCredentials()
             if credentials is None:
                 logging.error('No credentials found after bootstrapping. Stopping agent.')
@@ -162,7 +183,10 @@ def stop():
     stopDaemon(path + '/agent.pid')
 
 def stopDaemon(pidfile):
-    """Stop the daemon."""
+    """Stop the daemon.
+
+    The daemon gets SIGTERM and up to agent.shutdown.timeout.seconds plus some
+    slack to finish its operations and disconnect before it is killed."""
     logging.info(f'Stopping...')
     global terminated
     # Get the pid from the pidfile
@@ -174,25 +198,30 @@ def stopDaemon(pidfile):
 
     if not pid:
         return
-    else:
+    if pid == os.getpid():
+        # Called by the daemon itself after the agent was stopped
         delpid(pidfile)
-    # Try killing the daemon process
+        os.kill(pid, signal.SIGKILL)
+        return
+    config = Configuration(str(pathlib.Path(pidfile).parent))
+    timeout = config.getIntValue('agent', 'shutdown.timeout.seconds', 30) + SHUTDOWN_SLACK_SECONDS
     try:
-        while 1:
-            #if not terminated:
-            logging.debug(f'Try killing pid {pid}')
-            os.kill(pid, signal.SIGKILL)
-            time.sleep(0.1)
-                
+        logging.debug(f'Sending SIGTERM to pid {pid}')
+        os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + timeout
+        logging.info(f'Waiting up to {timeout}s for pid {pid} to stop')
+        while isPidRunning(pid):
+            if time.monotonic() >= deadline:
+                logging.warning(f'Pid {pid} did not stop within {timeout}s, killing it')
+                os.kill(pid, signal.SIGKILL)
+                break
+            time.sleep(0.5)
     except OSError as err:
         e = str(err.args)
-        if e.find("No such process") > 0:
-            if os.path.exists(pidfile):
-                os.remove(pidfile)
-        else:
+        if e.find("No such process") < 0:
             print(str(err.args))
             sys.exit(1)
-    
+    delpid(pidfile)
 
 
 def delpid(pidfile):
@@ -234,11 +263,11 @@ def startDaemon(pidfile):
 def isPidRunning(pid):
     """ Check For the existence of a unix pid. """
     try:
-        logging.info('Checking if pid ' + str(pid) + ' is existing...')
+        logging.debug('Checking if pid ' + str(pid) + ' is existing...')
         os.kill(pid, 0)
-        logging.info('Pid ' + str(pid) + ' exists')
+        logging.debug('Pid ' + str(pid) + ' exists')
     except OSError:
-        logging.info('Pid ' + str(pid) + ' does not exist')
+        logging.debug('Pid ' + str(pid) + ' does not exist')
         return False
     else:
         return True
@@ -73,6 +73,12 @@ class Configuration():
     except (NoOptionError, NoSectionError):
       return None
 
+  def getIntValue(self, category, key, default=None):
+    try:
+      return self.configuration.getint(category, key)
+    except (NoOptionError, NoSectionError, ValueError):
+      return default
+
   def setValue(self, category, key, value):
     if category not in self.configuration.sections():
       self.configuration.add_section(category)
@@ -19,33 +19,220 @@ limitations under the License.
 """
 import logging
 import inspect
+import json
 import os
 import pkgutil
 import importlib
+import threading
+from c8ydm.framework.aio import to_thread
 from c8ydm.framework.modulebase import Sensor, Listener, Initializer
 import c8ydm.agentmodules as agentmodules
 
-def findAgentModules():
-    
-    pkgpath = os.path.dirname(agentmodules.__file__)
-    modules = {
-        'sensors': [],
-        'listeners': [],
-        'initializers': []
+ROLES = (('sensors', Sensor), ('listeners', Listener), ('initializers', Initializer))
+
+
+class ModuleManifest:
+    """
+    Description of the agent modules cached in a JSON file: the classes of every
+    module, their roles and, for pure listeners, the operations, templates and
+    messages they handle. The manifest is discarded when a file of the agentmodules
+    package changed.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, path, package=agentmodules):
+        self.path = path
+        self.package = package
+        self.fingerprint = self._fingerprint()
+        self._modules = {}
+        self._changed = False
+        self._load()
+
+    def _fingerprint(self):
+        fingerprint = {}
+        for path in self.package.__path__:
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.py'):
+                    stat = os.stat(os.path.join(path, name))
+                    fingerprint[name] = [stat.st_size, stat.st_mtime_ns]
+        return fingerprint
+
+    def _load(self):
+        try:
+            with open(self.path) as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as ex:
+            self.logger.warning(f'Could not read module manifest {self.path}, creating a new one: {ex}')
+            return
+        if manifest.get('fingerprint') != self.fingerprint:
+            self.logger.info('Agent modules changed, creating a new module manifest')
+            return
+        self._modules = manifest.get('modules', {})
+
+    def module_names(self):
+        return [f'{self.package.__name__}.{info.name}' for info in pkgutil.iter_modules(self.package.__path__)]
+
+    def get(self, module):
+        return self._modules.get(module)
+
+    def put(self, module, classes):
+        if self._modules.get(module) != classes:
+            self._modules[module] = classes
+            self._changed = True
+
+    def save(self):
+        if not self._changed:
+            return
+        try:
+            tmp = f'{self.path}.tmp'
+            with open(tmp, 'w') as file:
+                json.dump({'fingerprint': self.fingerprint, 'modules': self._modules}, file, indent=2)
+            os.replace(tmp, self.path)
+            self._changed = False
+        except OSError as ex:
+            self.logger.error(f'Could not write module manifest {self.path}: {ex}')
+
+
+class LazyListener(Listener):
+    """
+    Stands in for a listener described by the module manifest. Its module is imported
+    and the listener created when the first operation arrives, until then the manifest
+    answers which operations and messages it handles.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, serial, agent, description):
+        super().__init__(serial, agent)
+        self.description = description
+        self.fragment = description.get('fragment')
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._listener is None:
+                module = self.__class__.__module__
+                name = self.__class__.__name__
+                self.logger.info(f'Loading listener {module}.{name} on first use')
+                cls = getattr(importlib.import_module(module), name)
+                self._listener = cls(self.serial, self.agent)
+            return self._listener
+
+    def handleOperation(self, message):
+        return self.load().handleOperation(message)
+
+    async def handleOperationAsync(self, message):
+        listener = await to_thread(self.load)
+        return await listener.handleOperationAsync(message)
+
+    def getSupportedOperations(self):
+        return self.description.get('operations')
+
+    def getSupportedTemplates(self):
+        return self.description.get('templates')
+
+    def getHandledMessages(self):
+        handled = self.description.get('handled')
+        return None if handled is None else [tuple(route) for route in handled]
+
+    def getIdempotentOperations(self):
+        return self.description.get('idempotent')
+
+
+def _lazyListener(module, name, serial, agent, description):
+    # Named like the real class, the operation journal identifies listeners by class name
+    cls = type(name, (LazyListener,), {'__module__': module, '__qualname__': name})
+    return cls(serial, agent, description)
+
+
+def _describe(listener):
+    handled = listener.getHandledMessages()
+    return {
+        'operations': list(listener.getSupportedOperations() or []),
+        'templates': list(listener.getSupportedTemplates() or []),
+        'handled': None if handled is None else [[topic, str(message_id)] for topic, message_id in handled],
+        'idempotent': list(listener.getIdempotentOperations() or []),
+        'fragment': getattr(listener, 'fragment', None),
     }
-    for name in pkgutil.iter_modules([pkgpath]):
-        logging.debug(name)
-        currentModule = 'c8ydm.agentmodules.' + name[1]
-        i = importlib.import_module(currentModule)
-        for name, obj in inspect.getmembers(i):
-            if inspect.isclass(obj) and obj.__module__ == currentModule:
-                if issubclass(obj, Sensor):
-                    logging.debug('Import sensor: ' + name)
-                    modules['sensors'].append(obj)
-                if issubclass(obj, Listener):
-                    logging.debug('Import listener: ' + name)
-                    modules['listeners'].append(obj)
-                if issubclass(obj, Initializer):
-                    logging.debug('Import initializer: ' + name)
-                    modules['initializers'].append(obj)
+
+
+def _names(module, name=None):
+    short = module.rsplit('.', 1)[-1]
+    if name is None:
+        return {short, module}
+    return {f'{short}.{name}', f'{module}.{name}'}
+
+
+def _isEnabled(module, name, enabled, disabled):
+    names = _names(module) | _names(module, name)
+    if names & disabled:
+        return False
+    return not enabled or bool(names & enabled)
+
+
+def _mightBeEnabled(module, enabled, disabled):
+    if _names(module) & disabled:
+        return False
+    prefixes = tuple(f'{name}.' for name in _names(module))
+    return not enabled or bool(_names(module) & enabled) or any(name.startswith(prefixes) for name in enabled)
+
+
+def loadAgentModules(serial, agent, manifest, trace=None, enabled=None, disabled=None, lazy=True):
+    """
+    Creates the sensors, listeners and initializers of the agent modules. A class
+    having several roles is created once.
+
+    `enabled` and `disabled` are sets of module names (e.g. sensehat) or module
+    qualified class names (e.g. sensehat.DeviceSensor); modules that are not enabled
+    are not imported at all. Modules containing only listeners that are described in
+    the manifest are imported when their first operation arrives if `lazy` is set.
+    """
+    enabled = enabled or set()
+    disabled = disabled or set()
+    modules = {role: [] for role, _ in ROLES}
+    for module in manifest.module_names():
+        if not _mightBeEnabled(module, enabled, disabled):
+            logging.info(f'Agent module {module} is disabled')
+            continue
+        classes = manifest.get(module)
+        if lazy and classes is not None:
+            selected = [cls for cls in classes if _isEnabled(module, cls['name'], enabled, disabled)]
+            if all(cls['roles'] == ['listeners'] and 'listener' in cls for cls in selected):
+                for cls in classes:
+                    if cls in selected:
+                        modules['listeners'].append(_lazyListener(module, cls['name'], serial, agent, cls['listener']))
+                    else:
+                        logging.info(f'Agent module {module}.{cls["name"]} is disabled')
+                continue
+        if trace is not None:
+            trace.begin(module, 'modules')
+        imported = importlib.import_module(module)
+        if trace is not None:
+            trace.end(module, 'modules')
+        classes = []
+        for name, obj in inspect.getmembers(imported):
+            if not inspect.isclass(obj) or obj.__module__ != module:
+                continue
+            roles = [role for role, base in ROLES if issubclass(obj, base)]
+            if not roles:
+                continue
+            description = {'name': name, 'roles': roles}
+            classes.append(description)
+            if not _isEnabled(module, name, enabled, disabled):
+                logging.info(f'Agent module {module}.{name} is disabled')
+                continue
+            if trace is not None:
+                trace.begin(f'{module}.{name}', 'instances')
+            instance = obj(serial, agent)
+            if trace is not None:
+                trace.end(f'{module}.{name}', 'instances')
+            for role in roles:
+                logging.debug(f'Import {role[:-1]}: {module}.{name}')
+                modules[role].append(instance)
+            if roles == ['listeners']:
+                description['listener'] = _describe(instance)
+        manifest.put(module, classes)
+    manifest.save()
     return modules
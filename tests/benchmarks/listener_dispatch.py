@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Compares the former thread-per-listener fan-out of Agent.__on_message with the
+bounded WorkerPool dispatcher. Reports messages per second and peak thread count.
+
+Usage (from the repository root):
+
+    python -m tests.benchmarks.listener_dispatch --messages 2000 --listeners 15
+"""
+import argparse
+import threading
+import time
+
+from c8ydm.framework.dispatcher import WorkerPool
+
+
+class BenchmarkListener:
+    """Mimics an agent module that checks topic and messageId and returns."""
+
+    def __init__(self, message_id, work, done):
+        self.message_id = message_id
+        self.work = work
+        self.done = done
+
+    def handleOperation(self, message):
+        if message == self.message_id:
+            time.sleep(self.work)
+        self.done.release()
+
+
+class ThreadSampler(threading.Thread):
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = threading.active_count()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, threading.active_count())
+            time.sleep(0.0005)
+
+
+def fan_out(listeners, message):
+    for listener in listeners:
+        thread = threading.Thread(target=listener.handleOperation, args=(message,))
+        thread.daemon = True
+        thread.start()
+
+
+def run(mode, messages, listener_count, work, workers, queue_size):
+    done = threading.Semaphore(0)
+    listeners = [BenchmarkListener(str(500 + i), work, done) for i in range(listener_count)]
+    pool = WorkerPool('Bench', workers=workers, queue_size=queue_size, overflow='block')
+    sampler = ThreadSampler()
+    sampler.start()
+    start = time.perf_counter()
+    for i in range(messages):
+        message = str(500 + i % listener_count)
+        if mode == 'fan-out':
+            fan_out(listeners, message)
+        else:
+            for listener in listeners:
+                pool.submit(listener.handleOperation, message)
+    for _ in range(messages * listener_count):
+        done.acquire()
+    elapsed = time.perf_counter() - start
+    sampler.running = False
+    sampler.join()
+    pool.shutdown()
+    return messages / elapsed, sampler.peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\nUsage')[0].split('\n\n')[-1])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--listeners', type=int, default=15)
+    parser.add_argument('--work-ms', type=float, default=5,
+                        help='time the matching listener spends handling a message')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--queue-size', type=int, default=256)
+    args = parser.parse_args()
+
+    print(f'{"mode":<12}{"msg/s":>12}{"peak threads":>16}')
+    for mode in ('fan-out', 'pool'):
+        rate, peak = run(mode, args.messages, args.listeners, args.work_ms / 1000,
+                         args.workers, args.queue_size)
+        print(f'{mode:<12}{rate:>12.1f}{peak:>16}')
+
+
+if __name__ == '__main__':
+    main()
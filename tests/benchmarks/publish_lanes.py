@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Measures how long operation updates wait behind a flood of measurements on a
+saturated link, with the priority lanes of CoalescingPublisher and with a single
+FIFO lane. The link is simulated by a send callback with a fixed bandwidth.
+The backlog runs start with --backlog measurements stored in an Outbox, which is
+replayed while new messages are routed like Agent.publishMessage does.
+
+Usage (from the repository root):
+
+    python -m tests.benchmarks.publish_lanes --seconds 3 --bandwidth 200000 --backlog 2000
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from c8ydm.client.outbox import Outbox, OutboxReplayer
+from c8ydm.client.publisher import LANES, CoalescingPublisher, classify
+
+OPERATION_UPDATE = '503,c8y_Command,done'
+
+
+class Link:
+
+    def __init__(self, bandwidth):
+        self.bandwidth = bandwidth
+        self.busy_until = time.monotonic()
+        self.latencies = []
+        # Publish times of operation updates, which carry a sequence number
+        self.created = {}
+        self.lock = threading.Lock()
+
+    def send(self, topic, payload, qos, futures):
+        now = time.monotonic()
+        with self.lock:
+            self.busy_until = max(self.busy_until, now) + len(payload) / self.bandwidth
+            for line in payload.split('\n'):
+                created = self.created.pop(line, None)
+                if created is not None:
+                    self.latencies.append(now - created)
+
+    def can_send(self):
+        return time.monotonic() >= self.busy_until
+
+    def replay(self, topic, payload, qos):
+        # Outbox replay waits for each message like the agent waits for the broker
+        time.sleep(max(self.busy_until - time.monotonic(), 0))
+        self.send(topic, payload, qos, ())
+        return True
+
+
+def run(lanes, seconds, bandwidth, backlog=0, priority=None):
+    link = Link(bandwidth)
+    publisher = CoalescingPublisher(
+        link.send, window=0.05, can_send=link.can_send, lanes=lanes,
+        classify=classify if len(lanes) > 1 else lambda topic, payload: lanes[0][0])
+    publisher.start()
+    outbox = replayer = None
+    directory = tempfile.TemporaryDirectory()
+    if backlog:
+        outbox = Outbox(os.path.join(directory.name, 'outbox.db'), max_messages=backlog * 10,
+                        max_bytes=backlog * 1000, priority=priority)
+        for i in range(backlog):
+            outbox.put('s/us', f'200,c8y_Temperature,T,{i},C')
+        replayer = OutboxReplayer(outbox, link.replay, lambda: True, rate=bandwidth)
+        replayer.start()
+        replayer.wake()
+
+    def publish(payload, qos=0):
+        if outbox is not None and outbox.holds_back('s/us', payload):
+            outbox.put('s/us', payload, qos)
+            replayer.wake()
+        else:
+            publisher.publish('s/us', payload, qos)
+
+    end = time.monotonic() + seconds
+    next_operation = time.monotonic()
+    sequence = 0
+    while time.monotonic() < end:
+        for i in range(20):
+            publish(f'200,c8y_Temperature,T,{i},C')
+        if time.monotonic() >= next_operation:
+            payload = f'{OPERATION_UPDATE},{sequence}'
+            with link.lock:
+                link.created[payload] = time.monotonic()
+            publish(payload, 1)
+            sequence += 1
+            next_operation += 0.1
+        time.sleep(0.001)
+    publisher.stop()
+    if replayer is not None:
+        replayer.stop(timeout=5)
+        outbox.close()
+    directory.cleanup()
+    # Updates still waiting at the end count with the run time as latency
+    latencies = sorted(link.latencies + [time.monotonic() - created for created in link.created.values()])
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\nUsage')[0].split('\n\n')[-1])
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--bandwidth', type=int, default=200000, help='bytes per second')
+    parser.add_argument('--backlog', type=int, default=2000,
+                        help='measurements stored in the outbox at start, 0 skips the backlog runs')
+    args = parser.parse_args()
+
+    print(f'{"lanes":<18}{"p50 ms":>10}{"p99 ms":>10}')
+    for label, lanes in (('fifo', (('default', 1),)), ('priority', LANES)):
+        p50, p99 = run(lanes, args.seconds, args.bandwidth)
+        print(f'{label:<18}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}')
+    if args.backlog:
+        control = lambda topic, payload: classify(topic, payload) == 'control'
+        for label, priority in (('backlog fifo', None), ('backlog priority', control)):
+            p50, p99 = run(LANES, args.seconds, args.bandwidth, args.backlog, priority)
+            print(f'{label:<18}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Compares the former comma split of Agent.__on_message with SmartRESTParser on
+typical inbound payloads. Reports payloads and messages per second. The split
+yields a single message per payload, so batched payloads are only counted once.
+
+Usage (from the repository root):
+
+    python -m tests.benchmarks.smartrest_parse --payloads 100000
+"""
+import argparse
+import time
+
+from c8ydm.framework.smartrest import SmartRESTMessage, SmartRESTParser
+
+PAYLOADS = {
+    'plain': '511,device-1234,show uptime',
+    'quoted': '511,device-1234,"echo ""hello, world"" && ls -la"',
+    'batched': '\n'.join(f'528,device-1234,package-{i},1.{i},,install' for i in range(10)),
+    'config': '513,device-1234,"' + '\n'.join(f'agent.key{i}=value{i}' for i in range(30)) + '"',
+}
+
+
+def split(topic, payload):
+    messageParts = payload.split(',')
+    return [SmartRESTMessage(topic, messageParts[0], messageParts[1:])]
+
+
+def run(parse, payload, count):
+    messages = 0
+    start = time.perf_counter()
+    for _ in range(count):
+        messages += len(parse('s/ds', payload))
+    elapsed = time.perf_counter() - start
+    return count / elapsed, messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\nUsage')[0].split('\n\n')[-1])
+    parser.add_argument('--payloads', type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f'{"payload":<10}{"parser":<10}{"payloads/s":>14}{"messages/s":>14}')
+    for name, payload in PAYLOADS.items():
+        for label, parse in (('split', split), ('parser', SmartRESTParser.parse)):
+            payload_rate, message_rate = run(parse, payload, args.payloads)
+            print(f'{name:<10}{label:<10}{payload_rate:>14.0f}{message_rate:>14.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import asyncio
+import contextvars
+import threading
+
+import pytest
+
+from c8ydm.framework import operations
+from c8ydm.framework.aio import to_thread
+from c8ydm.framework.modulebase import Listener, Sensor
+from c8ydm.framework.journal import DONE, OperationJournal
+from c8ydm.framework.operations import OperationExecutor
+from c8ydm.framework.smartrest import SmartRESTMessage
+
+_value = contextvars.ContextVar('value', default=None)
+
+
+class CommandListener(Listener):
+
+  def handleOperation(self, message):
+    self.thread = threading.current_thread()
+    self.checkpoint(DONE)
+
+  def getSupportedOperations(self):
+    return ['c8y_Command']
+
+  def getSupportedTemplates(self):
+    return []
+
+  def getMessageIds(self):
+    return ['511']
+
+
+class MemorySensor(Sensor):
+
+  def getSensorMessages(self):
+    return [threading.current_thread()]
+
+
+@pytest.fixture(params=['to_thread', 'run_in_executor'])
+def runtime(request, monkeypatch):
+  # Python < 3.9 has no asyncio.to_thread
+  if request.param == 'run_in_executor':
+    monkeypatch.delattr(asyncio, 'to_thread')
+  return request.param
+
+
+def test_to_thread_keeps_the_context_of_the_caller(runtime):
+  async def main():
+    _value.set('operation')
+    return await to_thread(lambda: (_value.get(), threading.current_thread()))
+
+  value, thread = asyncio.run(main())
+  assert value == 'operation'
+  assert thread is not threading.main_thread()
+
+
+def test_sync_sensor_runs_off_the_loop(runtime):
+  messages = asyncio.run(MemorySensor('device', None).getSensorMessagesAsync())
+  assert messages[0] is not threading.main_thread()
+
+
+def test_sync_listener_checkpoints_in_the_asyncio_runtime(runtime, tmp_path):
+  listener = CommandListener('device', None)
+  started = []
+  executor = OperationExecutor(started.append, lambda operation, reason: None,
+                               journal=OperationJournal(str(tmp_path / 'operations.db')))
+  executor.submit(listener, SmartRESTMessage('s/ds', '511', ['device', 'ls']))
+  asyncio.run(executor.execute_async(started[0]))
+  assert listener.thread is not threading.main_thread()
+  assert started[0].step == DONE
+  assert operations.current_operation() is None
+  assert executor.drain(1) == []
@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+from c8ydm.client.inflight import PublishFuture
+from c8ydm.framework.children import ChildDeviceRegistry
+
+
+class Clock:
+
+  def __init__(self, now=1000.0):
+    self.now = now
+
+  def __call__(self):
+    return self.now
+
+
+class Publisher:
+  """
+  Records published messages and resolves their futures with `state`.
+  """
+
+  def __init__(self, state=PublishFuture.PUBLISHED):
+    self.state = state
+    self.messages = []
+
+  def __call__(self, message, qos=0):
+    self.messages.append((message.topic, message.getMessage()))
+    future = PublishFuture(message.topic, qos)
+    future.resolve(self.state, None if self.state == PublishFuture.PUBLISHED else 'not connected')
+    return future
+
+
+@pytest.fixture
+def path(tmp_path):
+  return os.path.join(str(tmp_path), 'children.json')
+
+
+def test_known_child_is_registered_once(path):
+  publisher = Publisher()
+  registry = ChildDeviceRegistry(path, publisher, clock=Clock())
+  assert registry.register_device('child-1', 'Child 1', 'c8y_Container') is not None
+  assert registry.register_device('child-1', 'Child 1', 'c8y_Container') is None
+  assert publisher.messages == [('s/us', '101,child-1,Child 1,c8y_Container')]
+  assert registry.stats()['suppressed'] == 1
+
+
+def test_registrations_survive_a_restart(path):
+  ChildDeviceRegistry(path, Publisher(), clock=Clock()).register_device('child-1', 'Child 1', 'c8y_Container')
+  publisher = Publisher()
+  registry = ChildDeviceRegistry(path, publisher, clock=Clock())
+  assert registry.is_registered('child-1')
+  assert registry.register_device('child-1', 'Child 1', 'c8y_Container') is None
+  assert publisher.messages == []
+
+
+def test_changed_or_old_registrations_are_published_again(path):
+  clock = Clock()
+  publisher = Publisher()
+  registry = ChildDeviceRegistry(path, publisher, max_age=3600, clock=clock)
+  registry.register_device('child-1', 'Child 1', 'c8y_Container')
+  registry.register_device('child-1', 'Renamed', 'c8y_Container')
+  clock.now += 3601
+  registry.register_device('child-1', 'Renamed', 'c8y_Container')
+  assert len(publisher.messages) == 3
+
+
+def test_failed_registration_is_forgotten(path):
+  registry = ChildDeviceRegistry(path, Publisher(PublishFuture.FAILED), clock=Clock())
+  future = registry.register_device('child-1', 'Child 1', 'c8y_Container')
+  assert future.state == PublishFuture.FAILED
+  assert not registry.is_registered('child-1')
+  assert not ChildDeviceRegistry(path, Publisher()).is_registered('child-1')
+
+
+def test_queued_registration_is_kept(path):
+  registry = ChildDeviceRegistry(path, Publisher(PublishFuture.QUEUED), clock=Clock())
+  registry.register_device('child-1', 'Child 1', 'c8y_Container')
+  assert registry.is_registered('child-1')
+
+
+def test_service_status_is_only_published_when_it_changed(path):
+  publisher = Publisher()
+  registry = ChildDeviceRegistry(path, publisher, clock=Clock())
+  registry.register_service('svc-1', 'docker', 'web', 'up')
+  assert registry.update_status('svc-1', 'up') is None
+  registry.update_status('svc-1', 'down')
+  # Registering a known service again only updates its status
+  assert registry.register_service('svc-1', 'docker', 'web', 'up') is None
+  assert publisher.messages == [('s/us', '102,svc-1,docker,web,up'), ('s/us/svc-1', '104,down'),
+                                ('s/us/svc-1', '104,up')]
+  assert registry.children(ChildDeviceRegistry.SERVICE) == ['svc-1']
+  assert registry.children(ChildDeviceRegistry.DEVICE) == []
+
+
+def test_forgotten_child_is_registered_again(path):
+  publisher = Publisher()
+  registry = ChildDeviceRegistry(path, publisher, clock=Clock())
+  registry.register_device('child-1', 'Child 1', 'c8y_Container')
+  registry.forget('child-1')
+  assert registry.register_device('child-1', 'Child 1', 'c8y_Container') is not None
+  assert len(publisher.messages) == 2
+
+
+def test_unreadable_file_registers_children_again(path):
+  with open(path, 'w') as f:
+    f.write('{')
+  registry = ChildDeviceRegistry(path, Publisher(), clock=Clock())
+  assert registry.children() == []
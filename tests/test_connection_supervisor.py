@@ -0,0 +1,135 @@
+import threading
+
+import paho.mqtt.client as mqtt
+
+from c8ydm.client.connection_supervisor import Backoff, ConnectionSupervisor
+
+
+class Clock:
+
+  def __init__(self, now=1000.0):
+    self.now = now
+
+  def __call__(self):
+    return self.now
+
+
+class Client:
+  """
+  Stands in for a paho client whose first `failures` reconnects fail.
+  """
+
+  def __init__(self, failures=0):
+    self.failures = failures
+    self.reconnects = 0
+    self.supervisor = None
+    self.connack = False
+    self.lock = threading.Lock()
+
+  def reconnect(self):
+    with self.lock:
+      self.reconnects += 1
+      if self.reconnects <= self.failures:
+        raise ConnectionRefusedError('broker down')
+      self.connack = True
+
+  def loop(self, timeout=1.0):
+    with self.lock:
+      connack, self.connack = self.connack, False
+    if connack:
+      self.supervisor.connected(0)
+    else:
+      threading.Event().wait(0.001)
+    return mqtt.MQTT_ERR_SUCCESS
+
+
+def upper_bound(low, high):
+  return high
+
+
+def test_backoff_doubles_up_to_the_cap():
+  backoff = Backoff(base=1, cap=10, rand=upper_bound)
+  assert [backoff.next_delay() for _ in range(6)] == [1, 2, 4, 8, 10, 10]
+  backoff.reset()
+  assert backoff.next_delay() == 1
+
+
+def test_backoff_jitter_spans_the_whole_window():
+  windows = []
+  backoff = Backoff(base=1, cap=300, rand=lambda low, high: windows.append((low, high)) or low)
+  for _ in range(3):
+    backoff.next_delay()
+  assert windows == [(0, 1), (0, 2), (0, 4)]
+
+
+def test_backoff_runs_out_of_attempts():
+  backoff = Backoff(base=1, max_attempts=2, rand=upper_bound)
+  assert backoff.next_delay() == 1
+  assert backoff.next_delay() == 2
+  assert backoff.next_delay() is None
+
+
+def test_reconnect_latency_is_measured_from_the_lost_connection():
+  clock = Clock()
+  supervisor = ConnectionSupervisor(Client(), Backoff(rand=upper_bound), clock=clock)
+  supervisor.begin_attempt()
+  supervisor.connected(0)
+  supervisor.connection_lost()
+  supervisor.connection_lost()
+  assert supervisor.next_delay() == 1
+  supervisor.begin_attempt()
+  supervisor.connection_lost()
+  assert supervisor.next_delay() == 2
+  clock.now += 3
+  supervisor.begin_attempt()
+  supervisor.connected(0, session_present=True)
+  stats = supervisor.stats()
+  assert stats['state'] == ConnectionSupervisor.CONNECTED
+  assert stats['disconnects'] == 1
+  assert stats['failed_attempts'] == 1
+  assert stats['session_resumes'] == 1
+  assert stats['last_reconnect_latency'] == 3
+  assert stats['backoff_attempts'] == 0
+
+
+def test_missing_connack_counts_as_a_failed_attempt():
+  clock = Clock()
+  supervisor = ConnectionSupervisor(Client(), Backoff(), connect_timeout=30, clock=clock)
+  supervisor.begin_attempt()
+  clock.now += 30
+  supervisor.check_timeout()
+  assert supervisor.state == ConnectionSupervisor.CONNECTING
+  clock.now += 1
+  supervisor.check_timeout()
+  assert supervisor.state == ConnectionSupervisor.BACKOFF
+
+
+def test_refused_connack_is_retried():
+  supervisor = ConnectionSupervisor(Client(), Backoff())
+  supervisor.begin_attempt()
+  supervisor.connected(5)
+  assert supervisor.state == ConnectionSupervisor.BACKOFF
+
+
+def test_supervisor_reconnects_until_the_broker_accepts():
+  client = Client(failures=3)
+  supervisor = client.supervisor = ConnectionSupervisor(client, Backoff(base=0.001, cap=0.01))
+  supervisor.start()
+  assert supervisor.wait_connected(5)
+  assert client.reconnects == 4
+  assert supervisor.stats()['failed_attempts'] == 3
+  supervisor.stop()
+  assert supervisor.state == ConnectionSupervisor.STOPPED
+  assert not supervisor.wait_connected(0)
+
+
+def test_supervisor_gives_up_after_the_attempt_budget():
+  given_up = threading.Event()
+  client = Client(failures=100)
+  supervisor = client.supervisor = ConnectionSupervisor(
+    client, Backoff(base=0.001, cap=0.01, max_attempts=2), on_give_up=given_up.set)
+  supervisor.start()
+  assert given_up.wait(5)
+  assert not supervisor.wait_connected(5)
+  assert supervisor.state == ConnectionSupervisor.FAILED
+  assert client.reconnects == 3
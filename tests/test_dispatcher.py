@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+
+from c8ydm.framework.dispatcher import WorkerPool
+
+
+def blocked_pool(overflow, queue_size=2):
+  """
+  Returns a pool with one worker blocked until the returned event is set.
+  """
+  pool = WorkerPool('Test', workers=1, queue_size=queue_size, overflow=overflow)
+  release = threading.Event()
+  running = threading.Event()
+
+  def block():
+    running.set()
+    release.wait(5)
+
+  pool.submit(block)
+  assert running.wait(5)
+  return pool, release
+
+
+def test_unknown_overflow_policy():
+  with pytest.raises(ValueError):
+    WorkerPool('Test', overflow='wait')
+
+
+def test_runs_tasks_in_order_on_lazily_spawned_workers():
+  pool = WorkerPool('Test', workers=1)
+  assert pool.stats()['workers'] == 0
+  done = []
+  for i in range(5):
+    pool.submit(done.append, i)
+  assert pool.join(5)
+  assert done == [0, 1, 2, 3, 4]
+  assert pool.stats()['workers'] == 1
+
+
+def test_failing_task_does_not_stop_the_worker():
+  pool = WorkerPool('Test', workers=1)
+  done = []
+  pool.submit(lambda: 1 / 0)
+  pool.submit(done.append, 1)
+  assert pool.join(5)
+  assert done == [1]
+  assert pool.stats()['failed'] == 1
+
+
+def test_drop_newest_rejects_without_blocking():
+  pool, release = blocked_pool('drop-newest')
+  done = []
+  assert pool.submit(done.append, 1)
+  assert pool.submit(done.append, 2)
+  assert not pool.submit(done.append, 3)
+  release.set()
+  assert pool.join(5)
+  assert done == [1, 2]
+  assert pool.stats()['dropped'] == 1
+
+
+def test_drop_oldest_discards_the_oldest_queued_task():
+  pool, release = blocked_pool('drop-oldest')
+  done = []
+  for i in range(3):
+    assert pool.submit(done.append, i)
+  release.set()
+  assert pool.join(5)
+  assert done == [1, 2]
+
+
+def test_caller_runs_executes_in_the_submitting_thread():
+  pool, release = blocked_pool('caller-runs', queue_size=1)
+  threads = []
+  pool.submit(lambda: threads.append('queued'))
+  pool.submit(lambda: threads.append(threading.current_thread()))
+  assert threads == [threading.current_thread()]
+  release.set()
+  assert pool.join(5)
+
+
+def test_block_waits_for_a_free_slot():
+  pool, release = blocked_pool('block', queue_size=1)
+  done = []
+  pool.submit(done.append, 1)
+  submitted = threading.Event()
+
+  def submit():
+    pool.submit(done.append, 2)
+    submitted.set()
+
+  threading.Thread(target=submit, daemon=True).start()
+  assert not submitted.wait(0.1)
+  release.set()
+  assert submitted.wait(5)
+  assert pool.join(5)
+  assert done == [1, 2]
+
+
+def test_shutdown_runs_queued_tasks_and_rejects_new_ones():
+  pool, release = blocked_pool('drop-newest')
+  done = []
+  pool.submit(done.append, 1)
+  pool.shutdown(wait=False)
+  assert not pool.submit(done.append, 2)
+  release.set()
+  pool.shutdown(timeout=5)
+  assert done == [1]
@@ -0,0 +1,78 @@
+import threading
+
+from c8ydm.client.inflight import InflightTracker, PublishFuture
+
+
+def test_acknowledge_resolves_tracked_futures():
+  tracker = InflightTracker()
+  future = PublishFuture('s/us', 1)
+  with tracker.publishing():
+    tracker.track(1, [future])
+  assert not future.done()
+  tracker.acknowledge(1)
+  assert future.published
+  assert future.wait(0)
+  assert tracker.stats()['published'] == 1
+
+
+def test_early_ack_during_publish_is_matched():
+  tracker = InflightTracker()
+  future = PublishFuture('s/us', 0)
+  with tracker.publishing():
+    # on_publish fires before publish() returned the message id
+    tracker.acknowledge(7)
+    tracker.track(7, [future])
+  assert future.published
+
+
+def test_acks_of_untracked_messages_are_dropped():
+  tracker = InflightTracker()
+  # e.g. outbox replay, which does not track its message ids
+  tracker.acknowledge(3)
+  with tracker.publishing():
+    tracker.acknowledge(4)
+  future = PublishFuture('s/us', 1)
+  with tracker.publishing():
+    tracker.track(3, [future])
+  assert not future.done()
+  with tracker.publishing():
+    tracker.track(4, [PublishFuture('s/us', 1)])
+  assert tracker.stats()['in_flight'] == 2
+
+
+def test_connection_lost_fails_qos0_only():
+  tracker = InflightTracker()
+  qos0 = PublishFuture('s/us', 0)
+  qos1 = PublishFuture('s/us', 1)
+  with tracker.publishing():
+    tracker.track(1, [qos0])
+    tracker.track(2, [qos1])
+  tracker.connection_lost()
+  assert qos0.state == PublishFuture.FAILED
+  assert qos0.error == 'connection lost'
+  assert not qos1.done()
+  tracker.acknowledge(2)
+  assert qos1.published
+
+
+def test_fail_runs_callbacks():
+  tracker = InflightTracker()
+  future = PublishFuture('s/us', 1)
+  states = []
+  future.add_done_callback(lambda future: states.append(future.state))
+  tracker.fail([future], 'outbox rejected message')
+  assert states == [PublishFuture.FAILED]
+  assert future.error == 'outbox rejected message'
+  # A resolved future does not change anymore
+  future.resolve(PublishFuture.QUEUED)
+  assert future.state == PublishFuture.FAILED
+  assert tracker.stats()['failed'] == 1
+
+
+def test_drain_waits_for_acknowledgements():
+  tracker = InflightTracker()
+  with tracker.publishing():
+    tracker.track(1, [PublishFuture('s/us', 1)])
+  assert not tracker.drain(0.01)
+  threading.Timer(0.05, tracker.acknowledge, (1,)).start()
+  assert tracker.drain(5)
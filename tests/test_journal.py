@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from c8ydm.framework.journal import DONE, EXECUTING, FAILED, SUCCESSFUL, OperationJournal
+from c8ydm.framework.smartrest import SmartRESTMessage
+
+
+@pytest.fixture
+def path(tmp_path):
+  return os.path.join(str(tmp_path), 'operations.db')
+
+
+def record(journal, fragment, state=EXECUTING, step=None):
+  entry_id = journal.record(fragment, 'Listener', SmartRESTMessage('s/ds', '511', ['device', fragment]))
+  journal.transition(entry_id, state)
+  if step is not None:
+    journal.checkpoint(entry_id, step)
+  return entry_id
+
+
+def operation(operation_id, fragment):
+  return {'id': str(operation_id), 'creationTime': f'2026-01-01T00:00:0{operation_id}', fragment: {}}
+
+
+def reconcile(path, executing, idempotent=()):
+  journal = OperationJournal(path)
+  return [(action, operation and operation['id'], entry and entry.fragment)
+          for action, operation, entry in journal.reconcile(executing, idempotent)]
+
+
+def test_failed_state_wins_over_the_done_checkpoint(path):
+  journal = OperationJournal(path)
+  entry_id = record(journal, 'c8y_Restart', step=DONE)
+  journal.transition(entry_id, FAILED)
+  journal.close()
+  assert reconcile(path, [operation(1, 'c8y_Restart')]) == [('failed', '1', 'c8y_Restart')]
+
+
+def test_done_checkpoint_and_successful_state_are_successful(path):
+  journal = OperationJournal(path)
+  record(journal, 'c8y_Restart', step=DONE)
+  record(journal, 'c8y_Command', state=SUCCESSFUL)
+  journal.close()
+  assert reconcile(path, [operation(1, 'c8y_Restart'), operation(2, 'c8y_Command')]) == [
+    ('successful', '1', 'c8y_Restart'), ('successful', '2', 'c8y_Command')]
+
+
+def test_interrupted_operations_are_resumed_only_if_idempotent(path):
+  journal = OperationJournal(path)
+  record(journal, 'c8y_Command')
+  record(journal, 'c8y_Firmware')
+  journal.close()
+  assert reconcile(path, [operation(1, 'c8y_Command'), operation(2, 'c8y_Firmware')], {'c8y_Firmware'}) == [
+    ('failed', '1', 'c8y_Command'), ('resume', '2', 'c8y_Firmware')]
+
+
+def test_entries_are_matched_oldest_first_per_fragment(path):
+  journal = OperationJournal(path)
+  record(journal, 'c8y_Command', step=DONE)
+  record(journal, 'c8y_Command')
+  journal.close()
+  # The platform lists the newer operation first
+  assert reconcile(path, [operation(2, 'c8y_Command'), operation(1, 'c8y_Command')]) == [
+    ('successful', '1', 'c8y_Command'), ('failed', '2', 'c8y_Command')]
+
+
+def test_unknown_operations_fail_and_stale_entries_are_dropped(path):
+  journal = OperationJournal(path)
+  record(journal, 'c8y_Restart', step=DONE)
+  journal.close()
+  assert reconcile(path, [operation(1, 'c8y_Command')]) == [
+    ('failed', '1', None), ('drop', None, 'c8y_Restart')]
+
+
+def test_entries_of_this_run_are_not_reconciled(path):
+  journal = OperationJournal(path)
+  record(journal, 'c8y_Command', step=DONE)
+  assert journal.reconcile([operation(1, 'c8y_Command')], ()) == [('failed', operation(1, 'c8y_Command'), None)]
+  assert len(journal) == 1
@@ -0,0 +1,112 @@
+import os
+import socket
+import urllib.error
+import urllib.request
+
+import pytest
+
+from c8ydm.client.metrics_server import MetricsServer
+from c8ydm.framework.metrics import Histogram, MetricsRegistry
+
+
+def test_histogram_counts_are_cumulative():
+  histogram = Histogram(buckets=(1, 5))
+  for value in (0.5, 1, 3, 10):
+    histogram.observe(value)
+  assert histogram.snapshot() == {'buckets': {1: 2, 5: 3, '+Inf': 4}, 'count': 4, 'sum': 14.5}
+
+
+def test_metrics_are_shared_by_name():
+  registry = MetricsRegistry()
+  registry.counter('messages', 'Published messages').inc(topic='s/us')
+  registry.counter('messages').inc(2, topic='s/us')
+  registry.gauge('queue_depth').set(3)
+  assert registry.render() == (
+    '# TYPE c8ydm_messages counter\n'
+    '# HELP c8ydm_messages Published messages\n'
+    'c8ydm_messages_total{topic="s/us"} 3\n'
+    '# TYPE c8ydm_queue_depth gauge\n'
+    'c8ydm_queue_depth 3\n'
+    '# EOF\n')
+
+
+def test_histogram_rendering():
+  registry = MetricsRegistry()
+  registry.histogram('duration_seconds', buckets=(0.1, 1)).observe(0.5, listener='Restart')
+  lines = registry.render().splitlines()
+  assert 'c8ydm_duration_seconds_bucket{listener="Restart",le="0.1"} 0' in lines
+  assert 'c8ydm_duration_seconds_bucket{listener="Restart",le="1"} 1' in lines
+  assert 'c8ydm_duration_seconds_bucket{listener="Restart",le="+Inf"} 1' in lines
+  assert 'c8ydm_duration_seconds_sum{listener="Restart"} 0.5' in lines
+
+
+def test_stats_are_exported_as_gauges():
+  registry = MetricsRegistry()
+  registry.register_stats('publisher', lambda: {
+    'payloads': 4, 'avg_wait': None, 'state': 'connected',
+    'lanes': {'control': {'pending': 1}, 'telemetry': {'pending': 7}},
+  }, labels={'device': 'd1'}, nested={'lanes': 'lane'})
+  registry.register_stats('jobs', lambda: {'Sensor': {'runs': 2}}, label='job')
+  registry.register_stats('broken', lambda: 1 / 0)
+  lines = registry.render().splitlines()
+  assert 'c8ydm_publisher_payloads{device="d1"} 4' in lines
+  assert 'c8ydm_publisher_state{device="d1",state="connected"} 1' in lines
+  assert 'c8ydm_publisher_lanes_pending{device="d1",lane="control"} 1' in lines
+  assert 'c8ydm_publisher_lanes_pending{device="d1",lane="telemetry"} 7' in lines
+  assert 'c8ydm_jobs_runs{job="Sensor"} 2' in lines
+  assert not any('avg_wait' in line or 'broken' in line for line in lines)
+
+
+def test_label_values_are_escaped():
+  registry = MetricsRegistry()
+  registry.counter('errors').inc(reason='say "hi"\n')
+  assert 'c8ydm_errors_total{reason="say \\"hi\\"\\n"} 1' in registry.render().splitlines()
+
+
+def free_port():
+  with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+
+@pytest.fixture
+def registry():
+  registry = MetricsRegistry()
+  registry.gauge('up').set(1)
+  return registry
+
+
+def test_server_serves_metrics_on_localhost(registry):
+  port = free_port()
+  server = MetricsServer(registry, port=port)
+  server.start()
+  try:
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=5) as response:
+      assert response.headers['Content-Type'].startswith('application/openmetrics-text')
+      assert 'c8ydm_up 1' in response.read().decode()
+    with pytest.raises(urllib.error.HTTPError):
+      urllib.request.urlopen(f'http://127.0.0.1:{port}/other', timeout=5)
+  finally:
+    server.stop()
+
+
+def test_server_serves_metrics_on_a_unix_socket(registry, tmp_path):
+  path = os.path.join(str(tmp_path), 'metrics.sock')
+  server = MetricsServer(registry, socket_path=path)
+  server.start()
+  try:
+    with socket.socket(socket.AF_UNIX) as client:
+      client.settimeout(5)
+      client.connect(path)
+      client.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+      response = b''
+      while True:
+        data = client.recv(4096)
+        if not data:
+          break
+        response += data
+    assert response.startswith(b'HTTP/1.0 200')
+    assert b'c8ydm_up 1' in response
+  finally:
+    server.stop()
+  assert not os.path.exists(path)
@@ -0,0 +1,134 @@
+import importlib
+import os
+import sys
+import textwrap
+
+import pytest
+
+from c8ydm.utils.moduleloader import LazyListener, ModuleManifest, loadAgentModules
+
+MODULES = {
+  'commands': '''
+    from c8ydm.framework.modulebase import Listener
+
+    class CommandListener(Listener):
+      fragment = 'c8y_Command'
+
+      def handleOperation(self, message):
+        self.agent.handled.append(message)
+
+      def getSupportedOperations(self):
+        return ['c8y_Command']
+
+      def getSupportedTemplates(self):
+        return []
+
+      def getHandledMessages(self):
+        return [('s/ds', '511')]
+  ''',
+  'sensors': '''
+    from c8ydm.framework.modulebase import Initializer, Sensor
+
+    class MemorySensor(Sensor, Initializer):
+      def getSensorMessages(self):
+        return []
+
+      def getMessages(self):
+        return []
+
+    class DiskSensor(Sensor):
+      def getSensorMessages(self):
+        return []
+  ''',
+}
+
+
+@pytest.fixture
+def package(tmp_path, monkeypatch):
+  """
+  Creates the agent module package testmodules.
+  """
+  root = tmp_path / 'testmodules'
+  root.mkdir()
+  (root / '__init__.py').write_text('')
+  for name, source in MODULES.items():
+    (root / f'{name}.py').write_text(textwrap.dedent(source))
+  monkeypatch.syspath_prepend(str(tmp_path))
+  yield importlib.import_module('testmodules')
+  unload()
+  del sys.modules['testmodules']
+
+
+class Agent:
+
+  def __init__(self):
+    self.handled = []
+
+
+def imported():
+  return sorted(name for name in sys.modules if name.startswith('testmodules.'))
+
+
+def unload():
+  for module in imported():
+    del sys.modules[module]
+
+
+def load(package, tmp_path, agent=None, **kwargs):
+  manifest = ModuleManifest(os.path.join(str(tmp_path), 'modules.json'), package)
+  modules = loadAgentModules('device', agent, manifest, **kwargs)
+  return {role: sorted(instance.__class__.__name__ for instance in instances)
+          for role, instances in modules.items()}, modules
+
+
+def test_classes_are_created_once_per_role(package, tmp_path):
+  names, modules = load(package, tmp_path)
+  assert names == {'sensors': ['DiskSensor', 'MemorySensor'], 'listeners': ['CommandListener'],
+                   'initializers': ['MemorySensor']}
+  memory = [sensor for sensor in modules['sensors'] if sensor.__class__.__name__ == 'MemorySensor']
+  assert memory == modules['initializers']
+
+
+def test_listener_modules_are_imported_on_first_use(package, tmp_path):
+  load(package, tmp_path)
+  unload()
+  agent = Agent()
+  names, modules = load(package, tmp_path, agent)
+  assert imported() == ['testmodules.sensors']
+  listener = modules['listeners'][0]
+  assert isinstance(listener, LazyListener)
+  assert listener.__class__.__name__ == 'CommandListener'
+  assert listener.getSupportedOperations() == ['c8y_Command']
+  assert listener.getHandledMessages() == [('s/ds', '511')]
+  assert listener.fragment == 'c8y_Command'
+  listener.handleOperation('511,device,ls')
+  assert imported() == ['testmodules.commands', 'testmodules.sensors']
+  assert agent.handled == ['511,device,ls']
+
+
+def test_without_lazy_loading_every_module_is_imported(package, tmp_path):
+  load(package, tmp_path)
+  unload()
+  load(package, tmp_path, lazy=False)
+  assert imported() == ['testmodules.commands', 'testmodules.sensors']
+
+
+def test_disabled_modules_are_not_imported(package, tmp_path):
+  names, _ = load(package, tmp_path, disabled={'commands', 'sensors.DiskSensor'})
+  assert imported() == ['testmodules.sensors']
+  assert names == {'sensors': ['MemorySensor'], 'listeners': [], 'initializers': ['MemorySensor']}
+
+
+def test_enable_list_selects_modules_and_classes(package, tmp_path):
+  names, _ = load(package, tmp_path, enabled={'sensors.DiskSensor'})
+  assert imported() == ['testmodules.sensors']
+  assert names == {'sensors': ['DiskSensor'], 'listeners': [], 'initializers': []}
+
+
+def test_changed_module_discards_the_manifest(package, tmp_path):
+  load(package, tmp_path)
+  path = os.path.join(str(tmp_path), 'modules.json')
+  assert ModuleManifest(path, package).get('testmodules.commands') is not None
+  with open(os.path.join(package.__path__[0], 'commands.py'), 'a') as file:
+    file.write('\n# changed\n')
+  assert ModuleManifest(path, package).get('testmodules.commands') is None
@@ -0,0 +1,66 @@
+from c8ydm.client.operation_poller import OperationPoller
+from c8ydm.framework.scheduler import Scheduler
+
+
+class Clock:
+
+  def __init__(self, now=1000.0):
+    self.now = now
+
+  def __call__(self):
+    return self.now
+
+
+class InlinePool:
+
+  def submit(self, fn, *args, name=None):
+    fn(*args)
+    return True
+
+
+def make_poller():
+  clock = Clock()
+  scheduler = Scheduler(InlinePool(), clock=clock)
+  polls = []
+  poller = OperationPoller(lambda: polls.append(clock()), min_interval=5, max_interval=40,
+                           clock=clock, scheduler=scheduler, name='device/OperationPoller')
+  return clock, scheduler, poller, polls
+
+
+def advance(clock, scheduler, seconds):
+  end = clock.now + seconds
+  while True:
+    job = scheduler._jobs.get('device/OperationPoller')
+    if job is None or job.deadline > end:
+      break
+    clock.now = job.deadline
+    scheduler._heap.clear()
+    scheduler._fire(job)
+  clock.now = end
+
+
+def test_scheduled_polls_back_off():
+  clock, scheduler, poller, polls = make_poller()
+  poller.start()
+  assert poller._thread is None
+  advance(clock, scheduler, 200)
+  assert [poll - 1000 for poll in polls] == [5, 15, 35, 75, 115, 155, 195]
+
+
+def test_reset_polls_again_within_the_minimum_interval():
+  clock, scheduler, poller, polls = make_poller()
+  poller.start()
+  advance(clock, scheduler, 80)
+  del polls[:]
+  poller.reset()
+  advance(clock, scheduler, 5)
+  assert [poll - 1080 for poll in polls] == [5]
+
+
+def test_stop_removes_the_job():
+  clock, scheduler, poller, polls = make_poller()
+  poller.start()
+  poller.stop()
+  assert scheduler.stats() == {}
+  advance(clock, scheduler, 100)
+  assert polls == []
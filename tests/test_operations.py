@@ -0,0 +1,156 @@
+import threading
+import time
+
+from c8ydm.framework.operations import DeduplicationCache, OperationExecutor, OperationPolicy
+from c8ydm.framework.smartrest import SmartRESTMessage
+
+
+class Clock:
+
+  def __init__(self, now=1000.0):
+    self.now = now
+
+  def __call__(self):
+    return self.now
+
+
+class Listener:
+
+  def __init__(self):
+    self.started = []
+    self.release = {}
+    self.lock = threading.Lock()
+
+  def getSupportedOperations(self):
+    return ['c8y_SoftwareUpdate', 'c8y_Command']
+
+  def getMessageIds(self):
+    return ['528', '511']
+
+  def handleOperation(self, message):
+    with self.lock:
+      self.started.append(message.values[1])
+      release = self.release.setdefault(message.values[1], threading.Event())
+    release.wait(5)
+
+  def finish(self, name):
+    with self.lock:
+      self.release.setdefault(name, threading.Event()).set()
+
+
+def make_executor(policies, max_concurrent=4):
+  failed = []
+  executor = None
+
+  def run(operation):
+    threading.Thread(target=executor.execute, args=(operation,), daemon=True).start()
+
+  def report_failed(operation, reason):
+    failed.append((operation.message.values[1], reason))
+
+  executor = OperationExecutor(run, report_failed, policies=policies, max_concurrent=max_concurrent)
+  return executor, failed
+
+
+def wait_for(predicate, timeout=5):
+  deadline = time.monotonic() + timeout
+  while not predicate():
+    if time.monotonic() > deadline:
+      return False
+    time.sleep(0.01)
+  return True
+
+
+def update(name):
+  return SmartRESTMessage('s/ds', '528', ['device', name])
+
+
+def command(name):
+  return SmartRESTMessage('s/ds', '511', ['device', name])
+
+
+def test_serial_group_runs_one_after_the_other():
+  executor, failed = make_executor({'c8y_SoftwareUpdate': OperationPolicy('packages', None)})
+  listener = Listener()
+  executor.submit(listener, update('pkgA'))
+  executor.submit(listener, update('pkgB'))
+  executor.submit(listener, command('uptime'))
+  # The command is not in the group and overtakes pkgB
+  assert wait_for(lambda: listener.started == ['pkgA', 'uptime'])
+  listener.finish('uptime')
+  time.sleep(0.1)
+  assert listener.started == ['pkgA', 'uptime']
+  listener.finish('pkgA')
+  assert wait_for(lambda: listener.started == ['pkgA', 'uptime', 'pkgB'])
+  listener.finish('pkgB')
+  assert executor.drain(5) == []
+
+
+def test_concurrency_limit():
+  executor, failed = make_executor({}, max_concurrent=1)
+  listener = Listener()
+  executor.submit(listener, command('a'))
+  executor.submit(listener, command('b'))
+  assert wait_for(lambda: listener.started == ['a'])
+  assert executor.stats()['queued'] == 1
+  listener.finish('a')
+  assert wait_for(lambda: listener.started == ['a', 'b'])
+  listener.finish('b')
+  assert executor.drain(5) == []
+
+
+def test_timed_out_operation_keeps_its_serial_group():
+  executor, failed = make_executor({'c8y_SoftwareUpdate': OperationPolicy('packages', 0.1)})
+  listener = Listener()
+  first = executor.submit(listener, update('pkgA'))
+  executor.submit(listener, update('pkgB'))
+  assert wait_for(lambda: failed)
+  assert failed[0][0] == 'pkgA'
+  assert first.timed_out
+  time.sleep(0.2)
+  assert listener.started == ['pkgA']
+  listener.finish('pkgA')
+  assert wait_for(lambda: listener.started == ['pkgA', 'pkgB'])
+  listener.finish('pkgB')
+  assert executor.drain(5) == []
+  assert executor.stats()['fragments']['c8y_SoftwareUpdate']['timed_out'] == 1
+
+
+def test_operation_still_queued_is_not_submitted_again():
+  executor, failed = make_executor({'c8y_SoftwareUpdate': OperationPolicy('packages', None)})
+  listener = Listener()
+  executor.submit(listener, update('pkgA'))
+  assert executor.submit(listener, update('pkgB')) is not None
+  assert executor.submit(listener, update('pkgB')) is None
+  listener.finish('pkgA')
+  listener.finish('pkgB')
+  assert executor.drain(5) == []
+  assert listener.started == ['pkgA', 'pkgB']
+  assert executor.stats()['duplicates'] == 1
+
+
+def test_redelivered_operation_is_a_duplicate_within_the_ttl():
+  clock = Clock()
+  cache = DeduplicationCache(ttl=60, clock=clock)
+  assert not cache.seen(command('uptime'))
+  clock.now += 30
+  assert cache.seen(command('uptime'))
+  assert not cache.seen(command('ls'))
+  # A duplicate does not extend the lifetime of the entry
+  clock.now += 31
+  assert not cache.seen(command('uptime'))
+  assert cache.stats() == {'entries': 2, 'duplicates': 1}
+
+
+def test_deduplication_cache_keeps_the_newest_entries():
+  cache = DeduplicationCache(ttl=60, max_entries=2, clock=Clock())
+  for name in ('a', 'b', 'c'):
+    cache.seen(command(name))
+  assert not cache.seen(command('a'))
+  assert cache.seen(command('c'))
+
+
+def test_ttl_of_zero_disables_deduplication():
+  cache = DeduplicationCache(ttl=0, clock=Clock())
+  assert not cache.seen(command('uptime'))
+  assert not cache.seen(command('uptime'))
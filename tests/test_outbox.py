@@ -0,0 +1,151 @@
+import os
+import time
+
+import pytest
+
+from c8ydm.client.outbox import Outbox, OutboxReplayer
+
+
+class Clock:
+
+  def __init__(self, now=1000.0):
+    self.now = now
+
+  def __call__(self):
+    return self.now
+
+
+@pytest.fixture
+def path(tmp_path):
+  return os.path.join(str(tmp_path), 'outbox.db')
+
+
+def payloads(outbox):
+  return [payload for _, _, payload, _ in outbox.peek(100)]
+
+
+def wait_for(predicate, timeout=5):
+  deadline = time.monotonic() + timeout
+  while not predicate():
+    if time.monotonic() > deadline:
+      return False
+    time.sleep(0.01)
+  return True
+
+
+def test_messages_survive_a_restart_in_order(path):
+  outbox = Outbox(path)
+  for i in range(3):
+    assert outbox.put('s/us', f'200,c8y_Temperature,T,{i},C', 1)
+  outbox.close()
+  outbox = Outbox(path)
+  assert len(outbox) == 3
+  assert payloads(outbox) == ['200,c8y_Temperature,T,0,C', '200,c8y_Temperature,T,1,C',
+                              '200,c8y_Temperature,T,2,C']
+  assert outbox.peek(1)[0][3] == 1
+
+
+def test_drop_oldest_when_full(path):
+  outbox = Outbox(path, max_messages=2)
+  for i in range(3):
+    assert outbox.put('s/us', f'400,c8y_Event,{i}')
+  assert payloads(outbox) == ['400,c8y_Event,1', '400,c8y_Event,2']
+  assert outbox.stats()['evicted'] == 1
+
+
+def test_drop_newest_rejects_the_message(path):
+  outbox = Outbox(path, max_messages=2, overflow='drop-newest')
+  assert outbox.put('s/us', '400,c8y_Event,0')
+  assert outbox.put('s/us', '400,c8y_Event,1')
+  assert not outbox.put('s/us', '400,c8y_Event,2')
+  assert payloads(outbox) == ['400,c8y_Event,0', '400,c8y_Event,1']
+
+
+def test_message_larger_than_the_outbox_is_rejected(path):
+  outbox = Outbox(path, max_bytes=20)
+  assert not outbox.put('s/us', 'x' * 100)
+  assert len(outbox) == 0
+
+
+def test_write_error_rejects_the_message(path):
+  outbox = Outbox(path)
+  outbox._db.close()
+  assert not outbox.put('s/us', '400,c8y_Event,0')
+  assert outbox.stats()['errors'] == 1
+
+
+def test_expired_messages_are_dropped(path):
+  clock = Clock()
+  outbox = Outbox(path, max_age=60, clock=clock)
+  outbox.put('s/us', '400,c8y_Event,old')
+  clock.now += 30
+  outbox.put('s/us', '400,c8y_Event,new')
+  clock.now += 31
+  assert payloads(outbox) == ['400,c8y_Event,new']
+  assert outbox.stats()['expired'] == 1
+
+
+def test_priority_messages_skip_the_backlog_unless_one_is_stored(path):
+  outbox = Outbox(path, priority=lambda topic, payload: payload.startswith('5'))
+  assert not outbox.holds_back('s/us', '200,c8y_Temperature,T,1,C')
+  outbox.put('s/us', '200,c8y_Temperature,T,1,C')
+  assert outbox.holds_back('s/us', '200,c8y_Temperature,T,2,C')
+  assert not outbox.holds_back('s/us', '503,c8y_Command')
+  outbox.put('s/us', '501,c8y_Command')
+  assert outbox.holds_back('s/us', '503,c8y_Command')
+  outbox.close()
+  outbox = Outbox(path, priority=lambda topic, payload: payload.startswith('5'))
+  assert outbox.stats()['priority_depth'] == 1
+  for message_id, _, _, _ in outbox.peek():
+    outbox.remove(message_id)
+  assert outbox.stats()['priority_depth'] == 0
+  assert not outbox.holds_back('s/us', '200,c8y_Temperature,T,3,C')
+
+
+def test_replay_removes_messages_once_published(path):
+  outbox = Outbox(path)
+  for i in range(3):
+    outbox.put('s/us', f'400,c8y_Event,{i}')
+  published = []
+  replayer = OutboxReplayer(outbox, lambda topic, payload, qos: published.append(payload) or True,
+                            lambda: True, rate=1000)
+  replayer.start()
+  replayer.wake()
+  assert wait_for(lambda: len(outbox) == 0)
+  replayer.stop(1)
+  assert published == ['400,c8y_Event,0', '400,c8y_Event,1', '400,c8y_Event,2']
+  assert outbox.stats()['replayed'] == 3
+
+
+def test_replay_keeps_messages_the_broker_did_not_accept(path):
+  outbox = Outbox(path)
+  for i in range(3):
+    outbox.put('s/us', f'400,c8y_Event,{i}')
+  attempts = []
+
+  def publish(topic, payload, qos):
+    attempts.append(payload)
+    return len(attempts) == 1
+
+  replayer = OutboxReplayer(outbox, publish, lambda: True, rate=1000)
+  replayer._drain()
+  assert attempts == ['400,c8y_Event,0', '400,c8y_Event,1']
+  assert payloads(outbox) == ['400,c8y_Event,1', '400,c8y_Event,2']
+
+
+def test_idle_replayer_holds_no_thread(path):
+  outbox = Outbox(path)
+  connected = [False]
+  published = []
+  replayer = OutboxReplayer(outbox, lambda topic, payload, qos: published.append(payload) or True,
+                            lambda: connected[0], rate=1000)
+  replayer.start()
+  assert replayer._thread is None
+  outbox.put('s/us', '400,c8y_Event,0')
+  replayer.wake()
+  # Offline nothing is replayed
+  assert replayer._thread is None
+  connected[0] = True
+  replayer.wake()
+  assert wait_for(lambda: replayer._thread is None)
+  assert published == ['400,c8y_Event,0']
@@ -0,0 +1,68 @@
+import pathlib
+import shutil
+
+import pytest
+
+from c8ydm.client.mqtt_agent import Agent
+from c8ydm.utils.configutils import Configuration
+
+CONFIG = pathlib.Path(__file__).parent.parent / 'config' / 'agent.ini'
+
+
+class Client:
+
+  def __init__(self):
+    self.subscriptions = []
+
+  def subscribe(self, topic, qos=0):
+    self.subscriptions.append((topic, qos))
+
+
+class Message:
+
+  def __init__(self, topic, payload):
+    self.topic = topic
+    self.payload = payload.encode('utf-8')
+
+
+def make_agent(tmp_path, clean_session):
+  shutil.copy(str(CONFIG), str(tmp_path / 'agent.ini'))
+  configuration = Configuration(str(tmp_path))
+  configuration.setValue('mqtt', 'clean.session', str(clean_session).lower())
+  agent = Agent('device', tmp_path, configuration, str(tmp_path / 'agent.pid'), False)
+  client = agent._Agent__client = Client()
+  return agent, client
+
+
+def connect(agent, client, session_present, initialized=True):
+  agent._Agent__initialized = initialized
+  agent._Agent__on_connect(client, None, {'session present': int(session_present)}, 0)
+
+
+@pytest.mark.parametrize('session_present', [False, True])
+def test_clean_session_subscribes_after_every_connect(tmp_path, session_present):
+  agent, client = make_agent(tmp_path, clean_session=True)
+  connect(agent, client, session_present)
+  assert ('s/ds', 0) in client.subscriptions
+  assert agent.supervisor.stats()['session_resumes'] == 0
+
+
+def test_resumed_session_keeps_its_subscriptions(tmp_path):
+  agent, client = make_agent(tmp_path, clean_session=False)
+  connect(agent, client, session_present=True)
+  assert client.subscriptions == []
+  assert agent.supervisor.stats()['session_resumes'] == 1
+
+
+def test_new_persistent_session_subscribes_with_qos_1(tmp_path):
+  agent, client = make_agent(tmp_path, clean_session=False)
+  connect(agent, client, session_present=False)
+  assert ('s/ds', 1) in client.subscriptions
+
+
+def test_operations_before_initialization_are_buffered(tmp_path):
+  agent, client = make_agent(tmp_path, clean_session=False)
+  connect(agent, client, session_present=True, initialized=False)
+  agent._Agent__on_message(client, None, Message('s/ds', '511,device,ls\n511,device,ps'))
+  assert [message.values for message in agent._Agent__pending_messages] == [['device', 'ls'], ['device', 'ps']]
+  assert agent.operations.stats()['queued'] == 0
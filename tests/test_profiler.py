@@ -0,0 +1,122 @@
+import threading
+
+import pytest
+
+from c8ydm.agentmodules.command_handler import CommandHandler
+from c8ydm.core import profiler
+from c8ydm.framework.smartrest import SmartRESTMessage
+
+_retained = []
+
+
+def busy_worker(stop):
+  while not stop.is_set():
+    sum(i * i for i in range(1000))
+
+
+def allocate_while_captured(started):
+  started.wait(5)
+  _retained.append([bytearray(1024) for _ in range(512)])
+
+
+def test_cpu_profile_shows_the_busy_thread():
+  stop = threading.Event()
+  thread = threading.Thread(target=busy_worker, args=(stop,), name='BusyThread', daemon=True)
+  thread.start()
+  try:
+    report = profiler.capture('cpu', 0.3)
+  finally:
+    stop.set()
+    thread.join(5)
+  assert report.startswith('# CPU profile over 0.3 seconds')
+  collapsed = report.split('# Collapsed stacks')[1]
+  assert 'BusyThread;' in collapsed
+  assert 'busy_worker (test_profiler.py:' in collapsed
+
+
+def test_memory_profile_shows_allocations_still_alive():
+  started = threading.Event()
+  thread = threading.Thread(target=allocate_while_captured, args=(started,), daemon=True)
+  thread.start()
+  timer = threading.Timer(0.1, started.set)
+  timer.start()
+  try:
+    report = profiler.capture('memory', 0.3)
+  finally:
+    thread.join(5)
+    del _retained[:]
+  assert report.startswith('# Memory profile over 0.3 seconds')
+  assert 'test_profiler.py' in report
+  assert '[bytearray(1024) for _ in range(512)]' in report
+
+
+def test_unknown_profile_kind():
+  with pytest.raises(ValueError):
+    profiler.capture('disk', 1)
+
+
+def test_only_one_capture_at_a_time():
+  with profiler._lock:
+    with pytest.raises(RuntimeError):
+      profiler.capture('cpu', 0.1)
+
+
+class Configuration:
+
+  def getIntValue(self, category, key, default=None):
+    return default
+
+
+class RestClient:
+
+  def __init__(self, url):
+    self.url = url
+    self.uploads = []
+
+  def get_internal_id(self, serial):
+    return '4711'
+
+  def upload_event_logfile(self, mo_id, files):
+    self.uploads.append((mo_id, files['file'][0], files['file'][1].read().decode()))
+    return self.url
+
+
+class Agent:
+
+  def __init__(self, url='https://tenant/event/events/1/binaries'):
+    self.serial = 'device'
+    self.configuration = Configuration()
+    self.rest_client = RestClient(url)
+    self.messages = []
+
+  def publishMessage(self, message):
+    self.messages.append(message.getMessage())
+
+
+def handle(agent, command):
+  CommandHandler('device', agent).handleOperation(SmartRESTMessage('s/ds', '511', ['device', command]))
+
+
+def test_profile_command_uploads_the_report(monkeypatch):
+  monkeypatch.setattr(profiler, 'capture', lambda kind, duration: f'{kind} {duration}')
+  agent = Agent()
+  handle(agent, 'profile memory 5')
+  mo_id, name, report = agent.rest_client.uploads[0]
+  assert mo_id == '4711'
+  assert name.startswith('memory-profile_device_')
+  assert report == 'memory 5'
+  assert agent.messages == ['501,c8y_Command', '503,c8y_Command,https://tenant/event/events/1/binaries']
+
+
+@pytest.mark.parametrize('command', ['profile cpu 0', 'profile cpu 111'])
+def test_profile_duration_is_limited(command):
+  agent = Agent()
+  handle(agent, command)
+  assert agent.messages == ['501,c8y_Command', '502,c8y_Command,Profile duration must be between 1 and 110 seconds']
+
+
+def test_failed_upload_fails_the_operation(monkeypatch):
+  monkeypatch.setattr(profiler, 'capture', lambda kind, duration: 'report')
+  agent = Agent(url=None)
+  handle(agent, 'profile cpu 1')
+  assert agent.messages[-1] == '502,c8y_Command,Could not upload cpu profile'
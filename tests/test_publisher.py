@@ -0,0 +1,148 @@
+import threading
+
+from c8ydm.client.inflight import PublishFuture
+from c8ydm.client.publisher import CoalescingPublisher
+
+
+class Link:
+  """
+  Records the payloads handed to the transport and resolves their futures.
+  """
+
+  def __init__(self):
+    self.sent = []
+    self.event = threading.Event()
+
+  def __call__(self, topic, payload, qos, futures):
+    self.sent.append((topic, payload, qos))
+    for future in futures:
+      future.resolve(PublishFuture.PUBLISHED)
+    self.event.set()
+
+
+def test_lines_within_the_window_share_one_payload():
+  link = Link()
+  publisher = CoalescingPublisher(link, window=0.1)
+  publisher.start()
+  futures = [publisher.publish('s/us', f'200,c8y_Temperature,T,{i},C') for i in range(3)]
+  assert all(future.wait(5) for future in futures)
+  publisher.stop()
+  assert link.sent == [('s/us', '200,c8y_Temperature,T,0,C\n200,c8y_Temperature,T,1,C\n200,c8y_Temperature,T,2,C', 0)]
+  assert publisher.stats()['max_lines'] == 3
+
+
+def test_topics_and_qos_are_batched_separately():
+  link = Link()
+  publisher = CoalescingPublisher(link, window=0.1)
+  publisher.start()
+  publisher.publish('s/us', '400,c8y_Event,a')
+  publisher.publish('s/us', '400,c8y_Event,b', 1)
+  publisher.publish('s/uc/template', '400,c8y_Event,c')
+  publisher.stop()
+  assert sorted(link.sent) == [('s/uc/template', '400,c8y_Event,c', 0), ('s/us', '400,c8y_Event,a', 0),
+                               ('s/us', '400,c8y_Event,b', 1)]
+
+
+def test_batch_is_split_at_the_payload_limit():
+  link = Link()
+  publisher = CoalescingPublisher(link, window=0.1, max_payload=45)
+  publisher.start()
+  for i in range(3):
+    publisher.publish('s/us', f'400,c8y_Event,line{i}')
+  publisher.stop()
+  assert [payload for _, payload, _ in link.sent] == ['400,c8y_Event,line0\n400,c8y_Event,line1',
+                                                      '400,c8y_Event,line2']
+
+
+def test_other_topics_are_sent_immediately():
+  link = Link()
+  publisher = CoalescingPublisher(link, window=10)
+  publisher.start()
+  future = publisher.publish('s/ut/template', '10,value')
+  assert future.wait(1)
+  assert link.sent == [('s/ut/template', '10,value', 0)]
+  publisher.stop()
+
+
+def test_stop_sends_pending_lines():
+  link = Link()
+  publisher = CoalescingPublisher(link, window=10)
+  publisher.start()
+  future = publisher.publish('s/us', '400,c8y_Event,a')
+  publisher.stop()
+  assert future.wait(1)
+  assert link.sent == [('s/us', '400,c8y_Event,a', 0)]
+
+
+def test_failing_send_fails_the_futures_of_the_batch():
+  def send(topic, payload, qos, futures):
+    raise OSError('socket closed')
+
+  publisher = CoalescingPublisher(send, window=0.05)
+  publisher.start()
+  futures = [publisher.publish('s/us', f'400,c8y_Event,{i}') for i in range(2)]
+  for future in futures:
+    assert not future.wait(5)
+    assert future.state == PublishFuture.FAILED
+  publisher.stop()
+
+
+def gated_publisher(link, lanes=None):
+  """
+  Returns a started publisher that holds every line back until the returned event is set.
+  """
+  gate = threading.Event()
+  options = {} if lanes is None else {'lanes': lanes}
+  # Lines of 7 bytes never share a payload of 10 bytes, every line is a batch of its own
+  publisher = CoalescingPublisher(link, window=0, max_payload=10, can_send=gate.is_set, **options)
+  publisher.start()
+  return publisher, gate
+
+
+def test_lanes_are_drained_by_weight():
+  link = Link()
+  publisher, gate = gated_publisher(link)
+  for i in range(3):
+    publisher.publish('s/us', f'200,T,{i}')
+  for i in range(10):
+    publisher.publish('s/us', f'503,c{i}')
+  gate.set()
+  publisher.stop()
+  lanes = ['t' if payload.startswith('2') else 'c' for _, payload, _ in link.sent]
+  assert ''.join(lanes) == 'cccccccctcctt'
+  assert publisher.stats()['lanes']['control']['payloads'] == 10
+
+
+def test_lines_of_a_lane_keep_their_order():
+  link = Link()
+  publisher, gate = gated_publisher(link)
+  for i in range(5):
+    publisher.publish('s/us', f'501,c{i}')
+    publisher.publish('s/us', f'200,T,{i}')
+  gate.set()
+  publisher.stop()
+  sent = [payload for _, payload, _ in link.sent]
+  assert [payload for payload in sent if payload.startswith('5')] == [f'501,c{i}' for i in range(5)]
+  assert [payload for payload in sent if payload.startswith('2')] == [f'200,T,{i}' for i in range(5)]
+
+
+def test_control_line_skips_the_telemetry_backlog():
+  link = Link()
+  publisher, gate = gated_publisher(link)
+  for i in range(20):
+    publisher.publish('s/us', f'200,T,{i}')
+  update = publisher.publish('s/us', '503,c8y')
+  gate.set()
+  assert update.wait(5)
+  publisher.stop()
+  assert link.sent[0][1] == '503,c8y'
+
+
+def test_single_lane_keeps_the_publish_order():
+  link = Link()
+  publisher, gate = gated_publisher(link, lanes=(('default', 1),))
+  publisher.publish('s/us', '200,T,0')
+  publisher.publish('s/us', '503,c8y')
+  gate.set()
+  publisher.stop()
+  assert [payload for _, payload, _ in link.sent] == ['200,T,0', '503,c8y']
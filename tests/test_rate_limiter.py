@@ -0,0 +1,63 @@
+import pytest
+
+from c8ydm.client.rate_limiter import RateLimiter, TokenBucket
+
+
+class Clock:
+
+  def __init__(self, now=1000.0):
+    self.now = now
+    self.slept = []
+
+  def __call__(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.slept.append(seconds)
+    self.now += seconds
+
+
+def test_bucket_allows_the_burst_and_refills_with_the_rate():
+  clock = Clock()
+  bucket = TokenBucket(10, 5, clock)
+  assert [bucket.reserve() for _ in range(5)] == [0.0] * 5
+  assert bucket.reserve() == pytest.approx(0.1)
+  clock.now += 0.1
+  assert bucket.reserve() == pytest.approx(0.1)
+  clock.now += 10
+  assert bucket.reserve() == 0.0
+  assert bucket.tokens == 4
+
+
+def test_request_larger_than_the_burst_waits_longer():
+  bucket = TokenBucket(100, 100, Clock())
+  assert bucket.reserve(300) == pytest.approx(2.0)
+
+
+def test_disabled_limiter_never_waits():
+  clock = Clock()
+  limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+  assert not limiter.enabled
+  assert limiter.acquire(10 ** 6) == 0.0
+  assert clock.slept == []
+
+
+def test_sustained_traffic_is_spread_to_the_message_rate():
+  clock = Clock()
+  limiter = RateLimiter(messages_per_second=10, clock=clock, sleep=clock.sleep)
+  start = clock.now
+  for _ in range(30):
+    limiter.acquire(50)
+  # One second of burst, the remaining 20 messages need two more seconds
+  assert clock.now - start == pytest.approx(2.0)
+  stats = limiter.stats()
+  assert stats['passed'] == 30
+  assert stats['shaped'] == 20
+  assert stats['max_delay'] == pytest.approx(0.1)
+
+
+def test_the_slower_of_both_limits_applies():
+  clock = Clock()
+  limiter = RateLimiter(messages_per_second=100, bytes_per_second=1000, clock=clock, sleep=clock.sleep)
+  assert limiter.acquire(1000) == 0.0
+  assert limiter.acquire(500) == pytest.approx(0.5)
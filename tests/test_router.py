@@ -0,0 +1,44 @@
+from c8ydm.framework.router import MessageRouter
+from c8ydm.framework.smartrest import SmartRESTMessage
+
+
+def make_listener(name, handled):
+  return type(name, (), {'getHandledMessages': lambda self: handled})()
+
+
+def names(listeners):
+  return [listener.__class__.__name__ for listener in listeners]
+
+
+def test_message_goes_only_to_listeners_declaring_it():
+  router = MessageRouter([
+    make_listener('Restart', [('s/ds', '510')]),
+    make_listener('Command', [('s/ds', 511)]),
+  ])
+  assert names(router.route(SmartRESTMessage('s/ds', '510', ['device']))) == ['Restart']
+  assert names(router.route(SmartRESTMessage('s/ds', '511', ['device', 'ls']))) == ['Command']
+  assert router.route(SmartRESTMessage('s/ds', '999', [])) == []
+
+
+def test_topic_is_part_of_the_route():
+  router = MessageRouter([make_listener('Restart', [('s/ds', '510')])])
+  assert router.route(SmartRESTMessage('s/dc/template', '510', [])) == []
+
+
+def test_undeclared_listeners_receive_every_message():
+  router = MessageRouter([
+    make_listener('Legacy', None),
+    make_listener('Restart', [('s/ds', '510')]),
+  ])
+  assert names(router.route(SmartRESTMessage('s/ds', '510', []))) == ['Restart', 'Legacy']
+  assert names(router.route(SmartRESTMessage('s/ds', '999', []))) == ['Legacy']
+
+
+def test_any_topic_route_is_called_once():
+  router = MessageRouter([
+    make_listener('Config', [('s/ds', '513'), (None, '513')]),
+    make_listener('Custom', [(None, '513')]),
+  ])
+  assert names(router.route(SmartRESTMessage('s/ds', '513', []))) == ['Config', 'Custom']
+  assert names(router.route(SmartRESTMessage('s/dc/template', '513', []))) == ['Config', 'Custom']
+  assert router.routes() == {('s/ds', '513'): ['Config'], (None, '513'): ['Config', 'Custom']}
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from c8ydm.framework.scheduler import Scheduler
+
+
+class InlinePool:
+
+  def __init__(self):
+    self.accept = True
+
+  def submit(self, fn, *args, name=None):
+    if not self.accept:
+      return False
+    fn(*args)
+    return True
+
+
+def run_in_thread(scheduler):
+  thread = threading.Thread(target=scheduler.run, daemon=True)
+  thread.start()
+  return thread
+
+
+def test_stop_before_run_is_not_lost():
+  scheduler = Scheduler(InlinePool())
+  scheduler.add_job('job', lambda: None, 0.01)
+  scheduler.stop()
+  thread = run_in_thread(scheduler)
+  thread.join(1)
+  assert not thread.is_alive()
+
+
+def test_stop_ends_a_running_loop():
+  scheduler = Scheduler(InlinePool())
+  thread = run_in_thread(scheduler)
+  time.sleep(0.05)
+  scheduler.stop()
+  thread.join(1)
+  assert not thread.is_alive()
+
+
+def test_jobs_fire_in_deadline_order():
+  fired = []
+  scheduler = Scheduler(InlinePool())
+  scheduler.add_job('late', lambda: fired.append('late'), 10, delay=0.15)
+  scheduler.add_job('early', lambda: fired.append('early'), 10, delay=0.05)
+  scheduler.add_job('now', lambda: fired.append('now'), 10)
+  thread = run_in_thread(scheduler)
+  time.sleep(0.3)
+  scheduler.stop()
+  thread.join(1)
+  assert fired == ['now', 'early', 'late']
+
+
+def test_deadlines_do_not_drift():
+  scheduler = Scheduler(InlinePool())
+  job = scheduler.add_job('slow', lambda: time.sleep(0.03), 0.05)
+  start = job.deadline
+  thread = run_in_thread(scheduler)
+  time.sleep(0.28)
+  scheduler.stop()
+  thread.join(1)
+  # The job takes 30 ms of every 50 ms cycle, finish times do not delay the next deadline
+  assert job.runs >= 4
+  assert abs(job.deadline - (start + job.runs * 0.05)) < 1e-6
+
+
+def test_missed_deadlines_are_counted():
+  now = [100.0]
+  scheduler = Scheduler(InlinePool(), clock=lambda: now[0])
+  job = scheduler.add_job('job', lambda: None, 10)
+  now[0] += 35
+  scheduler._fire(job)
+  assert job.runs == 1
+  assert job.missed == 3
+  assert job.deadline == 140.0
+
+
+def test_rejected_job_is_skipped():
+  pool = InlinePool()
+  pool.accept = False
+  scheduler = Scheduler(pool)
+  job = scheduler.add_job('job', lambda: None, 10)
+  scheduler._fire(job)
+  assert job.runs == 0
+  assert job.skipped == 1
+  assert not job.running
+
+
+def test_removed_job_does_not_fire():
+  fired = []
+  scheduler = Scheduler(InlinePool())
+  scheduler.add_job('job', lambda: fired.append(1), 10, delay=0.05)
+  scheduler.remove_job('job')
+  thread = run_in_thread(scheduler)
+  time.sleep(0.1)
+  scheduler.stop()
+  thread.join(1)
+  assert fired == []
+  assert scheduler.stats() == {}
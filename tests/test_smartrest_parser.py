@@ -0,0 +1,67 @@
+from c8ydm.framework.smartrest import SmartRESTMessage, SmartRESTParser
+
+
+def rows(messages):
+  return [[message.messageId] + message.values for message in messages]
+
+
+def test_plain_payload():
+  messages = SmartRESTParser.parse('s/ds', '511,device,show uptime')
+  assert rows(messages) == [['511', 'device', 'show uptime']]
+  assert messages[0].topic == 's/ds'
+
+
+def test_quoted_values_are_unquoted():
+  payload = '511,device,"echo ""hello, world"" && ls"'
+  assert rows(SmartRESTParser.parse('s/ds', payload)) == [['511', 'device', 'echo "hello, world" && ls']]
+
+
+def test_quoted_value_spanning_lines():
+  payload = '513,device,"key1=a\nkey2=b"\n511,device,ls'
+  assert rows(SmartRESTParser.parse('s/ds', payload)) == [
+    ['513', 'device', 'key1=a\nkey2=b'], ['511', 'device', 'ls']]
+
+
+def test_one_message_per_line():
+  payload = '528,device,pkgA,1.0,,install\r\n528,device,pkgB,2.0,,delete\n\n'
+  assert rows(SmartRESTParser.parse('s/ds', payload)) == [
+    ['528', 'device', 'pkgA', '1.0', '', 'install'], ['528', 'device', 'pkgB', '2.0', '', 'delete']]
+
+
+def test_empty_values_are_kept():
+  assert rows(SmartRESTParser.parse('s/ds', '528,device,"",,x')) == [['528', 'device', '', '', 'x']]
+
+
+def test_unterminated_quote_keeps_the_rest_of_the_payload():
+  assert rows(SmartRESTParser.parse('s/ds', '511,device,"ls, -la')) == [['511', 'device', 'ls, -la']]
+
+
+def test_stray_characters_are_kept():
+  assert rows(SmartRESTParser.parse('s/ds', '511,device,"ls"x,a"b')) == [['511', 'device', 'lsx', 'a"b']]
+
+
+def test_feed_keeps_incomplete_lines_until_complete():
+  parser = SmartRESTParser('s/ds')
+  assert parser.feed('511,dev') == []
+  assert rows(parser.feed('ice,ls\n511,device,p')) == [['511', 'device', 'ls']]
+  assert rows(parser.feed('s\n')) == [['511', 'device', 'ps']]
+  assert parser.close() == []
+
+
+def test_feed_waits_for_the_closing_quote():
+  parser = SmartRESTParser('s/ds')
+  assert parser.feed('513,device,"a=1\n') == []
+  assert parser.feed('b=2') == []
+  assert rows(parser.feed('"\n')) == [['513', 'device', 'a=1\nb=2']]
+
+
+def test_close_returns_the_last_line_without_newline():
+  parser = SmartRESTParser('s/ds')
+  assert parser.feed('511,device,ls') == []
+  assert rows(parser.close()) == [['511', 'device', 'ls']]
+
+
+def test_parsed_message_is_serialized_back():
+  payload = '511,device,"echo ""hello, world"""'
+  message = SmartRESTParser.parse('s/ds', payload)[0]
+  assert SmartRESTMessage('s/us', message.messageId, message.values).getMessage() == payload
@@ -0,0 +1,143 @@
+import importlib
+import json
+import sys
+import threading
+import time
+
+from c8ydm.framework.dispatcher import WorkerPool
+from c8ydm.framework.startup import ImportTimer, StartupGraph, StartupTrace
+
+
+class Clock:
+
+  def __init__(self, now=1000.0):
+    self.now = now
+
+  def __call__(self):
+    return self.now
+
+
+def make_initializer(name, dependencies=(), priority=0, duration=0):
+  def getDependencies(self):
+    return list(dependencies)
+
+  def getPriority(self):
+    return priority
+
+  return type(name, (), {
+    'getDependencies': getDependencies,
+    'getPriority': getPriority,
+    'duration': duration,
+  })()
+
+
+def run_graph(initializers, budget=None, workers=4):
+  ran = []
+  lock = threading.Lock()
+
+  def run(initializer):
+    time.sleep(initializer.duration)
+    with lock:
+      ran.append(initializer.__class__.__name__)
+
+  pool = WorkerPool('Test', workers=workers, queue_size=max(1, len(initializers)))
+  graph = StartupGraph(initializers, run, pool)
+  completed = graph.run(budget)
+  graph.close()
+  return graph, pool, ran, completed
+
+
+def test_dependencies_run_first():
+  graph, pool, ran, completed = run_graph([
+    make_initializer('C', ['B']),
+    make_initializer('B', ['A']),
+    make_initializer('A'),
+  ])
+  assert completed
+  assert ran == ['A', 'B', 'C']
+
+
+def test_dependents_run_after_budget_exceeded():
+  graph, pool, ran, completed = run_graph([
+    make_initializer('A', duration=0.5),
+    make_initializer('B', ['A']),
+  ], budget=0.1)
+  assert not completed
+  assert graph.pending() == ['A', 'B']
+  deadline = time.monotonic() + 5
+  while graph.pending() and time.monotonic() < deadline:
+    time.sleep(0.05)
+  assert ran == ['A', 'B']
+  assert pool.stats()['dropped'] == 0
+  assert pool.submit(lambda: None) is False
+
+
+def test_cycle_members_wait_for_their_other_dependencies():
+  graph, pool, ran, completed = run_graph([
+    make_initializer('A', duration=0.2),
+    make_initializer('B', ['A', 'C']),
+    make_initializer('C', ['B']),
+    make_initializer('E', ['B']),
+  ])
+  assert completed
+  assert sorted(ran) == ['A', 'B', 'C', 'E']
+  # B only skips waiting for C, E is not part of the cycle
+  assert ran.index('A') < ran.index('B') < ran.index('E')
+
+
+def test_trace_keeps_the_first_run_of_a_phase():
+  clock = Clock()
+  trace = StartupTrace(origin=990.0, clock=clock)
+  trace.begin('connect')
+  clock.now += 2
+  trace.end('connect')
+  # A reconnect repeats the phase
+  trace.begin('connect')
+  clock.now += 5
+  trace.end('connect')
+  with trace.phase('Restart', 'initializers'):
+    clock.now += 1
+  trace.begin('pending')
+  assert trace.durations() == {'connect': 2}
+  assert trace.durations('initializers') == {'Restart': 1}
+  report = trace.report()
+  assert report['phases'] == [{'name': 'connect', 'start': 10.0, 'duration': 2},
+                              {'name': 'pending', 'start': 18.0, 'duration': None}]
+
+
+def test_finish_writes_the_report_once_ready(tmp_path):
+  clock = Clock()
+  path = str(tmp_path / 'startup-trace.json')
+  trace = StartupTrace(origin=995.0, path=path, clock=clock)
+  trace.add('imports', 995.0, 1.5)
+  assert trace.finish() == 5.0
+  clock.now += 10
+  assert trace.finish() == 5.0
+  with open(path) as file:
+    report = json.load(file)
+  assert report == {'ready': 5.0, 'phases': [{'name': 'imports', 'start': 0.0, 'duration': 1.5}]}
+
+
+def test_import_timer_separates_own_and_cumulative_time():
+  clock = Clock()
+  timer = ImportTimer(clock=clock)
+  with timer.measure('outer'):
+    clock.now += 1
+    with timer.measure('inner'):
+      clock.now += 2
+  assert timer.report() == [{'module': 'outer', 'self': 1, 'cumulative': 3},
+                            {'module': 'inner', 'self': 2, 'cumulative': 2}]
+
+
+def test_import_timer_records_imported_modules(tmp_path, monkeypatch):
+  (tmp_path / 'timedmodule.py').write_text('import json\nVALUE = 1\n')
+  monkeypatch.syspath_prepend(str(tmp_path))
+  timer = ImportTimer()
+  timer.install()
+  try:
+    assert importlib.import_module('timedmodule').VALUE == 1
+  finally:
+    timer.uninstall()
+    sys.modules.pop('timedmodule', None)
+  assert timer not in sys.meta_path
+  assert [entry['module'] for entry in timer.report()] == ['timedmodule']
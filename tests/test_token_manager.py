@@ -0,0 +1,74 @@
+import base64
+import json
+import threading
+
+from c8ydm.client.token_manager import TokenManager
+
+
+class Clock:
+
+  def __init__(self, now=1000.0):
+    self.now = now
+
+  def __call__(self):
+    return self.now
+
+
+def make_token(claims):
+  payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip('=')
+  return f'header.{payload}.signature'
+
+
+def make_manager(clock):
+  requests = []
+  manager = TokenManager(lambda: requests.append(clock()), refresh_margin=60, retry_interval=60, clock=clock)
+  return manager, requests
+
+
+def test_refresh_before_expiry():
+  clock = Clock()
+  manager, requests = make_manager(clock)
+  manager.update(make_token({'exp': clock() + 3600}))
+  assert manager.poll() == 3540
+  assert requests == []
+  clock.now += 3540
+  manager.poll()
+  assert requests == [clock.now]
+
+
+def test_token_without_exp_is_refreshed_after_retry_interval():
+  clock = Clock()
+  manager, requests = make_manager(clock)
+  manager.update(make_token({'sub': 'device'}))
+  assert manager.get_token() is not None
+  for _ in range(100):
+    assert manager.poll() == 60
+  assert requests == []
+  clock.now += 60
+  manager.poll()
+  assert requests == [clock.now]
+
+
+def test_malformed_token_is_refreshed_after_retry_interval():
+  clock = Clock()
+  manager, requests = make_manager(clock)
+  manager.update('not-a-jwt')
+  assert TokenManager.decode_expiry('not-a-jwt') is None
+  assert manager.poll() == 60
+  assert requests == []
+  clock.now += 30
+  assert manager.poll() == 30
+  clock.now += 30
+  manager.poll()
+  assert len(requests) == 1
+
+
+def test_stop_before_run_is_not_lost():
+  clock = Clock()
+  manager, requests = make_manager(clock)
+  manager.stop()
+  thread = threading.Thread(target=manager.run, daemon=True)
+  thread.start()
+  thread.join(1)
+  assert not thread.is_alive()
+  assert requests == []
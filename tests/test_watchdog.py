@@ -0,0 +1,80 @@
+import threading
+
+from c8ydm.framework.dispatcher import WorkerPool
+from c8ydm.framework.watchdog import Watchdog
+
+
+class Clock:
+
+  def __init__(self, now=1000.0):
+    self.now = now
+
+  def __call__(self):
+    return self.now
+
+
+def hang_in_listener(running, release):
+  running.set()
+  release.wait(5)
+
+
+def test_stuck_task_is_reported_once_with_its_stack():
+  clock = Clock()
+  reported = []
+  recovered = []
+  watchdog = Watchdog(budget=60, clock=clock, on_stuck=lambda task, stack: reported.append((task, stack)),
+                      on_recovered=recovered.append)
+  pool = WorkerPool('ListenerThread', workers=1, watchdog=watchdog)
+  running, release = threading.Event(), threading.Event()
+  pool.submit(hang_in_listener, running, release, name='device/Restart')
+  assert running.wait(5)
+  clock.now += 30
+  assert watchdog.check() == []
+  clock.now += 31
+  assert [task.name for task in watchdog.check()] == ['device/Restart']
+  assert watchdog.check() == []
+  task, stack = reported[0]
+  assert task.pool == 'ListenerThread'
+  assert 'hang_in_listener' in stack
+  assert task.location.endswith('in wait')
+  assert watchdog.stuck('device/') == [task]
+  release.set()
+  assert pool.join(5)
+  assert recovered == [task]
+  assert watchdog.stuck() == []
+  assert watchdog.stats()['recovered_total'] == 1
+
+
+def test_task_budget_overrides_the_default():
+  clock = Clock()
+  watchdog = Watchdog(budget=60, clock=clock)
+  short = watchdog.begin('Pool', 'short', budget=5)
+  default = watchdog.begin('Pool', 'default')
+  clock.now += 10
+  assert watchdog.check() == [short]
+  watchdog.end(short)
+  watchdog.end(default)
+  assert watchdog.stats()['running'] == 0
+
+
+def test_stats_by_pool_and_age():
+  clock = Clock()
+  watchdog = Watchdog(budget=60, clock=clock)
+  watchdog.begin('ListenerThread', 'a')
+  clock.now += 100
+  watchdog.begin('SensorThread', 'b')
+  watchdog.check()
+  stats = watchdog.stats()
+  assert stats['pools'] == {'ListenerThread': {'running': 1, 'stuck': 1}, 'SensorThread': {'running': 1, 'stuck': 0}}
+  assert stats['oldest_age_seconds'] == 100
+  assert stats['task_age_seconds']['buckets'][1] == 1
+  assert stats['task_age_seconds']['buckets'][300] == 2
+
+
+def test_failing_callback_does_not_stop_the_check():
+  clock = Clock()
+  watchdog = Watchdog(budget=1, clock=clock, on_stuck=lambda task, stack: 1 / 0)
+  watchdog.begin('Pool', 'a')
+  watchdog.begin('Pool', 'b')
+  clock.now += 2
+  assert sorted(task.name for task in watchdog.check()) == ['a', 'b']